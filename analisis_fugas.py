@@ -0,0 +1,322 @@
+"""
+ANÁLISIS DE FUGAS - MOTOR EN PROCESO
+Analiza cada paquete a medida que se ingiere, sin esperar a la Raspberry Pi.
+
+Métodos (todos sobre las estaciones de ambas tarjetas ordenadas por posición):
+    - Balance de flujos: media móvil de cada caudalímetro; una pérdida de
+      caudal entre dos estaciones consecutivas indica fuga en ese tramo.
+    - Gradiente de presión: intersección de las líneas piezométricas
+      ajustadas aguas arriba y aguas abajo del tramo con fuga.
+    - Onda de presión negativa: instante de la caída brusca en las dos
+      estaciones que rodean la fuga -> x = (xa + xb - v * (tb - ta)) / 2.
+    - Correlación cruzada: retardo entre la presión de la primera estación
+      de la línea y la de la última (tarjetas de los extremos) con la misma
+      fórmula.
+
+Los instantes se estiman por debajo del periodo de muestreo (100 ms son
+100 m de onda): el cruce del umbral se interpola entre las dos muestras que
+lo rodean y el pico de la correlación con una parábola.
+
+Las funciones de cada método son puras (arreglos NumPy de entrada, números
+de salida) para poder probarlas con fugas sintéticas. MotorAnalisis las
+combina en un hilo propio para no bloquear la ingesta.
+"""
+
+import logging
+import queue
+import threading
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+from buffer_circular import SEGUNDOS_DIA
+
+log = logging.getLogger(__name__)
+
+
+class ConfiguracionTuberia:
+    """Geometría y umbrales del análisis"""
+
+    def __init__(self, posiciones=None, velocidad_onda=1000.0, factor_presion=2.0,
+                 umbral_balance=0.05, umbral_caida=0.5, ventana=10, correlacion_minima=0.5):
+        # Posición (m) de las estaciones de cada tarjeta a lo largo de la línea; una
+        # tarjeta con n estaciones trae n caudales (columnas 1..n) y n presiones detrás
+        if posiciones is None:
+            posiciones = {1: np.arange(0, 600, 100.0), 2: np.arange(600, 1200, 100.0)}
+        self.posiciones = {t: np.asarray(p, dtype=np.float64) for t, p in posiciones.items()}
+        self.velocidad_onda = velocidad_onda        # m/s
+        self.factor_presion = factor_presion        # lectura -> m.c.a (número o {tarjeta: factor})
+        self.umbral_balance = umbral_balance        # pérdida relativa de caudal
+        self.umbral_caida = umbral_caida            # m.c.a bajo la línea base
+        self.ventana = ventana                      # paquetes en la media móvil
+        self.correlacion_minima = correlacion_minima
+
+    @classmethod
+    def desde_registro(cls, tarjetas, **opciones):
+        """Configuración con las estaciones y factores de un RegistroTarjetas"""
+        return cls(posiciones=tarjetas.posiciones(), factor_presion=tarjetas.factores_presion(), **opciones)
+
+    def factor(self, tarjeta_id):
+        if isinstance(self.factor_presion, dict):
+            return self.factor_presion[tarjeta_id]
+        return self.factor_presion
+
+    def columnas(self, tarjeta_id):
+        """(columnas de flujo, columnas de presión) de los paquetes de la tarjeta"""
+        n = len(self.posiciones[tarjeta_id])
+        return slice(1, 1 + n), slice(1 + n, 1 + 2 * n)
+
+
+# ----------------------------------------------------------------------
+# Métodos
+# ----------------------------------------------------------------------
+
+def balance_flujos(flujos, umbral):
+    """Tramo (i, i+1) con mayor pérdida de caudal, o None si ninguno supera `umbral`.
+
+    `flujos`: caudal medio por estación ordenado aguas abajo.
+    Devuelve (tramo, pérdida relativa).
+    """
+    flujos = np.asarray(flujos, dtype=np.float64)
+    referencia = np.abs(flujos).mean()
+    if len(flujos) < 2 or referencia == 0:
+        return None, 0.0
+    perdidas = (flujos[:-1] - flujos[1:]) / referencia
+    tramo = int(np.argmax(perdidas))
+    if perdidas[tramo] <= umbral:
+        return None, float(perdidas[tramo])
+    return tramo, float(perdidas[tramo])
+
+
+def localizar_por_gradiente(presiones, posiciones, tramo):
+    """Intersección de las rectas piezométricas a cada lado del tramo con fuga"""
+    presiones = np.asarray(presiones, dtype=np.float64)
+    posiciones = np.asarray(posiciones, dtype=np.float64)
+    xa, xb = posiciones[tramo], posiciones[tramo + 1]
+    arriba, abajo = slice(0, tramo + 1), slice(tramo + 1, None)
+    if tramo + 1 < 2 or len(posiciones) - tramo - 1 < 2:
+        return float((xa + xb) / 2)
+    b1, a1 = np.polyfit(posiciones[arriba], presiones[arriba], 1)
+    b2, a2 = np.polyfit(posiciones[abajo], presiones[abajo], 1)
+    if np.isclose(b1, b2):
+        return float((xa + xb) / 2)
+    return float(np.clip((a2 - a1) / (b1 - b2), xa, xb))
+
+
+def inicio_caida(presion, linea_base, umbral):
+    """Índice de la primera muestra que cae más de `umbral` bajo la línea base, o None"""
+    debajo = np.flatnonzero(np.asarray(presion) < linea_base - umbral)
+    return int(debajo[0]) if len(debajo) else None
+
+
+def instante_cruce(tiempos, presion, k, nivel):
+    """Instante en que la presión cruza `nivel` entre las muestras k-1 y k (interpolación lineal)"""
+    antes, despues = float(presion[k - 1]), float(presion[k])
+    if antes <= despues:
+        return float(tiempos[k])
+    fraccion = (antes - nivel) / (antes - despues)
+    return float(tiempos[k - 1] + fraccion * (tiempos[k] - tiempos[k - 1]))
+
+
+def localizar_por_tiempos(xa, xb, ta, tb, velocidad):
+    """Posición de la fuga entre dos sensores a partir de los tiempos de llegada (s)"""
+    return float(np.clip((xa + xb - velocidad * (tb - ta)) / 2, min(xa, xb), max(xa, xb)))
+
+
+def retardo_correlacion(a, b, periodo, retardo_maximo):
+    """Retardo (s) de `b` respecto de `a` por correlación cruzada y su coeficiente normalizado.
+
+    Se correlacionan las diferencias entre muestras: un escalón de presión
+    pasa a ser un pulso y el pico no se desplaza hacia el retardo 0 como
+    con la señal entera en una ventana finita.
+    """
+    a = np.diff(np.asarray(a, dtype=np.float64))
+    b = np.diff(np.asarray(b, dtype=np.float64))
+    if not len(a) or not len(b):
+        return 0.0, 0.0
+    a -= a.mean()
+    b -= b.mean()
+    norma = np.sqrt(np.dot(a, a) * np.dot(b, b))
+    if norma == 0:
+        return 0.0, 0.0
+    n = len(a) + len(b) - 1
+    tam = 1 << (n - 1).bit_length()
+    correlacion = np.fft.irfft(np.fft.rfft(b, tam) * np.conj(np.fft.rfft(a, tam)), tam)
+    # Retardos 0..len(b)-1 al principio y negativos al final
+    retardos = np.concatenate([np.arange(len(b)), np.arange(-(len(a) - 1), 0)])
+    valores = np.concatenate([correlacion[:len(b)], correlacion[tam - (len(a) - 1):]])
+    max_muestras = int(retardo_maximo / periodo)
+    dentro = np.abs(retardos) <= max_muestras
+    retardos, valores = retardos[dentro], valores[dentro]
+    orden = np.argsort(retardos)
+    retardos, valores = retardos[orden], valores[orden]
+    k = int(np.argmax(valores))
+    retardo = float(retardos[k])
+    if 0 < k < len(valores) - 1:
+        # Vértice de la parábola por el pico y sus vecinos
+        izquierda, centro, derecha = valores[k - 1], valores[k], valores[k + 1]
+        curvatura = izquierda - 2 * centro + derecha
+        if curvatura < 0:
+            retardo += 0.5 * (izquierda - derecha) / curvatura
+    return retardo * periodo, float(valores[k] / norma)
+
+
+# ----------------------------------------------------------------------
+# Motor
+# ----------------------------------------------------------------------
+
+class MotorAnalisis:
+    """Consume paquetes de forma incremental y mantiene el resultado del análisis"""
+
+    def __init__(self, configuracion=None, al_actualizar=None, tam_cola=256):
+        self.config = configuracion or ConfiguracionTuberia()
+        self.al_actualizar = al_actualizar
+        self.descartados = 0
+        self.resultado = None
+        self._cola = queue.Queue(maxsize=tam_cola)
+        self._hilo = None
+        # Por tarjeta: medias por paquete y último paquete con su tiempo absoluto (ms)
+        self._medias = {t: deque(maxlen=self.config.ventana) for t in self.config.posiciones}
+        self._ultimo = {}
+        # Caídas de presión recientes: (tarjeta, estación) -> instante (s)
+        self._caidas = {}
+        # Inicio del último paquete en tiempo continuo (s): la hora de la placa vuelve a 0 a medianoche
+        self._referencia = None
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name='analisis', daemon=True)
+            self._hilo.start()
+
+    def procesar(self, tarjeta_id, hora, muestras):
+        """Encola un paquete (copia) sin bloquear; si la cola está llena se descarta"""
+        if tarjeta_id not in self.config.posiciones:
+            return
+        try:
+            self._cola.put_nowait((tarjeta_id, hora, np.array(muestras, dtype=np.float64)))
+        except queue.Full:
+            self.descartados += 1
+
+    def esperar(self):
+        """Bloquea hasta analizar todo lo encolado"""
+        self._cola.join()
+
+    def _bucle(self):
+        while True:
+            tarjeta_id, hora, muestras = self._cola.get()
+            try:
+                resultado = self.analizar_paquete(tarjeta_id, hora, muestras)
+                if self.al_actualizar:
+                    self.al_actualizar(resultado)
+            except Exception as e:
+                log.exception("Error en análisis: %s", e)
+            finally:
+                self._cola.task_done()
+
+    def analizar_paquete(self, tarjeta_id, hora, muestras):
+        """Incorpora un paquete (segundos del día, arreglo muestras x columnas) y recalcula"""
+        cfg = self.config
+        col_flujos, col_presiones = cfg.columnas(tarjeta_id)
+        tiempos = self._tiempo_continuo(hora) + muestras[:, 0] / 1000.0
+        presiones = muestras[:, col_presiones] * cfg.factor(tarjeta_id)
+
+        previas = self._medias[tarjeta_id]
+        if previas:
+            self._detectar_caidas(tarjeta_id, tiempos, presiones, np.mean([m[1] for m in previas], axis=0))
+        previas.append((muestras[:, col_flujos].mean(axis=0), presiones.mean(axis=0)))
+        self._ultimo[tarjeta_id] = (tiempos, presiones)
+
+        tarjetas = [t for t in sorted(cfg.posiciones) if self._medias[t]]
+        posiciones = np.concatenate([cfg.posiciones[t] for t in tarjetas])
+        flujos = np.concatenate([np.mean([m[0] for m in self._medias[t]], axis=0) for t in tarjetas])
+        presiones_medias = np.concatenate([np.mean([m[1] for m in self._medias[t]], axis=0) for t in tarjetas])
+        orden = np.argsort(posiciones)
+        posiciones, flujos, presiones_medias = posiciones[orden], flujos[orden], presiones_medias[orden]
+
+        tramo, perdida = balance_flujos(flujos, cfg.umbral_balance)
+        detalle = {'perdida_relativa': round(perdida, 4)}
+        posicion, metodo = None, None
+
+        onda = self._localizar_onda()
+        if onda is not None:
+            posicion, metodo = onda, 'onda_negativa'
+        elif tramo is not None:
+            correlacion = self._localizar_correlacion()
+            if correlacion is not None:
+                posicion, metodo = correlacion, 'correlacion'
+            else:
+                posicion, metodo = localizar_por_gradiente(presiones_medias, posiciones, tramo), 'gradiente'
+            detalle['tramo'] = [float(posiciones[tramo]), float(posiciones[tramo + 1])]
+
+        self.resultado = {
+            'alarma_fuga': 'FUGA DETECTADA' if posicion is not None else 'NO DETECTADA',
+            'posicion_fuga': round(posicion, 1) if posicion is not None else 0.0,
+            'ultima_actualizacion': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'metodo': metodo,
+            'detalle': detalle
+        }
+        return self.resultado
+
+    def _tiempo_continuo(self, hora):
+        """Segundos del día -> escala sin saltos: el día que deja la hora más cerca del paquete
+        anterior (como tiempo_placa con la llegada), así que 00:00:05 sigue a 23:59:50"""
+        if self._referencia is None:
+            tiempo = float(hora)
+        else:
+            tiempo = self._referencia + (hora - self._referencia + SEGUNDOS_DIA / 2) % SEGUNDOS_DIA - SEGUNDOS_DIA / 2
+        self._referencia = tiempo
+        return tiempo
+
+    def _detectar_caidas(self, tarjeta_id, tiempos, presiones, linea_base):
+        """Registra el instante de caída brusca en cada estación de la tarjeta"""
+        cfg = self.config
+        # Una onda recorre la línea entera en este tiempo; lo anterior ya no es del mismo evento
+        todas = np.concatenate(list(cfg.posiciones.values()))
+        vigencia = (todas.max() - todas.min()) / cfg.velocidad_onda + (tiempos[-1] - tiempos[0])
+        for clave, instante in list(self._caidas.items()):
+            if tiempos[-1] - instante > vigencia:
+                del self._caidas[clave]
+        for estacion in range(presiones.shape[1]):
+            nivel = linea_base[estacion] - cfg.umbral_caida
+            k = inicio_caida(presiones[:, estacion], linea_base[estacion], cfg.umbral_caida)
+            # k == 0: el paquete ya empieza por debajo, es un nivel sostenido y no un frente
+            if k and (tarjeta_id, estacion) not in self._caidas:
+                self._caidas[(tarjeta_id, estacion)] = instante_cruce(tiempos, presiones[:, estacion], k, nivel)
+
+    def _localizar_onda(self):
+        """Fuga entre la estación que vio primero la caída y su vecina que también la vio"""
+        if len(self._caidas) < 2:
+            return None
+        cfg = self.config
+        estaciones = sorted(self._caidas, key=lambda c: cfg.posiciones[c[0]][c[1]])
+        x = np.array([cfg.posiciones[t][e] for t, e in estaciones])
+        t = np.array([self._caidas[c] for c in estaciones])
+        k = int(np.argmin(t))
+        vecinas = [j for j in (k - 1, k + 1) if 0 <= j < len(x)]
+        j = min(vecinas, key=lambda j: t[j])
+        a, b = sorted((k, j))
+        return localizar_por_tiempos(x[a], x[b], t[a], t[b], cfg.velocidad_onda)
+
+    def _localizar_correlacion(self):
+        """Correlación entre la primera estación de la línea y la última"""
+        cfg = self.config
+        primera = min(cfg.posiciones, key=lambda t: cfg.posiciones[t].min())
+        ultima = max(cfg.posiciones, key=lambda t: cfg.posiciones[t].max())
+        if primera == ultima or primera not in self._ultimo or ultima not in self._ultimo:
+            return None
+        tiempos_a, presiones_a = self._ultimo[primera]
+        tiempos_b, presiones_b = self._ultimo[ultima]
+        inicio, fin = max(tiempos_a[0], tiempos_b[0]), min(tiempos_a[-1], tiempos_b[-1])
+        comunes = (tiempos_a >= inicio) & (tiempos_a <= fin)
+        if comunes.sum() < 8:
+            return None
+        malla = tiempos_a[comunes]
+        a = presiones_a[comunes, np.argmin(cfg.posiciones[primera])]
+        b = np.interp(malla, tiempos_b, presiones_b[:, np.argmax(cfg.posiciones[ultima])])
+        xa, xb = cfg.posiciones[primera].min(), cfg.posiciones[ultima].max()
+        periodo = float(np.median(np.diff(malla)))
+        retardo, coeficiente = retardo_correlacion(a, b, periodo, abs(xb - xa) / cfg.velocidad_onda)
+        if coeficiente < cfg.correlacion_minima:
+            return None
+        return localizar_por_tiempos(xa, xb, 0.0, retardo, cfg.velocidad_onda)
@@ -0,0 +1,336 @@
+"""
+ARCHIVO HISTÓRICO - SERIES DE LARGO PLAZO EN DISCO
+Los buffers solo retienen los últimos paquetes; este archivo guarda todo lo
+recibido para poder revisar transitorios de hace horas o meses.
+
+Estructura por tarjeta (tarjetaN/):
+    crudo/AAAAMMDD/*.npz   bloques comprimidos por columnas: desplazamiento en
+                           ms de cada muestra y un vector por canal; el nombre
+                           lleva la primera y la última muestra (ms), el pid y
+                           un contador, y nunca se sobrescribe uno existente
+    1s/AAAAMMDD.bin        resúmenes por segundo, un archivo por día
+    1min/AAAAMM.bin        resúmenes por minuto, un archivo por mes
+    1h/AAAA.bin            resúmenes por hora, un archivo por año
+
+Las muestras se fechan con la hora de la placa, no con la de llegada: los
+paquetes de un mismo lote o reintentados quedan en su sitio.
+
+Un resumen es un registro de tamaño fijo con mínimo, suma, máximo y cuenta
+por canal (el número de canales es el de la tarjeta). Guardar suma y cuenta en lugar de la media permite fusionar al
+leer las cubetas repetidas (varios workers, paquetes desordenados), así que
+cada proceso solo anexa y nunca reescribe.
+
+Las consultas eligen el nivel más fino cuyo número de puntos cabe en el
+presupuesto: un año se responde con ~9000 registros de 1 h sin leer crudos.
+"""
+
+import fcntl
+import itertools
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+NUM_CANALES = 12
+
+# (ancho de cubeta en s, carpeta, partición de archivos)
+NIVELES = ((1, '1s', '%Y%m%d'), (60, '1min', '%Y%m'), (3600, '1h', '%Y'))
+
+
+def tipo_resumen(canales):
+    """dtype de un registro de resumen con `canales` canales"""
+    return np.dtype([
+        ('inicio', '<i8'),
+        ('cuenta', '<u4'),
+        ('minimo', '<f4', (canales,)),
+        ('suma', '<f8', (canales,)),
+        ('maximo', '<f4', (canales,)),
+    ])
+
+
+RESUMEN = tipo_resumen(NUM_CANALES)
+
+# Un bloque crudo se escribe cada PAQUETES_POR_BLOQUE paquetes o SEGUNDOS_POR_BLOQUE s desde el primero
+PAQUETES_POR_BLOQUE = 120
+SEGUNDOS_POR_BLOQUE = 10.0
+# Los resúmenes cerrados se anexan a disco como mucho cada INTERVALO_VOLCADO s
+INTERVALO_VOLCADO = 1.0
+# Margen para muestras que llegan tarde (duración de un paquete) antes de cerrar una cubeta
+MARGEN_CIERRE = 5.0
+
+
+def tiempos_muestras(inicio, muestras):
+    """Hora epoch (s) de cada muestra: `inicio` es la hora de la placa de la primera"""
+    ms = muestras[:, 0].astype(np.float64)
+    return inicio + (ms - ms[0]) / 1000.0
+
+
+def _inicios_grupos(cubetas):
+    """Índices donde empieza cada tramo de valores iguales de un arreglo ordenado"""
+    cambios = np.empty(len(cubetas), dtype=bool)
+    cambios[0] = True
+    np.not_equal(cubetas[1:], cubetas[:-1], out=cambios[1:])
+    return np.flatnonzero(cambios)
+
+
+def resumir(tiempos, valores, ancho):
+    """Resúmenes en cubetas de `ancho` s de muestras ordenadas por tiempo"""
+    cubetas = np.floor_divide(tiempos, ancho).astype(np.int64) * ancho
+    inicios = _inicios_grupos(cubetas)
+    resumenes = np.empty(len(inicios), tipo_resumen(valores.shape[1]))
+    resumenes['inicio'] = cubetas[inicios]
+    resumenes['cuenta'] = np.diff(inicios, append=len(tiempos))
+    resumenes['minimo'] = np.minimum.reduceat(valores, inicios)
+    resumenes['suma'] = np.add.reduceat(valores, inicios, dtype=np.float64)
+    resumenes['maximo'] = np.maximum.reduceat(valores, inicios)
+    return resumenes
+
+
+def fusionar(resumenes, ancho):
+    """Une los resúmenes que caen en la misma cubeta de `ancho` s (resultado ordenado)"""
+    if not len(resumenes):
+        return resumenes
+    cubetas = resumenes['inicio'] // ancho * ancho
+    orden = np.argsort(cubetas, kind='stable')
+    resumenes, cubetas = resumenes[orden], cubetas[orden]
+    inicios = _inicios_grupos(cubetas)
+    fusionados = np.empty(len(inicios), resumenes.dtype)
+    fusionados['inicio'] = cubetas[inicios]
+    fusionados['cuenta'] = np.add.reduceat(resumenes['cuenta'], inicios)
+    fusionados['minimo'] = np.minimum.reduceat(resumenes['minimo'], inicios)
+    fusionados['suma'] = np.add.reduceat(resumenes['suma'], inicios)
+    fusionados['maximo'] = np.maximum.reduceat(resumenes['maximo'], inicios)
+    return fusionados
+
+
+def _leer_resumenes(ruta, tipo=RESUMEN):
+    """Registros completos de un archivo de resúmenes (mapeado, sin copiar)"""
+    try:
+        n = os.path.getsize(ruta) // tipo.itemsize
+    except OSError:
+        return None
+    if not n:
+        return None
+    return np.memmap(ruta, dtype=tipo, mode='r', shape=(n,))
+
+
+class ArchivoHistorico:
+    """Archivo en disco de todos los paquetes, con resúmenes a 1 s, 1 min y 1 h"""
+
+    def __init__(self, directorio, canales=None):
+        """`canales(tarjeta_id)` da el número de canales de cada tarjeta (por defecto NUM_CANALES)"""
+        if canales is None:
+            canales = lambda tarjeta_id: NUM_CANALES
+        self.directorio = directorio
+        self.canales = canales
+        self._lock = threading.Lock()
+        self._abiertos = {}   # (tarjeta, ancho) -> resumen de la cubeta en curso
+        self._cerrados = {}   # (tarjeta, ancho) -> resúmenes pendientes de anexar
+        self._crudo = {}      # tarjeta -> ([tiempos], [valores]) pendientes de bloque
+        self._inicio_crudo = {}   # tarjeta -> time.monotonic() del primer pendiente
+        self._bloques = itertools.count()
+        self._ultimo_volcado = time.monotonic()
+        os.makedirs(directorio, exist_ok=True)
+
+    def _carpeta(self, tarjeta_id, *partes):
+        return os.path.join(self.directorio, f"tarjeta{tarjeta_id}", *partes)
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+
+    def agregar(self, tarjeta_id, inicio, muestras):
+        """Archiva un paquete (muestras x (1 + canales)) que la placa empezó en `inicio` (epoch)"""
+        tiempos = tiempos_muestras(inicio, muestras)
+        valores = np.array(muestras[:, 1:], dtype=np.float32)
+        if np.any(tiempos[1:] < tiempos[:-1]):
+            orden = np.argsort(tiempos, kind='stable')
+            tiempos, valores = tiempos[orden], valores[orden]
+
+        with self._lock:
+            pendientes = self._crudo.setdefault(tarjeta_id, ([], []))
+            ahora = time.monotonic()
+            self._inicio_crudo.setdefault(tarjeta_id, ahora)
+            pendientes[0].append(tiempos)
+            pendientes[1].append(valores)
+            # Los niveles gruesos salen de los resúmenes de 1 s, no de las 200 muestras
+            por_segundo = resumir(tiempos, valores, NIVELES[0][0])
+            for ancho, _, _ in NIVELES:
+                self._acumular(tarjeta_id, ancho, por_segundo)
+
+            if (len(pendientes[0]) >= PAQUETES_POR_BLOQUE
+                    or ahora - self._inicio_crudo[tarjeta_id] >= SEGUNDOS_POR_BLOQUE):
+                self._volcar_crudo(tarjeta_id)
+            if ahora - self._ultimo_volcado >= INTERVALO_VOLCADO:
+                self._volcar_resumenes(time.time())
+
+    def _acumular(self, tarjeta_id, ancho, resumenes):
+        """La cubeta más reciente queda abierta; las anteriores pasan a cerradas"""
+        clave = (tarjeta_id, ancho)
+        abierto = self._abiertos.get(clave)
+        if abierto is not None:
+            resumenes = np.concatenate([abierto, resumenes])
+        resumenes = fusionar(resumenes, ancho)
+        if len(resumenes) > 1:
+            self._cerrados.setdefault(clave, []).append(resumenes[:-1])
+        self._abiertos[clave] = resumenes[-1:]
+
+    def _volcar_resumenes(self, ahora):
+        # Cubetas sin muestras nuevas desde hace un rato: se cierran aunque no llegue otra
+        for clave, abierto in list(self._abiertos.items()):
+            if abierto['inicio'][0] + clave[1] + MARGEN_CIERRE < ahora:
+                self._cerrados.setdefault(clave, []).append(abierto)
+                del self._abiertos[clave]
+
+        for (tarjeta_id, ancho), listas in self._cerrados.items():
+            if not listas:
+                continue
+            resumenes = np.concatenate(listas)
+            listas.clear()
+            _, carpeta, formato = next(nivel for nivel in NIVELES if nivel[0] == ancho)
+            nombres = np.array([time.strftime(formato, time.gmtime(inicio))
+                                for inicio in resumenes['inicio']])
+            for nombre in np.unique(nombres):
+                self._anexar(self._carpeta(tarjeta_id, carpeta), f"{nombre}.bin",
+                             resumenes[nombres == nombre])
+        self._ultimo_volcado = time.monotonic()
+
+    def _anexar(self, carpeta, nombre, resumenes):
+        os.makedirs(carpeta, exist_ok=True)
+        with open(os.path.join(carpeta, nombre), 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            sobrante = os.fstat(f.fileno()).st_size % resumenes.dtype.itemsize
+            if sobrante:
+                # Registro a medias de una caída: se descarta para no desalinear los siguientes
+                f.truncate(os.fstat(f.fileno()).st_size - sobrante)
+            f.write(resumenes.tobytes())
+
+    def _volcar_crudo(self, tarjeta_id):
+        tiempos, valores = self._crudo.pop(tarjeta_id, ([], []))
+        self._inicio_crudo.pop(tarjeta_id, None)
+        if not tiempos:
+            return
+        tiempos = np.concatenate(tiempos)
+        valores = np.concatenate(valores)
+        origen = float(tiempos.min())
+        carpeta = self._carpeta(tarjeta_id, 'crudo', time.strftime('%Y%m%d', time.gmtime(origen)))
+        os.makedirs(carpeta, exist_ok=True)
+        temporal = os.path.join(carpeta, f".{os.getpid()}.tmp")
+        with open(temporal, 'wb') as f:
+            # Columnar: los desplazamientos enteros y cada canal por separado comprimen mucho mejor
+            np.savez_compressed(f, origen=origen,
+                                desplazamiento_ms=np.round((tiempos - origen) * 1000).astype(np.uint32),
+                                valores=np.ascontiguousarray(valores.T))
+        # link() falla si el nombre ya existe (un pid reutilizado tras reiniciar): se prueba el siguiente
+        while True:
+            ruta = os.path.join(carpeta, f"{int(origen * 1000)}_{int(tiempos.max() * 1000)}_"
+                                         f"{os.getpid()}_{next(self._bloques)}.npz")
+            try:
+                os.link(temporal, ruta)
+                break
+            except FileExistsError:
+                continue
+        os.unlink(temporal)
+
+    def volcar(self, ahora=None):
+        """Escribe a disco los bloques crudos y resúmenes pendientes"""
+        with self._lock:
+            for tarjeta_id in list(self._crudo):
+                self._volcar_crudo(tarjeta_id)
+            self._volcar_resumenes(time.time() if ahora is None else ahora)
+
+    def cerrar(self):
+        """Cierra también las cubetas en curso (al terminar el proceso)"""
+        self.volcar(ahora=math.inf)
+
+    # ------------------------------------------------------------------
+    # Consulta
+    # ------------------------------------------------------------------
+
+    def _leer_nivel(self, tarjeta_id, indice, desde, hasta):
+        """Resúmenes fusionados del nivel `indice` con inicio en [desde, hasta]"""
+        ancho, carpeta, formato = NIVELES[indice]
+        tipo = tipo_resumen(self.canales(tarjeta_id))
+        desde = math.floor(desde / ancho) * ancho
+        # Cubetas que otros workers aún pueden tener abiertas: se rehacen desde el nivel fino
+        corte = math.floor((time.time() - MARGEN_CIERRE) / ancho) * ancho if indice else math.inf
+        nombres = sorted({time.strftime(formato, time.gmtime(dia * 86400))
+                          for dia in range(int(desde // 86400), int(hasta // 86400) + 1)})
+        partes = []
+        for nombre in nombres:
+            resumenes = _leer_resumenes(self._carpeta(tarjeta_id, carpeta, f"{nombre}.bin"), tipo)
+            if resumenes is None:
+                continue
+            inicio = resumenes['inicio']
+            partes.append(resumenes[(inicio >= desde) & (inicio <= hasta) & (inicio < corte)])
+        if corte <= hasta:
+            partes.append(self._leer_nivel(tarjeta_id, indice - 1, max(corte, desde), hasta))
+        if not partes:
+            return np.empty(0, tipo)
+        return fusionar(np.concatenate(partes), ancho)
+
+    def _leer_crudo(self, tarjeta_id, desde, hasta, pendientes):
+        tiempos, valores = [], []
+        # Lo que este proceso aún no ha escrito como bloque
+        for t, v in zip(*pendientes):
+            dentro = (t >= desde) & (t <= hasta)
+            tiempos.append(t[dentro])
+            valores.append(v[dentro])
+        # Un bloque se guarda en la carpeta del día de su primera muestra
+        for dia in range(int(desde // 86400) - 1, int(hasta // 86400) + 1):
+            carpeta = self._carpeta(tarjeta_id, 'crudo', time.strftime('%Y%m%d', time.gmtime(dia * 86400)))
+            try:
+                nombres = os.listdir(carpeta)
+            except OSError:
+                continue
+            for nombre in nombres:
+                if not nombre.endswith('.npz'):
+                    continue
+                inicio_ms, fin_ms = nombre[:-4].split('_')[:2]
+                if int(fin_ms) < desde * 1000 or int(inicio_ms) > hasta * 1000:
+                    continue
+                with np.load(os.path.join(carpeta, nombre)) as bloque:
+                    t = bloque['origen'] + bloque['desplazamiento_ms'] / 1000.0
+                    dentro = (t >= desde) & (t <= hasta)
+                    tiempos.append(t[dentro])
+                    valores.append(bloque['valores'].T[dentro])
+        if not tiempos:
+            return np.empty(0), np.empty((0, self.canales(tarjeta_id)), dtype=np.float32)
+        tiempos, valores = np.concatenate(tiempos), np.concatenate(valores)
+        orden = np.argsort(tiempos, kind='stable')
+        return tiempos[orden], valores[orden]
+
+    def consultar(self, tarjeta_id, desde, hasta, puntos=1000):
+        """Serie de la tarjeta entre `desde` y `hasta` (epoch s) con a lo sumo `puntos` puntos.
+
+        Devuelve un dict con 'nivel' ('crudo', '1s', '1min', '1h'), 'ancho' de
+        cubeta en s (0 para crudo), 'tiempo' y arreglos (puntos x canales)
+        'minimo', 'media' y 'maximo'. Si ni 1 h cabe, las horas se agrupan.
+        """
+        with self._lock:
+            self._volcar_resumenes(time.time())
+            pendientes = tuple(list(lista) for lista in self._crudo.get(tarjeta_id, ([], [])))
+        rango = max(hasta - desde, 1e-3)
+        indice = next((i for i, (ancho, _, _) in enumerate(NIVELES) if rango / ancho <= puntos),
+                      len(NIVELES) - 1)
+        resumenes = self._leer_nivel(tarjeta_id, indice, desde, hasta)
+
+        if indice == 0 and resumenes['cuenta'].sum() <= puntos:
+            tiempos, valores = self._leer_crudo(tarjeta_id, desde, hasta, pendientes)
+            return {'nivel': 'crudo', 'ancho': 0, 'tiempo': tiempos,
+                    'minimo': valores, 'media': valores, 'maximo': valores}
+
+        ancho, carpeta, _ = NIVELES[indice]
+        if len(resumenes) > puntos:
+            ancho *= math.ceil(rango / ancho / puntos)
+            resumenes = fusionar(resumenes, ancho)
+        return {
+            'nivel': carpeta,
+            'ancho': ancho,
+            'tiempo': resumenes['inicio'].astype(np.float64),
+            'minimo': resumenes['minimo'],
+            'media': resumenes['suma'] / resumenes['cuenta'][:, None],
+            'maximo': resumenes['maximo'],
+        }
@@ -0,0 +1,295 @@
+"""
+BENCHMARK DE CARGA - INGESTA Y LECTURA
+Simula N tarjetas enviando paquetes PAQUETE a un ritmo fijo mientras el panel
+y la Raspberry Pi consultan, y mide rendimiento y latencias p50/p99 de:
+
+    /recibir_paquete            POST de cada tarjeta simulada
+    /obtener_ultimos_paquetes   lectura del panel
+    /obtener_datos_raspberry    lectura de la Raspberry Pi
+
+Sin --url la aplicación se carga en este proceso (cliente de pruebas de Flask,
+datos en un directorio temporal). Con --url se ataca un servidor ya levantado,
+que debe tener registradas las tarjetas 1..N:
+
+    FUGAS_TARJETAS=N gunicorn -c gunicorn.conf.py servidor_flask:app
+    python benchmarks/bench_carga.py --url http://127.0.0.1:5000
+
+Con ritmo fijo la latencia se mide desde el instante en que tocaba enviar la
+petición, no desde que se envió: si el servidor se atrasa, la espera cuenta.
+
+Uso:
+    python benchmarks/bench_carga.py [--tarjetas 2] [--ritmo 10] [--lecturas 5]
+                                     [--duracion 10] [--salida resultado.json]
+                                     [--comparar anterior.json]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import numpy as np
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+INGESTA = '/recibir_paquete'
+LECTURAS = ('/obtener_ultimos_paquetes', '/obtener_datos_raspberry')
+NUM_MUESTRAS = 200
+PERIODO_MS = 100
+# Cuerpos distintos que se generan por tarjeta antes de empezar a medir
+CUERPOS_POR_TARJETA = 32
+
+
+def generar_filas(rng, tarjeta_id, indice):
+    """Filas de un paquete: caudal y presión suaves con ruido de sensor"""
+    t = (indice * NUM_MUESTRAS + np.arange(NUM_MUESTRAS)) * PERIODO_MS / 1000.0
+    estaciones = np.arange(6)
+    flujos = 30 + 5 * np.sin(2 * np.pi * t[:, None] / 60 + estaciones) + rng.normal(0, 0.3, (NUM_MUESTRAS, 6))
+    presiones = (4.0 - 0.4 * estaciones - 0.2 * (tarjeta_id - 1) + 0.05 * np.sin(2 * np.pi * t[:, None] / 20)
+                 + rng.normal(0, 0.01, (NUM_MUESTRAS, 6)))
+    return '\n'.join(
+        ','.join([str(j * PERIODO_MS)] + [f"{v:.2f}" for v in f] + [f"{v:.3f}" for v in p])
+        for j, (f, p) in enumerate(zip(flujos, presiones)))
+
+
+class Tarjeta:
+    """Tarjeta simulada: reloj propio que avanza un segundo por paquete"""
+
+    def __init__(self, tarjeta_id, semilla):
+        rng = np.random.default_rng([semilla, tarjeta_id])
+        self.tarjeta_id = tarjeta_id
+        self.filas = [generar_filas(rng, tarjeta_id, i) for i in range(CUERPOS_POR_TARJETA)]
+        self.reloj = int(rng.integers(0, 86400))
+        self.enviados = 0
+
+    def siguiente(self):
+        """Cuerpo del próximo paquete (la hora distinta evita que dos sean idénticos)"""
+        segundos = (self.reloj + self.enviados) % 86400
+        filas = self.filas[self.enviados % len(self.filas)]
+        self.enviados += 1
+        hora = f"{segundos // 3600},{segundos // 60 % 60},{segundos % 60}"
+        return f"PAQUETE\n{hora}\nTARJETA{self.tarjeta_id}\n{filas}\nFIN_PAQUETE"
+
+
+class ClienteLocal:
+    """Peticiones al cliente de pruebas de Flask, en este mismo proceso"""
+
+    def __init__(self, app):
+        self.cliente = app.test_client()
+
+    def get(self, ruta):
+        return self.cliente.get(ruta).status_code
+
+    def post(self, ruta, cuerpo):
+        return self.cliente.post(ruta, data=cuerpo, content_type='text/plain').status_code
+
+
+class ClienteHTTP:
+    """Peticiones HTTP con conexión persistente (una por hilo)"""
+
+    def __init__(self, url):
+        partes = urlsplit(url)
+        self.destino = (partes.hostname, partes.port or 80)
+        self.conexion = None
+
+    def _pedir(self, metodo, ruta, cuerpo=None, cabeceras=None):
+        for intento in range(2):
+            if self.conexion is None:
+                self.conexion = http.client.HTTPConnection(*self.destino, timeout=30)
+            try:
+                self.conexion.request(metodo, ruta, body=cuerpo, headers=cabeceras or {})
+                respuesta = self.conexion.getresponse()
+                respuesta.read()
+                return respuesta.status
+            except (http.client.HTTPException, OSError):
+                # El servidor cerró la conexión keep-alive: se reabre una vez
+                self.conexion.close()
+                self.conexion = None
+                if intento:
+                    raise
+
+    def get(self, ruta):
+        return self._pedir('GET', ruta)
+
+    def post(self, ruta, cuerpo):
+        return self._pedir('POST', ruta, cuerpo.encode(), {'Content-Type': 'text/plain'})
+
+
+class Medicion:
+    """Latencias y errores de un endpoint (solo lo ocurrido dentro de la ventana)"""
+
+    def __init__(self):
+        self.latencias = []
+        self.errores = 0
+        self._lock = threading.Lock()
+
+    def anotar(self, latencia, correcto):
+        with self._lock:
+            self.latencias.append(latencia)
+            if not correcto:
+                self.errores += 1
+
+    def resumen(self, duracion):
+        latencias = np.array(self.latencias) * 1000
+        if not len(latencias):
+            return {'peticiones': 0, 'errores': self.errores, 'por_segundo': 0.0}
+        p50, p90, p99 = np.percentile(latencias, [50, 90, 99])
+        return {
+            'peticiones': len(latencias),
+            'errores': self.errores,
+            'por_segundo': round(len(latencias) / duracion, 2),
+            'p50_ms': round(float(p50), 3),
+            'p90_ms': round(float(p90), 3),
+            'p99_ms': round(float(p99), 3),
+            'max_ms': round(float(latencias.max()), 3),
+        }
+
+
+def _bucle(crear_cliente, ritmo, inicio, medir_desde, fin, medicion, peticion):
+    """Lanza `peticion(cliente)` `ritmo` veces por segundo (0 = sin pausa) hasta `fin`"""
+    cliente = crear_cliente()
+    k = 0
+    while True:
+        programado = inicio + k / ritmo if ritmo else time.perf_counter()
+        if programado >= fin:
+            return
+        espera = programado - time.perf_counter()
+        if espera > 0:
+            time.sleep(espera)
+        try:
+            correcto = peticion(cliente) < 400
+        except (http.client.HTTPException, OSError):
+            correcto = False
+        terminado = time.perf_counter()
+        # Las peticiones del calentamiento no cuentan
+        if programado >= medir_desde:
+            medicion.anotar(terminado - programado, correcto)
+        k += 1
+
+
+def ejecutar(crear_cliente, tarjetas, ritmo, lecturas, duracion, calentamiento):
+    """Corre la carga y devuelve {endpoint: resumen}"""
+    mediciones = {INGESTA: Medicion(), **{ruta: Medicion() for ruta in LECTURAS}}
+    inicio = time.perf_counter() + 0.1
+    medir_desde = inicio + calentamiento
+    fin = medir_desde + duracion
+
+    def enviar(tarjeta):
+        return lambda cliente: cliente.post(INGESTA, tarjeta.siguiente())
+
+    def leer(ruta):
+        return lambda cliente: cliente.get(ruta)
+
+    hilos = [threading.Thread(target=_bucle, args=(crear_cliente, ritmo, inicio, medir_desde, fin,
+                                                   mediciones[INGESTA], enviar(t)))
+             for t in tarjetas]
+    if lecturas:
+        hilos += [threading.Thread(target=_bucle, args=(crear_cliente, lecturas, inicio, medir_desde, fin,
+                                                        mediciones[ruta], leer(ruta)))
+                  for ruta in LECTURAS]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return {ruta: medicion.resumen(duracion) for ruta, medicion in mediciones.items()}
+
+
+def _version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=RAIZ,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _cargar_app(num_tarjetas):
+    """Importa servidor_flask con datos en un directorio temporal, estado por proceso
+    y las tarjetas 1..num_tarjetas registradas con el esquema por defecto"""
+    os.chdir(tempfile.mkdtemp(prefix='bench_carga_'))
+    os.environ.pop('FUGAS_DIR_COMPARTIDO', None)
+    os.environ['FUGAS_TARJETAS'] = str(num_tarjetas)
+    os.environ.setdefault('FUGAS_DIR_HISTORICO', 'historico_sensores')
+    os.environ.setdefault('FUGAS_LOG_NIVEL', 'WARNING')
+    import servidor_flask
+    return servidor_flask.app
+
+
+def comparar(actual, anterior):
+    """Tabla de variación de rendimiento y p99 respecto a un resultado guardado"""
+    print(f"\nComparación con {anterior.get('version') or 'resultado anterior'}:")
+    for ruta, datos in actual['resultados'].items():
+        previo = anterior.get('resultados', {}).get(ruta)
+        if not previo or 'p99_ms' not in datos or 'p99_ms' not in previo:
+            continue
+        print(f"  {ruta:28s} por_segundo {previo['por_segundo']:9.1f} -> {datos['por_segundo']:9.1f}"
+              f"   p99 {previo['p99_ms']:9.2f} -> {datos['p99_ms']:9.2f} ms"
+              f"  ({(datos['p99_ms'] / previo['p99_ms'] - 1) * 100:+.0f}%)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--url', help='servidor a medir (por defecto, la app en este proceso)')
+    ap.add_argument('--tarjetas', type=int, default=2, help='tarjetas simuladas (ids 1..N)')
+    ap.add_argument('--ritmo', type=float, default=10.0,
+                    help='paquetes por segundo de cada tarjeta (0 = tan rápido como se pueda)')
+    ap.add_argument('--lecturas', type=float, default=5.0,
+                    help='consultas por segundo a cada endpoint de lectura (0 = ninguna)')
+    ap.add_argument('--duracion', type=float, default=10.0, help='segundos medidos')
+    ap.add_argument('--calentamiento', type=float, default=2.0, help='segundos previos sin medir')
+    ap.add_argument('--semilla', type=int, default=0)
+    ap.add_argument('--salida', help='archivo JSON donde guardar el resultado')
+    ap.add_argument('--comparar', help='resultado JSON anterior con el que comparar')
+    args = ap.parse_args()
+    # Rutas resueltas antes de que la app en proceso cambie de directorio
+    salida = args.salida and os.path.abspath(args.salida)
+    anterior = args.comparar and os.path.abspath(args.comparar)
+
+    tarjetas = [Tarjeta(i, args.semilla) for i in range(1, args.tarjetas + 1)]
+    if args.url:
+        crear_cliente = lambda: ClienteHTTP(args.url)  # noqa: E731
+    else:
+        app = _cargar_app(args.tarjetas)
+        crear_cliente = lambda: ClienteLocal(app)  # noqa: E731
+
+    resultados = ejecutar(crear_cliente, tarjetas, args.ritmo, args.lecturas, args.duracion, args.calentamiento)
+    informe = {
+        'version': _version(),
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'destino': args.url or 'proceso',
+        'parametros': {k: getattr(args, k) for k in ('tarjetas', 'ritmo', 'lecturas', 'duracion',
+                                                     'calentamiento', 'semilla')},
+        'resultados': resultados,
+    }
+
+    print(f"{args.tarjetas} tarjetas a {args.ritmo:g} paquetes/s, lecturas a {args.lecturas:g}/s, "
+          f"{args.duracion:g} s contra {informe['destino']}")
+    for ruta, datos in resultados.items():
+        if 'p50_ms' in datos:
+            print(f"  {ruta:28s} {datos['por_segundo']:9.1f} pet/s   p50 {datos['p50_ms']:8.2f} ms"
+                  f"   p99 {datos['p99_ms']:8.2f} ms   errores {datos['errores']}")
+        else:
+            print(f"  {ruta:28s} sin peticiones")
+
+    if anterior:
+        with open(anterior) as f:
+            comparar(informe, json.load(f))
+    if salida:
+        with open(salida, 'w') as f:
+            json.dump(informe, f, indent=2)
+            f.write('\n')
+        print(f"\nResultado guardado en {args.salida}")
+
+
+if __name__ == '__main__':
+    main()
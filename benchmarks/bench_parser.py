@@ -0,0 +1,83 @@
+"""
+MICRO-BENCHMARK - PARSER DE PAQUETES
+Compara el bucle original de /recibir_paquete con parser_paquetes.parsear_paquete.
+
+Uso:
+    python benchmarks/bench_parser.py [--repeticiones 2000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser_paquetes import PaqueteInvalido, parsear_paquete  # noqa: E402
+
+
+def generar_cuerpo(tarjeta_id=1, semilla=0):
+    """Paquete PAQUETE/FIN_PAQUETE con valores parecidos a los del Arduino"""
+    rng = random.Random(semilla)
+    lineas = ['PAQUETE', '12,30,15', f'TARJETA{tarjeta_id}']
+    for j in range(200):
+        flujos = [f"{rng.uniform(10, 50):.2f}" for _ in range(6)]
+        presiones = [f"{rng.uniform(1.0, 4.5):.3f}" for _ in range(6)]
+        lineas.append(','.join([str(j * 100)] + flujos + presiones))
+    lineas.append('FIN_PAQUETE')
+    return '\n'.join(lineas)
+
+
+def parser_anterior(datos):
+    """Bucle por campo que usaba recibir_paquete antes del parser en bloque"""
+    lineas = datos.strip().split('\n')
+    if lineas[0] != 'PAQUETE' or lineas[-1] != 'FIN_PAQUETE':
+        raise ValueError('Formato inválido')
+    tiempo = lineas[1].split(',')
+    hora, minuto, segundo = int(tiempo[0]), int(tiempo[1]), int(tiempo[2])
+    tarjeta_id = int(lineas[2].replace('TARJETA', ''))
+    mediciones = []
+    for i in range(3, 203):
+        valores = lineas[i].split(',')
+        mediciones.append({
+            'tiempo_muestreo': int(valores[0]),
+            'flujos': [float(valores[j]) for j in range(1, 7)],
+            'presiones': [float(valores[j]) for j in range(7, 13)]
+        })
+    return tarjeta_id, (hora, minuto, segundo), mediciones
+
+
+def medir(funcion, argumento, repeticiones):
+    """Microsegundos por llamada (mejor de 5 rondas)"""
+    rondas = timeit.repeat(lambda: funcion(argumento), number=repeticiones, repeat=5)
+    return min(rondas) / repeticiones * 1e6
+
+
+def rechazar(cuerpo):
+    try:
+        parsear_paquete(cuerpo)
+    except PaqueteInvalido:
+        pass
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--repeticiones', type=int, default=2000)
+    args = ap.parse_args()
+
+    cuerpo = generar_cuerpo()
+    truncado = cuerpo.rsplit('\n', 5)[0] + '\nFIN_PAQUETE'
+
+    anterior = medir(parser_anterior, cuerpo, args.repeticiones)
+    nuevo = medir(parsear_paquete, cuerpo, args.repeticiones)
+    invalido = medir(rechazar, truncado, args.repeticiones)
+
+    print(f"Paquete de {len(cuerpo)} bytes, {args.repeticiones} repeticiones")
+    print(f"  parser anterior (bucle)   {anterior:8.1f} us/paquete")
+    print(f"  parsear_paquete (bloque)  {nuevo:8.1f} us/paquete   x{anterior / nuevo:.1f}")
+    print(f"  rechazo de paquete corto  {invalido:8.1f} us/paquete")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""
+BUFFER CIRCULAR - ALMACENAMIENTO COLUMNAR DE PAQUETES
+Arreglo NumPy preasignado por tarjeta con forma (capacidad, muestras, columnas).
+
+Columnas de cada muestra (por defecto; el esquema real lo da tarjetas.py):
+    0      tiempo de muestreo (ms)
+    1-6    flujos
+    7-12   presiones
+Junto al arreglo se guarda un índice con el número de secuencia global,
+el timestamp de llegada y la hora de inicio de la placa (segundos del día)
+de cada paquete, y los
+agregados por canal (media, mínimo, máximo, desviación) calculados una
+sola vez al insertar.
+
+Los paquetes se mantienen en orden de hora de la placa (ver tiempo_placa),
+no de llegada: uno atrasado se inserta en su sitio, así quien los lea no
+tiene que ordenarlos. La secuencia global sigue siendo la de llegada.
+"""
+
+import bisect
+import time
+
+import numpy as np
+
+NUM_MUESTRAS = 200
+NUM_COLUMNAS = 13
+NUM_FLUJOS = 6
+COL_FLUJOS = slice(1, 7)
+COL_PRESIONES = slice(7, 13)
+
+# Filas de `agregados[pos]`; las columnas son los canales (columna 1 en adelante)
+AGREGADOS = ('media', 'minimo', 'maximo', 'desviacion')
+
+# Decimales al volver a JSON: quita el ruido de float32 sin perder resolución del sensor
+DECIMALES_JSON = 5
+
+# Secuencia de la placa de un paquete que no la trae
+SIN_SECUENCIA = -1
+SEGUNDOS_DIA = 86400
+
+
+def hora_a_segundos(hora, minuto, segundo):
+    return hora * 3600 + minuto * 60 + segundo
+
+
+def segundos_a_hora(segundos):
+    segundos = int(segundos)
+    return f"{segundos // 3600:02d}:{segundos // 60 % 60:02d}:{segundos % 60:02d}"
+
+
+def texto_a_segundos(hora_inicio):
+    """'HH:MM:SS' -> segundos del día"""
+    hora, minuto, segundo = (int(v) for v in hora_inicio.split(':'))
+    return hora_a_segundos(hora, minuto, segundo)
+
+
+def tiempo_placa(timestamp, hora):
+    """Hora de inicio de la placa (s del día) como epoch en s.
+
+    El día es el de la llegada, o el anterior o el siguiente si así queda más
+    cerca de ella: un paquete de las 23:59:50 que llega a las 00:00:05 es de ayer.
+    """
+    local = time.localtime(timestamp)
+    tiempo = int(timestamp) - hora_a_segundos(local.tm_hour, local.tm_min, local.tm_sec) + int(hora)
+    if tiempo - timestamp > SEGUNDOS_DIA / 2:
+        tiempo -= SEGUNDOS_DIA
+    elif timestamp - tiempo > SEGUNDOS_DIA / 2:
+        tiempo += SEGUNDOS_DIA
+    return tiempo
+
+
+def tiempos_placa(timestamps, horas):
+    """tiempo_placa() para arreglos: una llamada a localtime por cuarto de hora de llegada, no por paquete"""
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    segundos = np.floor(timestamps).astype(np.int64)
+    # Los cambios de hora caen en múltiplos de 15 min: el desfase es el mismo en cada cuarto
+    cuartos, inverso = np.unique(segundos // 900, return_inverse=True)
+    desfases = np.array([time.localtime(int(c) * 900).tm_gmtoff for c in cuartos], dtype=np.int64)
+    tiempos = segundos - (segundos + desfases[inverso.reshape(-1)]) % SEGUNDOS_DIA + np.asarray(horas, dtype=np.int64)
+    tiempos[tiempos - timestamps > SEGUNDOS_DIA / 2] -= SEGUNDOS_DIA
+    tiempos[timestamps - tiempos > SEGUNDOS_DIA / 2] += SEGUNDOS_DIA
+    return tiempos
+
+
+def muestras_desde_mediciones(mediciones, num_columnas=NUM_COLUMNAS):
+    """Convierte la lista de dicts del formato antiguo a un arreglo (muestras, columnas)"""
+    muestras = np.empty((len(mediciones), num_columnas), dtype=np.float32)
+    for fila, m in zip(muestras, mediciones):
+        fila[0] = m['tiempo_muestreo']
+        fila[1:] = m['flujos'] + m['presiones']
+    return muestras
+
+
+class BufferCircular:
+    """Últimos `capacidad` paquetes de una tarjeta con descarte O(1) del más antiguo"""
+
+    def __init__(self, capacidad, num_muestras=NUM_MUESTRAS, num_columnas=NUM_COLUMNAS, arreglos=None,
+                 num_flujos=NUM_FLUJOS):
+        """`arreglos(campo, forma, dtype)` crea cada arreglo; por defecto np.zeros.
+
+        `num_flujos` separa flujos y presiones en paquete(); el resto de
+        columnas tras el tiempo son presiones.
+
+        EstadoCompartido.arreglo permite respaldarlos con archivos mapeados
+        para que varios procesos vean el mismo buffer.
+        """
+        if arreglos is None:
+            arreglos = lambda campo, forma, dtype: np.zeros(forma, dtype=dtype)
+        self.capacidad = capacidad
+        self.num_muestras = num_muestras
+        self.num_columnas = num_columnas
+        self.col_flujos = slice(1, 1 + num_flujos)
+        self.col_presiones = slice(1 + num_flujos, num_columnas)
+        # np.zeros no compromete memoria física hasta que se escribe cada página
+        self.muestras = arreglos('muestras', (capacidad, num_muestras, num_columnas), np.float32)
+        self.secuencias = arreglos('secuencias', (capacidad,), np.int64)
+        self.timestamps = arreglos('timestamps', (capacidad,), np.float64)
+        self.horas = arreglos('horas', (capacidad,), np.int32)
+        self.tiempos_placa = arreglos('tiempos_placa', (capacidad,), np.int64)
+        self.secuencias_placa = arreglos('secuencias_placa', (capacidad,), np.int64)
+        self.agregados = arreglos('agregados', (capacidad, len(AGREGADOS), num_columnas - 1), np.float32)
+        self._campos = (self.muestras, self.secuencias, self.timestamps, self.horas,
+                        self.tiempos_placa, self.secuencias_placa, self.agregados)
+        # inicio, cantidad y mayor secuencia descartada por falta de espacio (no por confirmación)
+        self._indices = arreglos('indices', (3,), np.int64)
+
+    @property
+    def _inicio(self):
+        return int(self._indices[0])
+
+    @_inicio.setter
+    def _inicio(self, valor):
+        self._indices[0] = valor
+
+    @property
+    def _cantidad(self):
+        return int(self._indices[1])
+
+    @_cantidad.setter
+    def _cantidad(self, valor):
+        self._indices[1] = valor
+
+    @property
+    def secuencia_pisada(self):
+        return int(self._indices[2])
+
+    @secuencia_pisada.setter
+    def secuencia_pisada(self, valor):
+        self._indices[2] = valor
+
+    def __len__(self):
+        return self._cantidad
+
+    def posiciones(self, ultimos=None):
+        """Índices físicos de los paquetes retenidos, del más antiguo al más reciente"""
+        n = self._cantidad if ultimos is None else min(ultimos, self._cantidad)
+        return (self._inicio + self._cantidad - n + np.arange(n)) % self.capacidad
+
+    def posicion(self, i):
+        """Índice físico del i-ésimo paquete (admite negativos como una lista)"""
+        if i < 0:
+            i += self._cantidad
+        if not 0 <= i < self._cantidad:
+            raise IndexError('paquete fuera de rango')
+        return (self._inicio + i) % self.capacidad
+
+    def agregar(self, muestras, timestamp, hora, secuencia=0, secuencia_placa=SIN_SECUENCIA):
+        """Copia el paquete en su lugar por hora de la placa; si está lleno pisa el más antiguo.
+
+        Lo normal es que sea el más reciente y vaya a la siguiente ranura;
+        uno atrasado desplaza una ranura los posteriores. Devuelve la
+        posición física, o None si el buffer está lleno y el paquete es
+        anterior a todos los retenidos (sería el primero en pisarse).
+        """
+        tiempo = tiempo_placa(timestamp, hora)
+        if self._cantidad and tiempo < self.tiempos_placa[self.posicion(-1)]:
+            pos = self._hacer_hueco(tiempo)
+            if pos is None:
+                return None
+        elif self._cantidad == self.capacidad:
+            pos = self._inicio
+            self._inicio = (self._inicio + 1) % self.capacidad
+            self.secuencia_pisada = max(self.secuencia_pisada, int(self.secuencias[pos]))
+        else:
+            pos = (self._inicio + self._cantidad) % self.capacidad
+            self._cantidad += 1
+        self.muestras[pos] = muestras
+        self.secuencias[pos] = secuencia
+        self.timestamps[pos] = timestamp
+        self.horas[pos] = hora
+        self.tiempos_placa[pos] = tiempo
+        self.secuencias_placa[pos] = secuencia_placa
+        self._agregar_estadisticas(pos)
+        return pos
+
+    def cargar(self, muestras, timestamps, horas, secuencias, secuencias_placa):
+        """Reemplaza el contenido por estos paquetes con una copia en bloque por campo.
+
+        Si son más que la capacidad quedan los últimos por hora de la placa.
+        Los agregados se calculan para todos de una vez. Devuelve cuántos se cargaron.
+        """
+        tiempos = tiempos_placa(timestamps, horas)
+        if len(tiempos) > 1 and (np.diff(tiempos) < 0).any():
+            seleccion = np.argsort(tiempos, kind='stable')[-self.capacidad:]
+        else:
+            # Ya en orden (lo normal en una instantánea): tramos, sin copias intermedias
+            seleccion = slice(max(0, len(tiempos) - self.capacidad), len(tiempos))
+        tiempos = tiempos[seleccion]
+        n = len(tiempos)
+        self.muestras[:n] = muestras[seleccion]
+        self.secuencias[:n] = np.asarray(secuencias)[seleccion]
+        self.timestamps[:n] = np.asarray(timestamps)[seleccion]
+        self.horas[:n] = np.asarray(horas)[seleccion]
+        self.tiempos_placa[:n] = tiempos
+        self.secuencias_placa[:n] = np.asarray(secuencias_placa)[seleccion]
+        self._agregar_estadisticas(slice(0, n))
+        self._inicio = 0
+        self._cantidad = n
+        return n
+
+    def _hacer_hueco(self, tiempo):
+        """Libera la ranura que corresponde a un paquete atrasado desplazando los vecinos"""
+        pos = self.posiciones()
+        k = int(np.searchsorted(self.tiempos_placa[pos], tiempo, side='right'))
+        if self._cantidad == self.capacidad:
+            if k == 0:
+                return None
+            # Sale el más antiguo y los anteriores al nuevo retroceden una ranura
+            self.secuencia_pisada = max(self.secuencia_pisada, int(self.secuencias[pos[0]]))
+            origen, destino, libre = pos[1:k], pos[:k - 1], pos[k - 1]
+        else:
+            self._cantidad += 1
+            pos = self.posiciones()
+            origen, destino, libre = pos[k:-1], pos[k + 1:], pos[k]
+        for arreglo in self._campos:
+            arreglo[destino] = arreglo[origen]
+        return int(libre)
+
+    def duplicado(self, muestras, timestamp, hora, secuencia_placa=SIN_SECUENCIA):
+        """¿Ya está retenido? Misma hora de la placa y misma secuencia (o, sin ella, mismas muestras).
+
+        Los paquetes están ordenados por hora de la placa: uno posterior al
+        último es nuevo sin más (el caso normal, O(1)); si no, los candidatos
+        salen de una bisección sobre las ranuras, sin recorrer el buffer.
+        """
+        n = self._cantidad
+        tiempo = tiempo_placa(timestamp, hora)
+        if not n or tiempo > self.tiempos_placa[self.posicion(-1)]:
+            return False
+        clave = lambda i: self.tiempos_placa[(self._inicio + i) % self.capacidad]
+        desde = bisect.bisect_left(range(n), tiempo, key=clave)
+        hasta = bisect.bisect_right(range(n), tiempo, lo=desde, key=clave)
+        for i in range(desde, hasta):
+            pos = (self._inicio + i) % self.capacidad
+            if secuencia_placa != SIN_SECUENCIA:
+                if self.secuencias_placa[pos] == secuencia_placa:
+                    return True
+            elif np.array_equal(self.muestras[pos], muestras):
+                return True
+        return False
+
+    def _agregar_estadisticas(self, pos):
+        """Agregados de la ranura `pos` (o de un tramo de ranuras)"""
+        canales = self.muestras[pos, :, 1:]
+        agregados = self.agregados[pos]
+        canales.mean(axis=-2, dtype=np.float64, out=agregados[..., 0, :])
+        canales.min(axis=-2, out=agregados[..., 1, :])
+        canales.max(axis=-2, out=agregados[..., 2, :])
+        canales.std(axis=-2, dtype=np.float64, out=agregados[..., 3, :])
+
+    def vaciar(self):
+        self._inicio = 0
+        self._cantidad = 0
+
+    def posiciones_desde(self, secuencia, maximo=None):
+        """Posiciones de los paquetes con secuencia mayor que `secuencia`, en orden de
+        secuencia (a lo sumo `maximo`)"""
+        pos = self.posiciones()
+        secuencias = self.secuencias[pos]
+        nuevos = secuencias > secuencia
+        pos, secuencias = pos[nuevos], secuencias[nuevos]
+        if len(secuencias) > 1 and (np.diff(secuencias) < 0).any():
+            # Un paquete atrasado quedó en medio con una secuencia mayor que los posteriores
+            pos = pos[np.argsort(secuencias, kind='stable')]
+        return pos if maximo is None else pos[:maximo]
+
+    def descartar_hasta(self, secuencia):
+        """Libera los primeros paquetes mientras su secuencia sea <= `secuencia`; devuelve cuántos.
+
+        Un paquete atrasado aún sin confirmar retiene a los que le siguen
+        hasta la próxima confirmación (posiciones_desde ya no los devuelve).
+        """
+        pendientes = np.flatnonzero(self.secuencias[self.posiciones()] > secuencia)
+        n = int(pendientes[0]) if len(pendientes) else self._cantidad
+        self._inicio = (self._inicio + n) % self.capacidad
+        self._cantidad -= n
+        return n
+
+    def ultimo_timestamp(self):
+        """Llegada más reciente (con paquetes atrasados no es la del último en orden)"""
+        return float(self.timestamps[self.posiciones()].max()) if self._cantidad else None
+
+    def paquete(self, pos):
+        """Paquete en ranura física `pos` con el formato JSON de siempre"""
+        filas = self.muestras[pos].astype(np.float64).round(DECIMALES_JSON).tolist()
+        return {
+            'timestamp': float(self.timestamps[pos]),
+            'hora_inicio': segundos_a_hora(self.horas[pos]),
+            'mediciones': [
+                {'tiempo_muestreo': int(f[0]), 'flujos': f[self.col_flujos], 'presiones': f[self.col_presiones]}
+                for f in filas
+            ]
+        }
@@ -0,0 +1,87 @@
+"""
+COLA DE INGESTA - ACEPTAR RÁPIDO, PROCESAR APARTE
+Los endpoints de ingesta validan el encuadre del paquete, lo encolan y
+responden; un hilo propio hace el resto (parseo, buffers, registro en disco,
+archivo histórico y análisis). Así un disco lento retrasa el guardado pero
+no la respuesta a las tarjetas.
+
+La cola es acotada: llena, encolar() devuelve False y el endpoint contesta
+503 con Retry-After para que la tarjeta reintente en lugar de acumular
+memoria sin límite. El hilo vacía de una vez todo lo pendiente (hasta
+`max_lote`) para guardarlo con un solo flush.
+"""
+
+import logging
+import queue
+import threading
+
+log = logging.getLogger(__name__)
+
+CAPACIDAD = 512
+MAX_LOTE = 64
+
+_FIN = object()
+
+
+class ColaIngesta:
+    """Cola acotada consumida por un hilo que procesa los trabajos por lotes"""
+
+    def __init__(self, procesar, capacidad=CAPACIDAD, max_lote=MAX_LOTE):
+        """`procesar(trabajos)` recibe una lista con los trabajos pendientes en orden de llegada"""
+        self.procesar = procesar
+        self.max_lote = max_lote
+        self._cola = queue.Queue(maxsize=capacidad)
+        self._hilo = None
+
+    @property
+    def capacidad(self):
+        return self._cola.maxsize
+
+    def __len__(self):
+        return self._cola.qsize()
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name='ingesta', daemon=True)
+            self._hilo.start()
+
+    def encolar(self, trabajo):
+        """Encola sin bloquear; False si la cola está llena"""
+        try:
+            self._cola.put_nowait(trabajo)
+            return True
+        except queue.Full:
+            return False
+
+    def esperar(self):
+        """Bloquea hasta que se haya procesado todo lo encolado"""
+        self._cola.join()
+
+    def detener(self, timeout=None):
+        """Procesa lo pendiente y termina el hilo (al cerrar el proceso)"""
+        if self._hilo is None:
+            return
+        self._cola.put(_FIN)
+        self._hilo.join(timeout)
+        self._hilo = None
+
+    def _bucle(self):
+        while True:
+            trabajos = [self._cola.get()]
+            while len(trabajos) < self.max_lote:
+                try:
+                    trabajos.append(self._cola.get_nowait())
+                except queue.Empty:
+                    break
+            fin = any(trabajo is _FIN for trabajo in trabajos)
+            pendientes = [trabajo for trabajo in trabajos if trabajo is not _FIN]
+            try:
+                if pendientes:
+                    self.procesar(pendientes)
+            except Exception as e:
+                log.exception("Error en ingesta: %s", e)
+            finally:
+                for _ in trabajos:
+                    self._cola.task_done()
+            if fin:
+                return
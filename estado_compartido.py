@@ -0,0 +1,179 @@
+"""
+ESTADO COMPARTIDO - VARIOS WORKERS DE GUNICORN SOBRE LOS MISMOS DATOS
+Arreglos respaldados por archivos mapeados en memoria (np.memmap) y un
+bloqueo lector/escritor entre procesos e hilos.
+
+Sin directorio todo vive en memoria del proceso, como antes, y el bloqueo
+solo protege entre hilos. Con directorio (idealmente en /dev/shm) cada
+worker abre los mismos archivos: los buffers circulares, los contadores
+globales y el resultado del análisis son los mismos para todos.
+
+Protocolo: las modificaciones toman el bloqueo exclusivo e incrementan
+el contador VERSION_DATOS; las lecturas toman el bloqueo compartido. Cada
+worker compara ese contador con el que vio por última vez para invalidar
+sus cachés.
+"""
+
+import fcntl
+import json
+import os
+import threading
+import weakref
+from contextlib import contextmanager
+
+import numpy as np
+
+# Posiciones del arreglo de contadores
+VERSION_DATOS = 0
+ULTIMA_SECUENCIA = 1
+VERSION_ANALISIS = 2
+INICIALIZADO = 3
+# Identificador del arranque que cargó los datos (las versiones vuelven a empezar con él)
+ARRANQUE = 4
+NUM_CONTADORES = 8
+
+
+class _Descriptor:
+    """Descriptor de un hilo: se cierra cuando el hilo termina y threading.local lo suelta"""
+
+    def __init__(self, ruta):
+        self.fd = os.open(ruta, os.O_RDWR | os.O_CREAT, 0o644)
+        weakref.finalize(self, os.close, self.fd)
+
+
+class Bloqueo:
+    """Bloqueo lector/escritor reentrante entre hilos y, con `ruta`, entre procesos.
+
+    flock() se aplica por descripción de archivo abierto, así que cada hilo
+    abre su propio descriptor (y lo cierra al terminar); la reentrada se
+    cuenta por hilo para que un bloqueo anidado no libere el exterior.
+    """
+
+    def __init__(self, ruta=None):
+        self.ruta = ruta
+        self._local = threading.local()
+        self._rlock = threading.RLock() if ruta is None else None
+
+    def _fd(self):
+        descriptor = getattr(self._local, 'descriptor', None)
+        if descriptor is None:
+            descriptor = self._local.descriptor = _Descriptor(self.ruta)
+        return descriptor.fd
+
+    @contextmanager
+    def _tomar(self, modo):
+        profundidad = getattr(self._local, 'profundidad', 0)
+        if profundidad == 0:
+            if self._rlock is not None:
+                self._rlock.acquire()
+            else:
+                fcntl.flock(self._fd(), modo)
+        self._local.profundidad = profundidad + 1
+        try:
+            yield
+        finally:
+            self._local.profundidad -= 1
+            if self._local.profundidad == 0:
+                if self._rlock is not None:
+                    self._rlock.release()
+                else:
+                    fcntl.flock(self._fd(), fcntl.LOCK_UN)
+
+    def lectura(self):
+        return self._tomar(fcntl.LOCK_SH)
+
+    def escritura(self):
+        return self._tomar(fcntl.LOCK_EX)
+
+
+class EstadoCompartido:
+    """Fábrica de arreglos compartidos, contadores globales y documentos JSON"""
+
+    def __init__(self, directorio=None):
+        self.directorio = directorio
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self.bloqueo = Bloqueo(os.path.join(directorio, 'bloqueo') if directorio else None)
+        with self.bloqueo.escritura():
+            self.contadores = self.arreglo('contadores', (NUM_CONTADORES,), np.int64)
+        self._documentos = {}
+
+    @property
+    def compartido(self):
+        return self.directorio is not None
+
+    def lectura(self):
+        return self.bloqueo.lectura()
+
+    def escritura(self):
+        return self.bloqueo.escritura()
+
+    def arreglo(self, nombre, forma, dtype):
+        """Arreglo en ceros; en modo compartido, un .npy mapeado que ven todos los workers.
+
+        Debe llamarse con el bloqueo exclusivo: si el archivo existe con otra
+        forma o tipo (cambió la configuración) se vuelve a crear.
+        """
+        if not self.compartido:
+            return np.zeros(forma, dtype=dtype)
+        ruta = os.path.join(self.directorio, f"{nombre}.npy")
+        if os.path.exists(ruta):
+            try:
+                existente = np.lib.format.open_memmap(ruta, mode='r+')
+                if existente.shape == tuple(forma) and existente.dtype == np.dtype(dtype):
+                    return existente
+            except ValueError:
+                pass
+        if hasattr(self, 'contadores'):
+            # Arreglo nuevo o con otra forma (p. ej. tras actualizar): los datos mapeados
+            # ya no están completos y el próximo worker recarga del registro
+            self.contadores[INICIALIZADO] = 0
+        return np.lib.format.open_memmap(ruta, mode='w+', dtype=dtype, shape=tuple(forma))
+
+    def esperar_liderazgo(self, nombre):
+        """Bloquea hasta que este proceso sea el único que ejecuta la tarea `nombre`.
+
+        El flock se mantiene mientras viva el proceso; si el líder muere el
+        sistema lo libera y otro worker toma el relevo.
+        """
+        if not self.compartido:
+            return
+        fd = os.open(os.path.join(self.directorio, f"lider_{nombre}"), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        self._lider = getattr(self, '_lider', []) + [fd]
+
+    def incrementar(self, contador, cantidad=1):
+        """Incrementa un contador global (llamar con el bloqueo exclusivo)"""
+        self.contadores[contador] += cantidad
+        return int(self.contadores[contador])
+
+    def guardar_documento(self, nombre, datos, contador):
+        """Guarda un dict JSON visible para todos los workers e incrementa su contador"""
+        with self.escritura():
+            if self.compartido:
+                ruta = os.path.join(self.directorio, f"{nombre}.json")
+                with open(ruta + '.tmp', 'w') as f:
+                    json.dump(datos, f)
+                os.replace(ruta + '.tmp', ruta)
+            version = self.incrementar(contador)
+            self._documentos[nombre] = (version, datos)
+
+    def leer_documento(self, nombre, contador, defecto):
+        """Último dict guardado con guardar_documento (releído solo si cambió su contador)"""
+        version = int(self.contadores[contador])
+        guardado = self._documentos.get(nombre)
+        if guardado and guardado[0] == version:
+            return guardado[1]
+        datos = defecto
+        if self.compartido:
+            with self.lectura():
+                version = int(self.contadores[contador])
+                try:
+                    with open(os.path.join(self.directorio, f"{nombre}.json")) as f:
+                        datos = json.load(f)
+                except (OSError, ValueError):
+                    pass
+        elif guardado:
+            datos = guardado[1]
+        self._documentos[nombre] = (version, datos)
+        return datos
@@ -0,0 +1,22 @@
+"""
+CONFIGURACIÓN DE GUNICORN - VARIOS WORKERS SOBRE EL MISMO ESTADO
+Uso:
+    gunicorn -c gunicorn.conf.py servidor_flask:app
+
+Los workers comparten buffers, contadores y análisis a través de archivos
+mapeados en FUGAS_DIR_COMPARTIDO (por defecto /dev/shm/fugas, en RAM).
+"""
+
+import os
+
+os.environ.setdefault('FUGAS_DIR_COMPARTIDO', '/dev/shm/fugas')
+
+bind = os.environ.get('FUGAS_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('FUGAS_WORKERS', 4))
+# Hilos por worker: /eventos y /esperar_cambios mantienen conexiones abiertas
+# (como mucho la mitad de los hilos, FUGAS_MAX_CLIENTES_PUSH)
+worker_class = 'gthread'
+threads = int(os.environ.get('FUGAS_HILOS', 8))
+# Cada worker importa la aplicación por su cuenta y abre los arreglos compartidos
+preload_app = False
+timeout = 60
@@ -0,0 +1,287 @@
+"""
+INSTANTÁNEA - EXPORTAR E IMPORTAR LOS BUFFERS EN BINARIO
+Copia de los paquetes retenidos en un solo .npz para analizarlos fuera de
+línea (NumPy, pandas) o para sembrar otro servidor, sin pasar por JSON.
+
+Contenido del .npz (sin comprimir):
+    meta                    JSON en uint8: versión, fecha, última secuencia
+                            y esquema de cada tarjeta
+    tarjetaN_muestras       (paquetes, muestras, columnas) float32
+    tarjetaN_secuencias     (paquetes,) int64, número de secuencia global
+    tarjetaN_timestamps     (paquetes,) float64, llegada al servidor (epoch s)
+    tarjetaN_horas          (paquetes,) int32, hora de inicio de la placa (s del día)
+    tarjetaN_secuencias_placa  (paquetes,) int64, contador de la placa (-1 si no lo envía)
+
+Al no estar comprimido, cada arreglo ocupa un tramo contiguo del archivo y
+cargar() lo mapea en memoria en lugar de leerlo (np.load(mmap_mode='r') solo
+mapea .npy sueltos, no los miembros de un .npz): una captura de varios GB se
+abre en milisegundos y solo se leen del disco las páginas que se usan.
+
+Uso:
+    python instantanea.py info captura.npz
+    python instantanea.py descargar captura.npz [--url http://127.0.0.1:5000] [--tarjetas 1,2]
+    python instantanea.py subir captura.npz [--url http://127.0.0.1:5000]
+    python instantanea.py convertir paquetes_sensores.json captura.npz
+
+En Python:
+    from instantanea import cargar
+    captura = cargar('captura.npz')
+    muestras = captura[1]['muestras']     # memmap (paquetes, 200, 13)
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+import urllib.request
+import zipfile
+
+import numpy as np
+
+from buffer_circular import SIN_SECUENCIA, muestras_desde_mediciones, texto_a_segundos
+
+VERSION = 1
+CAMPOS = (('muestras', np.float32), ('secuencias', np.int64), ('timestamps', np.float64), ('horas', np.int32),
+          ('secuencias_placa', np.int64))
+# Campos que pueden faltar (instantáneas anteriores) y su valor por defecto
+OPCIONALES = {'secuencias_placa': SIN_SECUENCIA}
+URL_POR_DEFECTO = 'http://127.0.0.1:5000'
+
+# Cabecera local de un miembro del zip: firma, versión, flags, método, hora,
+# fecha, crc, tamaños, longitud del nombre y del campo extra
+CABECERA_ZIP = struct.Struct('<4s5H3I2H')
+
+
+def _nombre(tarjeta_id, campo):
+    return f'tarjeta{tarjeta_id}_{campo}'
+
+
+def escribir(destino, paquetes, esquemas, ultima_secuencia=0):
+    """Guarda un .npz en `destino` (ruta o archivo abierto en binario).
+
+    `paquetes` es {tarjeta: {campo: arreglo}} con los campos de CAMPOS y
+    `esquemas` {tarjeta: dict del esquema} (ver EsquemaTarjeta.a_dict).
+    """
+    meta = {
+        'version': VERSION,
+        'creada': time.time(),
+        'ultima_secuencia': int(ultima_secuencia),
+        'tarjetas': [dict(esquemas[tarjeta_id], id=tarjeta_id) for tarjeta_id in paquetes]
+    }
+    arreglos = {'meta': np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)}
+    for tarjeta_id, campos in paquetes.items():
+        for campo, dtype in CAMPOS:
+            arreglos[_nombre(tarjeta_id, campo)] = np.ascontiguousarray(campos[campo], dtype=dtype)
+    np.savez(destino, **arreglos)
+
+
+def exportar(destino, buffers, esquemas, ultima_secuencia=0):
+    """Instantánea de los paquetes retenidos en `buffers` ({tarjeta: BufferCircular}).
+
+    Llamar con el bloqueo de lectura tomado para que no cambien a mitad.
+    """
+    paquetes = {}
+    for tarjeta_id, buf in buffers.items():
+        pos = buf.posiciones()
+        paquetes[tarjeta_id] = {'muestras': buf.muestras[pos], 'secuencias': buf.secuencias[pos],
+                                'timestamps': buf.timestamps[pos], 'horas': buf.horas[pos],
+                                'secuencias_placa': buf.secuencias_placa[pos]}
+    escribir(destino, paquetes, esquemas, ultima_secuencia)
+
+
+def _mapear_npz(ruta):
+    """{nombre: memmap} de los miembros de un .npz sin comprimir"""
+    arreglos = {}
+    with zipfile.ZipFile(ruta) as zf, open(ruta, 'rb') as f:
+        for info in zf.infolist():
+            if not info.filename.endswith('.npy'):
+                continue
+            nombre = info.filename[:-4]
+            if info.compress_type != zipfile.ZIP_STORED:
+                # Comprimido (p. ej. np.savez_compressed): no se puede mapear, se lee
+                arreglos[nombre] = np.load(zf.open(info))
+                continue
+            f.seek(info.header_offset)
+            campos = CABECERA_ZIP.unpack(f.read(CABECERA_ZIP.size))
+            f.seek(info.header_offset + CABECERA_ZIP.size + campos[-2] + campos[-1])
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                forma, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                forma, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                raise ValueError(f"{nombre}: arreglos de objetos no admitidos")
+            if 0 in forma:
+                arreglos[nombre] = np.empty(forma, dtype=dtype)
+            else:
+                arreglos[nombre] = np.memmap(ruta, dtype=dtype, mode='r', offset=f.tell(), shape=forma,
+                                             order='F' if fortran else 'C')
+    return arreglos
+
+
+class Instantanea:
+    """Paquetes de una instantánea por tarjeta; captura[tarjeta][campo]"""
+
+    def __init__(self, arreglos):
+        if 'meta' not in arreglos:
+            raise ValueError('Instantánea inválida: falta "meta"')
+        self.meta = json.loads(bytes(np.asarray(arreglos['meta'])).decode())
+        if self.meta.get('version') != VERSION:
+            raise ValueError(f"Versión de instantánea no admitida: {self.meta.get('version')}")
+        self.esquemas = {int(e['id']): e for e in self.meta['tarjetas']}
+        self.ids = tuple(self.esquemas)
+        self.ultima_secuencia = int(self.meta.get('ultima_secuencia', 0))
+        self._arreglos = arreglos
+        for tarjeta_id in self.ids:
+            campos = self[tarjeta_id]
+            if len({len(v) for v in campos.values()}) != 1 or campos['muestras'].ndim != 3:
+                raise ValueError(f"Instantánea inválida: campos inconsistentes en la tarjeta {tarjeta_id}")
+
+    def __getitem__(self, tarjeta_id):
+        if tarjeta_id not in self.esquemas:
+            raise KeyError(f"La instantánea no tiene la tarjeta {tarjeta_id}")
+        campos = {}
+        for campo, dtype in CAMPOS:
+            nombre = _nombre(tarjeta_id, campo)
+            if nombre in self._arreglos:
+                campos[campo] = self._arreglos[nombre]
+            elif campo in OPCIONALES and 'secuencias' in campos:
+                campos[campo] = np.full(len(campos['secuencias']), OPCIONALES[campo], dtype=dtype)
+            else:
+                raise ValueError(f"Instantánea inválida: falta {nombre}")
+        return campos
+
+    def __len__(self):
+        """Paquetes en total"""
+        return sum(len(self[tarjeta_id]['secuencias']) for tarjeta_id in self.ids)
+
+
+def cargar(origen, mmap=True):
+    """Abre una instantánea (ruta o archivo binario); ValueError si no lo es.
+
+    Desde una ruta y con `mmap` los arreglos quedan mapeados en memoria y no
+    se lee nada hasta usarlos.
+    """
+    try:
+        if mmap and isinstance(origen, (str, os.PathLike)):
+            arreglos = _mapear_npz(origen)
+        else:
+            if not zipfile.is_zipfile(origen):
+                raise ValueError('Instantánea inválida: no es un .npz')
+            if hasattr(origen, 'seek'):
+                origen.seek(0)
+            with np.load(origen) as npz:
+                arreglos = {nombre: npz[nombre] for nombre in npz.files}
+        return Instantanea(arreglos)
+    except (OSError, EOFError, KeyError, zipfile.BadZipFile, json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ValueError(f"Instantánea inválida: {e}")
+
+
+def convertir_json(datos):
+    """{tarjeta: campos} desde el paquetes_sensores.json de versiones anteriores"""
+    paquetes, esquemas = {}, {}
+    secuencia = 0
+    for clave, lista in sorted(datos.items()):
+        if not clave.startswith('tarjeta') or not lista:
+            continue
+        tarjeta_id = int(clave[len('tarjeta'):])
+        primera = lista[0]['mediciones'][0]
+        flujos, presiones = len(primera['flujos']), len(primera['presiones'])
+        muestras = np.stack([muestras_desde_mediciones(p['mediciones'], 1 + flujos + presiones) for p in lista])
+        paquetes[tarjeta_id] = {
+            'muestras': muestras,
+            'secuencias': np.arange(secuencia + 1, secuencia + 1 + len(lista)),
+            'timestamps': [p['timestamp'] for p in lista],
+            'horas': [texto_a_segundos(p['hora_inicio']) for p in lista],
+            'secuencias_placa': np.full(len(lista), SIN_SECUENCIA)
+        }
+        esquemas[tarjeta_id] = {'flujos': flujos, 'presiones': presiones, 'muestras': muestras.shape[1]}
+        secuencia += len(lista)
+    return paquetes, esquemas, secuencia
+
+
+def _info(args):
+    captura = cargar(args.archivo)
+    creada = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(captura.meta['creada']))
+    print(f"{args.archivo}: {len(captura)} paquetes, creada {creada}, última secuencia {captura.ultima_secuencia}")
+    for tarjeta_id in captura.ids:
+        campos = captura[tarjeta_id]
+        esquema = captura.esquemas[tarjeta_id]
+        n = len(campos['secuencias'])
+        rango = ''
+        if n:
+            desde, hasta = (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+                            for t in (campos['timestamps'][0], campos['timestamps'][-1]))
+            rango = f", {desde} .. {hasta}"
+        print(f"  tarjeta {tarjeta_id}: {n} paquetes de {esquema['muestras']} muestras, "
+              f"{esquema['flujos']} flujos + {esquema['presiones']} presiones{rango}")
+
+
+def _descargar(args):
+    url = args.url.rstrip('/') + '/instantanea'
+    if args.tarjetas:
+        url += f'?tarjetas={args.tarjetas}'
+    with urllib.request.urlopen(url, timeout=args.timeout) as respuesta, open(args.archivo, 'wb') as f:
+        while True:
+            bloque = respuesta.read(1024 * 1024)
+            if not bloque:
+                break
+            f.write(bloque)
+    print(f"✅ {args.archivo}: {len(cargar(args.archivo))} paquetes")
+
+
+def _subir(args):
+    cargar(args.archivo)  # falla aquí, antes de enviar nada, si el archivo no vale
+    with open(args.archivo, 'rb') as f:
+        peticion = urllib.request.Request(args.url.rstrip('/') + '/instantanea', data=f.read(), method='POST',
+                                          headers={'Content-Type': 'application/octet-stream'})
+    with urllib.request.urlopen(peticion, timeout=args.timeout) as respuesta:
+        print(json.loads(respuesta.read()))
+
+
+def _convertir(args):
+    with open(args.origen) as f:
+        paquetes, esquemas, ultima_secuencia = convertir_json(json.load(f))
+    escribir(args.archivo, paquetes, esquemas, ultima_secuencia)
+    print(f"✅ {args.archivo}: {ultima_secuencia} paquetes de {len(paquetes)} tarjetas")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    sub = parser.add_subparsers(dest='orden', required=True)
+
+    p = sub.add_parser('info', help='resumen de una instantánea')
+    p.add_argument('archivo')
+    p.set_defaults(funcion=_info)
+
+    p = sub.add_parser('descargar', help='guarda la instantánea de un servidor')
+    p.add_argument('archivo')
+    p.add_argument('--url', default=URL_POR_DEFECTO)
+    p.add_argument('--tarjetas', help='ids separados por comas (por defecto todas)')
+    p.add_argument('--timeout', type=float, default=60)
+    p.set_defaults(funcion=_descargar)
+
+    p = sub.add_parser('subir', help='carga una instantánea en un servidor (reemplaza sus tarjetas)')
+    p.add_argument('archivo')
+    p.add_argument('--url', default=URL_POR_DEFECTO)
+    p.add_argument('--timeout', type=float, default=60)
+    p.set_defaults(funcion=_subir)
+
+    p = sub.add_parser('convertir', help='paquetes_sensores.json de versiones anteriores -> .npz')
+    p.add_argument('origen')
+    p.add_argument('archivo')
+    p.set_defaults(funcion=_convertir)
+
+    args = parser.parse_args(argv)
+    try:
+        args.funcion(args)
+    except (ValueError, OSError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""
+MÉTRICAS - CONTADORES, MEDIDORES E HISTOGRAMAS EN FORMATO PROMETHEUS
+Implementación mínima del formato de texto de exposición (versión 0.0.4)
+sin dependencias externas.
+
+    recibidos = Contador('fugas_paquetes_recibidos_total', 'Paquetes aceptados', ('tarjeta',))
+    recibidos.incrementar(tarjeta=1)
+    with latencia.medir(etapa='parseo'):
+        ...
+    texto = exponer()
+
+Los valores viven en la memoria del proceso. Con varios workers de gunicorn,
+compartir(directorio) hace que cada proceso vuelque sus contadores e
+histogramas a su propio archivo cada INTERVALO_VOLCADO s y que exponer() sume
+los de todos (los medidores fijados toman el máximo; los calculados con
+`funcion` se leen del estado que ya comparten los workers). Los archivos de
+workers que terminaron se conservan para que los totales no retrocedan.
+"""
+
+import bisect
+import json
+import math
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+CUBETAS_LATENCIA = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                    0.1, 0.25, 0.5, 1.0, 2.5)
+CUBETAS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+INTERVALO_VOLCADO = 1.0
+
+_metricas = []
+# Volcado por proceso: directorio, archivo de este proceso, pid que lo creó, último texto
+# escrito y pid que arrancó el hilo de volcado
+_volcado = {'directorio': None, 'archivo': None, 'pid': None, 'escrito': None, 'hilo': None}
+_lock_volcado = threading.Lock()
+
+
+def _formatear(valor):
+    if valor == math.inf:
+        return '+Inf'
+    if valor == -math.inf:
+        return '-Inf'
+    if isinstance(valor, float) and valor.is_integer() and abs(valor) < 1e15:
+        return str(int(valor))
+    return repr(valor)
+
+
+def _etiquetas_texto(nombres, valores, extra=()):
+    pares = [f'{n}="{str(v)}"' for n, v in zip(nombres, valores)] + list(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._series = {}
+        _metricas.append(self)
+
+    def _clave(self, valores):
+        if set(valores) != set(self.etiquetas):
+            raise ValueError(f"{self.nombre} espera las etiquetas {self.etiquetas}")
+        return tuple(str(valores[n]) for n in self.etiquetas)
+
+    # Se vuelca a archivo para sumarse con los demás workers
+    volcable = True
+
+    def series(self):
+        with self._lock:
+            return {clave: self._copia(valor) for clave, valor in self._series.items()}
+
+    def lineas(self, series=None):
+        """Líneas de exposición de `series` (por defecto, las de este proceso)"""
+        if series is None:
+            series = self.series()
+        yield f"# HELP {self.nombre} {self.ayuda}"
+        yield f"# TYPE {self.nombre} {self.tipo}"
+        for clave, valor in sorted(series.items()):
+            yield from self._lineas_serie(clave, valor)
+
+    def _copia(self, valor):
+        return valor
+
+    def _combinar(self, a, b):
+        return a + b
+
+    def _lineas_serie(self, clave, valor):
+        yield f"{self.nombre}{_etiquetas_texto(self.etiquetas, clave)} {_formatear(valor)}"
+
+
+class Contador(_Metrica):
+    """Valor que solo crece (paquetes, bytes, errores)"""
+    tipo = 'counter'
+
+    def incrementar(self, cantidad=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._series[clave] = self._series.get(clave, 0) + cantidad
+
+
+class Medidor(_Metrica):
+    """Valor que sube y baja; con `funcion` se calcula al exponer.
+
+    `funcion()` devuelve {tupla de valores de etiquetas: valor}.
+    """
+    tipo = 'gauge'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), funcion=None):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.funcion = funcion
+        self.volcable = funcion is None
+
+    def fijar(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._series[clave] = valor
+
+    def series(self):
+        if self.funcion is not None:
+            series = {tuple(str(v) for v in clave): valor for clave, valor in self.funcion().items()}
+            with self._lock:
+                self._series = series
+        return super().series()
+
+    def _combinar(self, a, b):
+        return max(a, b)
+
+
+class Histograma(_Metrica):
+    """Distribución en cubetas acumuladas, con suma y cuenta"""
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), cubetas=CUBETAS_LATENCIA):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.cubetas = tuple(sorted(cubetas))
+
+    def observar(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        indice = bisect.bisect_left(self.cubetas, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * (len(self.cubetas) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        """Observa los segundos que tarda el bloque"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+    def _copia(self, valor):
+        return [list(valor[0]), valor[1], valor[2]]
+
+    def _combinar(self, a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def _lineas_serie(self, clave, valor):
+        cuentas, suma, total = valor
+        acumulado = 0
+        for limite, cuenta in zip(self.cubetas + (math.inf,), cuentas):
+            acumulado += cuenta
+            etiquetas = _etiquetas_texto(self.etiquetas, clave, (f'le="{_formatear(float(limite))}"',))
+            yield f"{self.nombre}_bucket{etiquetas} {acumulado}"
+        etiquetas = _etiquetas_texto(self.etiquetas, clave)
+        yield f"{self.nombre}_sum{etiquetas} {_formatear(suma)}"
+        yield f"{self.nombre}_count{etiquetas} {total}"
+
+
+def compartir(directorio):
+    """Vuelca las métricas de este proceso en `directorio` y suma las de todos al exponer (None lo desactiva)"""
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    with _lock_volcado:
+        if directorio != _volcado['directorio']:
+            _volcado.update(directorio=directorio, archivo=None, pid=None, escrito=None)
+        iniciar = directorio is not None and _volcado['hilo'] != os.getpid()
+        if iniciar:
+            _volcado['hilo'] = os.getpid()
+    if iniciar:
+        threading.Thread(target=_volcar_periodicamente, name='volcado_metricas', daemon=True).start()
+
+
+def borrar_volcados(directorio):
+    """Olvida los archivos de arranques anteriores (llamar antes de que los workers vuelquen)"""
+    try:
+        nombres = os.listdir(directorio)
+    except OSError:
+        return
+    for nombre in nombres:
+        if nombre.endswith('.json'):
+            try:
+                os.remove(os.path.join(directorio, nombre))
+            except OSError:
+                pass
+
+
+def volcar():
+    """Escribe las métricas volcables de este proceso en su archivo (si cambiaron)"""
+    with _lock_volcado:
+        directorio = _volcado['directorio']
+        if directorio is None:
+            return
+        if _volcado['pid'] != os.getpid():
+            # Proceso nuevo (o hijo de un fork): archivo propio, distinto aunque se repita el pid
+            _volcado.update(pid=os.getpid(), archivo=f"{os.getpid()}_{secrets.token_hex(4)}.json", escrito=None)
+        texto = json.dumps({m.nombre: [[list(clave), valor] for clave, valor in m.series().items()]
+                            for m in _metricas if m.volcable})
+        ruta = os.path.join(directorio, _volcado['archivo'])
+        if texto == _volcado['escrito'] and os.path.exists(ruta):
+            return
+        with open(ruta + '.tmp', 'w') as f:
+            f.write(texto)
+        os.replace(ruta + '.tmp', ruta)
+        _volcado['escrito'] = texto
+
+
+def _volcar_periodicamente():
+    while True:
+        time.sleep(INTERVALO_VOLCADO)
+        try:
+            volcar()
+        except OSError:
+            pass
+
+
+def _sumar_volcados(directorio):
+    """{nombre: {clave: valor}} combinando los archivos de todos los procesos"""
+    volcar()
+    por_nombre = {m.nombre: m for m in _metricas if m.volcable}
+    combinadas = {nombre: {} for nombre in por_nombre}
+    for nombre_archivo in os.listdir(directorio):
+        if not nombre_archivo.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directorio, nombre_archivo)) as f:
+                volcado = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for nombre, series in volcado.items():
+            metrica = por_nombre.get(nombre)
+            if metrica is None:
+                continue
+            destino = combinadas[nombre]
+            for clave, valor in series:
+                clave = tuple(clave)
+                destino[clave] = valor if clave not in destino else metrica._combinar(destino[clave], valor)
+    return combinadas
+
+
+def exponer():
+    """Todas las métricas registradas en formato de texto de Prometheus"""
+    directorio = _volcado['directorio']
+    combinadas = _sumar_volcados(directorio) if directorio is not None else {}
+    lineas = []
+    for metrica in _metricas:
+        lineas.extend(metrica.lineas(combinadas.get(metrica.nombre)))
+    return '\n'.join(lineas) + '\n'
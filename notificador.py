@@ -0,0 +1,42 @@
+"""
+NOTIFICADOR - CANAL DE EVENTOS PARA EL PANEL Y LA RASPBERRY
+Difunde eventos numerados ('paquete', 'estado', 'analisis', 'recarga') a
+clientes Server-Sent Events y long-poll sin que tengan que sondear.
+
+Cada evento lleva una versión creciente. Un cliente pide los eventos
+posteriores a la última versión que vio; si ya salieron del historial se
+le indica que recargue el estado completo.
+"""
+
+import threading
+from collections import deque
+
+
+class Notificador:
+    """Historial acotado de eventos con espera bloqueante por versión"""
+
+    def __init__(self, historial=512):
+        self._cond = threading.Condition()
+        self._eventos = deque(maxlen=historial)
+        self.version = 0
+
+    def publicar(self, tipo, datos):
+        with self._cond:
+            self.version += 1
+            self._eventos.append({'version': self.version, 'tipo': tipo, 'datos': datos})
+            self._cond.notify_all()
+
+    def esperar(self, desde, timeout):
+        """Eventos con versión > `desde`, esperando hasta `timeout` s si no hay ninguno.
+
+        Devuelve (eventos, incompleto); `incompleto` es True cuando parte de
+        lo ocurrido desde `desde` ya no está en el historial.
+        """
+        with self._cond:
+            if desde > self.version:
+                # Versión de antes de reiniciar el servidor
+                return list(self._eventos), True
+            self._cond.wait_for(lambda: self.version > desde, timeout)
+            eventos = [e for e in self._eventos if e['version'] > desde]
+            incompleto = bool(eventos) and eventos[0]['version'] > desde + 1
+            return eventos, incompleto
@@ -0,0 +1,248 @@
+"""
+PARSER DE PAQUETES - PROTOCOLOS DE TEXTO Y BINARIO
+Convierte el cuerpo enviado por el Arduino en un arreglo float32 de una pasada.
+
+Formato de texto:
+    PAQUETE
+    hh,mm,ss[,secuencia]
+    TARJETAn
+    tiempo_muestreo,flujo1..flujo6,presion1..presion6   (200 filas)
+    FIN_PAQUETE
+
+Formato binario (little-endian, ~4x más pequeño que el de texto):
+    cabecera   12 bytes  'FUGA', versión u8, banderas u8, tarjeta u8,
+                         hora u8, minuto u8, segundo u8, num_muestras u16
+    secuencia  uint32 opcional (bandera 0x02)
+    tiempos    num_muestras x uint32  (tiempo de muestreo, ms)
+    valores    num_muestras x 12 float32  (6 flujos y 6 presiones por muestra)
+    crc32      uint32 opcional (bandera 0x01) sobre todo lo anterior
+
+La secuencia es un contador propio de cada tarjeta: si el firmware la envía,
+el servidor descarta los reintentos por ella y cuenta exactamente los
+paquetes perdidos. Sin ella los parsers devuelven secuencia None.
+"""
+
+import io
+import struct
+import zlib
+
+import numpy as np
+
+NUM_MUESTRAS = 200
+NUM_COLUMNAS = 13
+
+CABECERA_TRAMA = struct.Struct('<4sBBBBBBH')
+MAGIA_TRAMA = b'FUGA'
+VERSION_TRAMA = 1
+BANDERA_CRC = 0x01
+BANDERA_SECUENCIA = 0x02
+
+
+class PaqueteInvalido(ValueError):
+    """El cuerpo recibido no respeta el protocolo"""
+
+
+def _parsear_hora(linea):
+    """'hh,mm,ss[,secuencia]' -> ((hora, minuto, segundo), secuencia o None)"""
+    try:
+        campos = [int(v) for v in linea.split(',')]
+    except ValueError:
+        raise PaqueteInvalido(f"Hora inválida: {linea!r}")
+    if len(campos) not in (3, 4):
+        raise PaqueteInvalido(f"Hora inválida: {linea!r}")
+    hora, minuto, segundo = campos[:3]
+    if not (0 <= hora < 24 and 0 <= minuto < 60 and 0 <= segundo < 60):
+        raise PaqueteInvalido(f"Hora fuera de rango: {linea!r}")
+    secuencia = campos[3] if len(campos) == 4 else None
+    if secuencia is not None and not 0 <= secuencia < 2 ** 32:
+        raise PaqueteInvalido(f"Secuencia fuera de rango: {linea!r}")
+    return (hora, minuto, segundo), secuencia
+
+
+def _parsear_tarjeta(linea):
+    if not linea.startswith('TARJETA'):
+        raise PaqueteInvalido(f"Línea de tarjeta inválida: {linea!r}")
+    try:
+        return int(linea[len('TARJETA'):])
+    except ValueError:
+        raise PaqueteInvalido(f"Línea de tarjeta inválida: {linea!r}")
+
+
+def _encuadre(texto, num_muestras, num_columnas, formas):
+    """Cabecera, tarjeta, hora y número de filas -> (tarjeta_id, hora, secuencia, cuerpo, num_muestras, num_columnas)"""
+    partes = texto.strip().split('\n', 3)
+    if len(partes) < 4 or partes[0].strip() != 'PAQUETE':
+        raise PaqueteInvalido('Formato inválido')
+    cuerpo, _, fin = partes[3].rpartition('\n')
+    if fin.strip() != 'FIN_PAQUETE':
+        raise PaqueteInvalido('Formato inválido')
+
+    hora, secuencia = _parsear_hora(partes[1].strip())
+    tarjeta_id = _parsear_tarjeta(partes[2].strip())
+    if formas is not None:
+        num_muestras, num_columnas = formas(tarjeta_id)
+
+    filas = cuerpo.count('\n') + 1 if cuerpo else 0
+    if filas != num_muestras:
+        raise PaqueteInvalido(f"Se esperaban {num_muestras} filas, llegaron {filas}")
+    return tarjeta_id, hora, secuencia, cuerpo, num_muestras, num_columnas
+
+
+def validar_paquete(texto, num_muestras=NUM_MUESTRAS, num_columnas=NUM_COLUMNAS, formas=None):
+    """Solo el encuadre del paquete, sin convertir números -> (tarjeta_id, (hora, minuto, segundo))
+
+    Lanza PaqueteInvalido por lo mismo que parsear_paquete salvo filas con
+    valores mal escritos, que se detectan al parsearlo.
+    """
+    tarjeta_id, hora, _, _, _, _ = _encuadre(texto, num_muestras, num_columnas, formas)
+    return tarjeta_id, hora
+
+
+def parsear_paquete(texto, num_muestras=NUM_MUESTRAS, num_columnas=NUM_COLUMNAS, formas=None):
+    """Texto del protocolo -> (tarjeta_id, (hora, minuto, segundo), muestras, secuencia)
+
+    `muestras` es un arreglo float32 de forma (num_muestras, num_columnas).
+    Con `formas(tarjeta_id)` -> (num_muestras, num_columnas) la forma depende
+    de la tarjeta (la función lanza PaqueteInvalido si no la conoce).
+    Cabecera, tarjeta y número de filas se validan antes de convertir números,
+    así un paquete mal formado se rechaza sin coste apreciable.
+    """
+    tarjeta_id, hora, secuencia, cuerpo, num_muestras, num_columnas = _encuadre(
+        texto, num_muestras, num_columnas, formas)
+
+    # Conversión en bloque (C) de todas las filas a la vez
+    try:
+        muestras = np.loadtxt(io.StringIO(cuerpo), delimiter=',', dtype=np.float32, ndmin=2)
+    except ValueError as e:
+        raise PaqueteInvalido(f"Fila con formato inválido: {e}")
+    if muestras.shape != (num_muestras, num_columnas):
+        raise PaqueteInvalido(f"Se esperaban {num_columnas} columnas por fila, llegaron {muestras.shape[1]}")
+    if not np.isfinite(muestras).all():
+        raise PaqueteInvalido('Valores no numéricos en las mediciones')
+
+    return tarjeta_id, hora, muestras, secuencia
+
+
+def parsear_trama(datos, num_muestras=NUM_MUESTRAS, num_columnas=NUM_COLUMNAS, formas=None):
+    """Trama binaria -> (tarjeta_id, (hora, minuto, segundo), tiempos, valores, secuencia)
+
+    `tiempos` (uint32) y `valores` (float32, num_muestras x canales) son vistas
+    sobre `datos` creadas con np.frombuffer, sin copiar ni convertir el cuerpo.
+    `formas` como en parsear_paquete.
+    """
+    datos = memoryview(datos)
+    if len(datos) < CABECERA_TRAMA.size:
+        raise PaqueteInvalido('Trama demasiado corta')
+    magia, version, banderas, tarjeta_id, hora, minuto, segundo, n = CABECERA_TRAMA.unpack_from(datos)
+    if magia != MAGIA_TRAMA or version != VERSION_TRAMA:
+        raise PaqueteInvalido('Cabecera de trama inválida')
+    if not (hora < 24 and minuto < 60 and segundo < 60):
+        raise PaqueteInvalido('Hora fuera de rango')
+    if formas is not None:
+        num_muestras, num_columnas = formas(tarjeta_id)
+    if n != num_muestras:
+        raise PaqueteInvalido(f"Se esperaban {num_muestras} muestras, llegaron {n}")
+
+    canales = num_columnas - 1
+    offset_tiempos = CABECERA_TRAMA.size + (4 if banderas & BANDERA_SECUENCIA else 0)
+    offset_valores = offset_tiempos + 4 * n
+    fin = offset_valores + 4 * n * canales
+    esperado = fin + (4 if banderas & BANDERA_CRC else 0)
+    if len(datos) != esperado:
+        raise PaqueteInvalido(f"Longitud de trama {len(datos)}, se esperaban {esperado} bytes")
+    if banderas & BANDERA_CRC:
+        crc, = struct.unpack_from('<I', datos, fin)
+        if zlib.crc32(datos[:fin]) != crc:
+            raise PaqueteInvalido('CRC de trama incorrecto')
+
+    secuencia = None
+    if banderas & BANDERA_SECUENCIA:
+        secuencia, = struct.unpack_from('<I', datos, CABECERA_TRAMA.size)
+    tiempos = np.frombuffer(datos, dtype='<u4', count=n, offset=offset_tiempos)
+    valores = np.frombuffer(datos, dtype='<f4', count=n * canales, offset=offset_valores).reshape(n, canales)
+    if not np.isfinite(valores).all():
+        raise PaqueteInvalido('Valores no numéricos en las mediciones')
+    return tarjeta_id, (hora, minuto, segundo), tiempos, valores, secuencia
+
+
+def construir_trama(tarjeta_id, hora, tiempos, valores, crc=True, secuencia=None):
+    """Codifica una trama binaria (referencia para el firmware y las pruebas)"""
+    tiempos = np.ascontiguousarray(tiempos, dtype='<u4')
+    valores = np.ascontiguousarray(valores, dtype='<f4')
+    banderas = (BANDERA_CRC if crc else 0) | (BANDERA_SECUENCIA if secuencia is not None else 0)
+    cabecera = CABECERA_TRAMA.pack(MAGIA_TRAMA, VERSION_TRAMA, banderas, tarjeta_id, *hora, len(tiempos))
+    if secuencia is not None:
+        cabecera += struct.pack('<I', secuencia)
+    trama = cabecera + tiempos.tobytes() + valores.tobytes()
+    if crc:
+        trama += struct.pack('<I', zlib.crc32(trama))
+    return trama
+
+
+def dividir_lote_texto(texto):
+    """Separa un lote de texto en bloques PAQUETE...FIN_PAQUETE"""
+    for bloque in texto.split('FIN_PAQUETE'):
+        if bloque.strip():
+            yield bloque + 'FIN_PAQUETE'
+
+
+def _siguiente_cabecera(datos, desde):
+    """Posición de la próxima cabecera ('FUGA' + versión) en `datos` (bytes) desde `desde`, o el final"""
+    pos = datos.find(MAGIA_TRAMA + bytes([VERSION_TRAMA]), desde)
+    return len(datos) if pos < 0 else pos
+
+
+def _fin_trama(datos, pos, fijo, n):
+    """Fin de una trama sin saber sus canales: la siguiente cabecera cuyo hueco
+    cabe un número entero de columnas de `n` muestras (o el final del lote)"""
+    desde = pos + fijo
+    while True:
+        siguiente = _siguiente_cabecera(datos, desde)
+        cuerpo = siguiente - pos - fijo
+        if siguiente == len(datos) or (n and cuerpo > 0 and cuerpo % (4 * n) == 0):
+            return siguiente
+        desde = siguiente + 1
+
+
+def dividir_lote_binario(datos, formas=None):
+    """Separa tramas binarias concatenadas usando la longitud de cada cabecera.
+
+    Devuelve cada trama (memoryview) o, por cada tramo que no se pudo separar,
+    un PaqueteInvalido con el número de bytes descartados en `sin_procesar`:
+    tras una cabecera inválida se sigue en la siguiente 'FUGA' del lote, así
+    una trama corrupta no se lleva por delante las posteriores.
+    Con `formas` (ver parsear_paquete) el número de canales sale de la
+    tarjeta de cada trama; la de una tarjeta desconocida se entrega hasta la
+    siguiente cabecera para que parsear_trama la rechace sola.
+    """
+    crudo = bytes(datos)
+    datos = memoryview(crudo)
+    pos = 0
+    while pos < len(datos):
+        if len(datos) - pos < CABECERA_TRAMA.size:
+            error = PaqueteInvalido(f"Trama demasiado corta al final del lote (byte {pos})")
+            error.sin_procesar = len(datos) - pos
+            yield error
+            return
+        magia, version, banderas, tarjeta_id, _, _, _, n = CABECERA_TRAMA.unpack_from(datos, pos)
+        if magia != MAGIA_TRAMA or version != VERSION_TRAMA:
+            siguiente = _siguiente_cabecera(crudo, pos + 1)
+            error = PaqueteInvalido(f"Cabecera de trama inválida en el byte {pos}, "
+                                    f"{siguiente - pos} bytes descartados")
+            error.sin_procesar = siguiente - pos
+            yield error
+            pos = siguiente
+            continue
+        fijo = (CABECERA_TRAMA.size + (4 if banderas & BANDERA_CRC else 0)
+                + (4 if banderas & BANDERA_SECUENCIA else 0))
+        try:
+            num_columnas = NUM_COLUMNAS if formas is None else formas(tarjeta_id)[1]
+        except PaqueteInvalido:
+            # Tarjeta desconocida: la trama llega hasta la siguiente cabecera y la rechaza parsear_trama
+            fin = _fin_trama(crudo, pos, fijo, n)
+            yield datos[pos:fin]
+            pos = fin
+            continue
+        longitud = fijo + 4 * n * num_columnas
+        yield datos[pos:pos + longitud]
+        pos += longitud
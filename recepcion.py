@@ -0,0 +1,201 @@
+"""
+RECEPCIÓN - CONTINUIDAD DE LOS PAQUETES DE CADA TARJETA
+Compara cada paquete con el último aceptado de su tarjeta para detectar
+huecos (paquetes perdidos) y llegadas fuera de orden.
+
+Con la secuencia que numera la placa el recuento de perdidos es exacto y
+no le afecta el desorden: es el rango de secuencias visto menos los
+paquetes recibidos. Sin ella se deduce de la hora de la placa: más de
+TOLERANCIA_HUECO veces la duración nominal de un paquete (muestras x
+periodo) sin datos cuenta como hueco, y un paquete atrasado que cae en el
+último hueco lo descuenta.
+
+Los duplicados se reconocen por la clave (hora de la placa, huella) de los
+últimos VENTANA_CLAVES paquetes aceptados de cada tarjeta, que no depende de
+lo que retenga el buffer: un reintento de un paquete ya confirmado y
+descartado también se descarta. La huella es la secuencia de la placa o,
+sin ella, el CRC32 de las muestras. Cada proceso indexa el anillo de claves
+en un dict (consulta O(1)) y lo pone al día con lo que hayan anexado otros
+workers, que se sabe por el total de claves escritas.
+
+Los contadores de todas las tarjetas viven en un solo arreglo (compartido
+entre workers con EstadoCompartido.arreglo), igual que las claves; se
+actualizan con el bloqueo exclusivo tomado, como los buffers.
+"""
+
+import zlib
+
+import numpy as np
+
+from buffer_circular import SIN_SECUENCIA
+
+CAMPOS = ('ultimo_tiempo', 'ultima_secuencia', 'duplicados', 'desordenados', 'huecos', 'perdidos',
+          'hueco_desde', 'hueco_hasta', 'primera_secuencia', 'recibidos', 'claves')
+(ULTIMO_TIEMPO, ULTIMA_SECUENCIA, DUPLICADOS, DESORDENADOS, HUECOS, PERDIDOS,
+ HUECO_DESDE, HUECO_HASTA, PRIMERA_SECUENCIA, RECIBIDOS, CLAVES) = range(len(CAMPOS))
+
+TOLERANCIA_HUECO = 1.5
+# Claves recordadas por tarjeta para descartar reintentos (1024 x 20 s son casi 6 h)
+VENTANA_CLAVES = 1024
+
+# Resultado de registrar()
+EN_ORDEN = 'en_orden'
+HUECO = 'hueco'
+DESORDENADO = 'desordenado'
+DUPLICADO = 'duplicado'
+
+
+def huella(muestras, secuencia=SIN_SECUENCIA):
+    """Identifica un paquete junto a su hora: la secuencia de la placa o, sin ella, el CRC32 de las muestras"""
+    if secuencia != SIN_SECUENCIA:
+        return int(secuencia)
+    # Negativa para no confundirse con una secuencia
+    return -1 - zlib.crc32(np.ascontiguousarray(muestras))
+
+
+class ControlRecepcion:
+    """Último paquete visto y contadores de pérdidas por tarjeta"""
+
+    def __init__(self, ids, arreglos=None):
+        """`arreglos(nombre, forma, dtype)` como en BufferCircular"""
+        if arreglos is None:
+            arreglos = lambda nombre, forma, dtype: np.zeros(forma, dtype=dtype)
+        self.indices = {tarjeta_id: i for i, tarjeta_id in enumerate(ids)}
+        self._datos = arreglos('recepcion', (len(self.indices), len(CAMPOS)), np.int64)
+        # (hora de la placa, huella) de los últimos paquetes aceptados; hora 0 = ranura libre
+        self._claves = arreglos('recepcion_claves', (len(self.indices), VENTANA_CLAVES, 2), np.int64)
+        # Por tarjeta, en este proceso: clave -> número de orden, copia de cada ranura y claves indexadas
+        self._indice = [{} for _ in self.indices]
+        self._en_ranura = [[None] * VENTANA_CLAVES for _ in self.indices]
+        self._indexadas = [0] * len(self.indices)
+
+    def _fila(self, tarjeta_id):
+        return self._datos[self.indices[tarjeta_id]]
+
+    def iniciar(self, tarjeta_id, tiempo, secuencia=SIN_SECUENCIA):
+        """Toma como último paquete uno ya guardado (al cargar) si aún no hay ninguno"""
+        fila = self._fila(tarjeta_id)
+        if not fila[ULTIMO_TIEMPO]:
+            fila[ULTIMO_TIEMPO] = tiempo
+            fila[ULTIMA_SECUENCIA] = fila[PRIMERA_SECUENCIA] = secuencia
+            fila[RECIBIDOS] = 1
+
+    def duplicado(self, tarjeta_id):
+        self._fila(tarjeta_id)[DUPLICADOS] += 1
+
+    def visto(self, tarjeta_id, tiempo, clave):
+        """¿Se aceptó ya un paquete con esta hora de la placa y huella? (entre los últimos VENTANA_CLAVES)"""
+        i = self.indices[tarjeta_id]
+        self._indexar(i)
+        return (int(tiempo), int(clave)) in self._indice[i]
+
+    def _recordar(self, tarjeta_id, tiempo, clave):
+        i = self.indices[tarjeta_id]
+        fila = self._datos[i]
+        self._claves[i, fila[CLAVES] % VENTANA_CLAVES] = (tiempo, clave)
+        fila[CLAVES] += 1
+        self._indexar(i)
+
+    def _indexar(self, i):
+        """Pasa al dict las claves anexadas al anillo desde la última vez; sale la que cada una pisa"""
+        total = int(self._datos[i, CLAVES])
+        indice, en_ranura = self._indice[i], self._en_ranura[i]
+        desde = self._indexadas[i]
+        if total < desde or total - desde > VENTANA_CLAVES:
+            # Arreglo recreado o más claves nuevas de las que caben: se rehace desde el anillo
+            indice.clear()
+            en_ranura[:] = [None] * VENTANA_CLAVES
+            desde = max(0, total - VENTANA_CLAVES)
+        for numero in range(desde, total):
+            ranura = numero % VENTANA_CLAVES
+            vieja = en_ranura[ranura]
+            if vieja is not None and indice.get(vieja) == numero - VENTANA_CLAVES:
+                del indice[vieja]
+            tiempo, clave = self._claves[i, ranura]
+            en_ranura[ranura] = (int(tiempo), int(clave))
+            indice[en_ranura[ranura]] = numero
+        self._indexadas[i] = total
+
+    def registrar(self, tarjeta_id, tiempo, secuencia, duracion, clave):
+        """Clasifica un paquete -> (EN_ORDEN | HUECO | DESORDENADO | DUPLICADO, perdidos).
+
+        `tiempo` es la hora de la placa en epoch s, `duracion` la de un
+        paquete de la tarjeta en s y `clave` su huella(), que se recuerda si
+        el paquete se acepta. `perdidos` son los que faltan entre el último y
+        este; uno desordenado no mueve la referencia. Los duplicados que no
+        se vieron con visto() (la misma secuencia que el último) se cuentan aquí.
+        """
+        fila = self._fila(tarjeta_id)
+        if not fila[ULTIMO_TIEMPO]:
+            self.iniciar(tarjeta_id, tiempo, secuencia)
+            self._recordar(tarjeta_id, tiempo, clave)
+            return EN_ORDEN, 0
+        ultimo_tiempo, ultima_secuencia = int(fila[ULTIMO_TIEMPO]), int(fila[ULTIMA_SECUENCIA])
+        estado, perdidos = EN_ORDEN, 0
+        if secuencia != SIN_SECUENCIA and ultima_secuencia != SIN_SECUENCIA:
+            salto = secuencia - ultima_secuencia
+            if salto == 0 and tiempo <= ultimo_tiempo:
+                # Reenvío del último paquete (aunque la hora no coincida)
+                fila[DUPLICADOS] += 1
+                return DUPLICADO, 0
+            if salto < 1 and tiempo > ultimo_tiempo:
+                # La secuencia retrocede pero la hora avanza: la placa reinició su contador
+                fila[PERDIDOS] += self._perdidos_secuencia(fila)
+                fila[PRIMERA_SECUENCIA] = secuencia
+                fila[RECIBIDOS] = 0
+            elif salto < 1:
+                estado = DESORDENADO
+            elif salto > 1:
+                estado, perdidos = HUECO, salto - 1
+            fila[PRIMERA_SECUENCIA] = min(fila[PRIMERA_SECUENCIA], secuencia)
+            fila[RECIBIDOS] += 1
+        elif secuencia != SIN_SECUENCIA:
+            # Primera secuencia de una placa que antes no la enviaba
+            fila[PRIMERA_SECUENCIA] = secuencia
+            fila[RECIBIDOS] = 1
+        else:
+            salto = tiempo - ultimo_tiempo
+            if salto < 0:
+                estado = DESORDENADO
+                if fila[HUECO_DESDE] < tiempo < fila[HUECO_HASTA] and fila[PERDIDOS]:
+                    fila[PERDIDOS] -= 1
+            elif salto > TOLERANCIA_HUECO * duracion:
+                estado, perdidos = HUECO, max(1, round(salto / duracion) - 1)
+                fila[PERDIDOS] += perdidos
+
+        self._recordar(tarjeta_id, tiempo, clave)
+        if estado == DESORDENADO:
+            fila[DESORDENADOS] += 1
+            return estado, 0
+        if estado == HUECO:
+            fila[HUECOS] += 1
+            fila[HUECO_DESDE] = ultimo_tiempo
+            fila[HUECO_HASTA] = tiempo
+        fila[ULTIMO_TIEMPO] = tiempo
+        fila[ULTIMA_SECUENCIA] = secuencia
+        return estado, perdidos
+
+    @staticmethod
+    def _perdidos_secuencia(fila):
+        """Secuencias que faltan desde la primera vista hasta la última"""
+        if not fila[ULTIMO_TIEMPO] or fila[ULTIMA_SECUENCIA] == SIN_SECUENCIA:
+            return 0
+        return max(0, int(fila[ULTIMA_SECUENCIA] - fila[PRIMERA_SECUENCIA] + 1 - fila[RECIBIDOS]))
+
+    def perdidos(self, tarjeta_id):
+        fila = self._fila(tarjeta_id)
+        return int(fila[PERDIDOS]) + self._perdidos_secuencia(fila)
+
+    def estado(self, tarjeta_id):
+        """Contadores de la tarjeta; el último hueco como (desde, hasta) en hora de la placa"""
+        fila = self._fila(tarjeta_id)
+        return {
+            'ultimo_paquete': int(fila[ULTIMO_TIEMPO]) or None,
+            'ultima_secuencia': (int(fila[ULTIMA_SECUENCIA])
+                                 if fila[ULTIMO_TIEMPO] and fila[ULTIMA_SECUENCIA] != SIN_SECUENCIA else None),
+            'duplicados': int(fila[DUPLICADOS]),
+            'desordenados': int(fila[DESORDENADOS]),
+            'huecos': int(fila[HUECOS]),
+            'perdidos': self.perdidos(tarjeta_id),
+            'ultimo_hueco': [int(fila[HUECO_DESDE]), int(fila[HUECO_HASTA])] if fila[HUECOS] else None
+        }
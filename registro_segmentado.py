@@ -0,0 +1,299 @@
+"""
+REGISTRO SEGMENTADO - PERSISTENCIA DE PAQUETES
+Log de solo-anexado repartido en segmentos, con compactación periódica
+y recuperación tolerante a caídas.
+
+Cada registro se escribe como [longitud u32][crc32 u32][datos]. Al leer,
+un registro truncado o con CRC inválido marca el final útil de su segmento,
+de modo que una escritura a medias tras una caída nunca se carga.
+
+Archivos en el directorio:
+    base_NNNNNN.log      estado completo escrito por compactar()
+    segmento_NNNNNN.log  registros anexados después de esa base
+Solo cuentan la base de mayor número y los segmentos posteriores a ella.
+
+Con la política 'lote' se hace fsync cada `lote_registros` registros o,
+si no llegan más, `lote_segundos` después del último: un temporizador
+vuelca lo pendiente aunque no haya otra escritura.
+
+Varios procesos pueden escribir el mismo registro si comparten el arreglo
+`compartido` (número de segmento actual y tamaños) y llaman a agregar() y
+compactar() con un bloqueo exclusivo común; cada escritura se vuelca
+antes de soltarlo.
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+CABECERA = struct.Struct('<II')
+POLITICAS_FSYNC = ('siempre', 'lote', 'nunca')
+
+
+def _fsync_directorio(directorio):
+    """Asegura en disco los renombrados y borrados del directorio"""
+    try:
+        fd = os.open(directorio, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class RegistroSegmentado:
+    """Log binario de solo-anexado con segmentos, bases compactadas y fsync por lotes"""
+
+    def __init__(self, directorio, tam_segmento=8 * 1024 * 1024, politica_fsync='lote',
+                 lote_registros=20, lote_segundos=1.0, factor_compactacion=4, compartido=None):
+        if politica_fsync not in POLITICAS_FSYNC:
+            raise ValueError(f"Política de fsync desconocida: {politica_fsync}")
+        self.directorio = directorio
+        self.tam_segmento = tam_segmento
+        self.politica_fsync = politica_fsync
+        self.lote_registros = lote_registros
+        self.lote_segundos = lote_segundos
+        self.factor_compactacion = factor_compactacion
+
+        self._lock = threading.RLock()
+        self._archivo = None
+        self._abierto = None
+        self._tam_actual = 0
+        self._pendientes = 0
+        self._ultima_sync = time.monotonic()
+        self._diferido = 0
+        self._temporizador = None
+        # [número del segmento actual, bytes de la base, bytes anexados desde la base]
+        self._compartido = compartido if compartido is not None else np.zeros(3, dtype=np.int64)
+
+        os.makedirs(directorio, exist_ok=True)
+        if not self._numero:
+            base, segmentos = self._vigentes()
+            numeros = [n for n, _ in segmentos] + ([base[0]] if base else [])
+            self._numero = max(numeros, default=0)
+            self.bytes_base = os.path.getsize(base[1]) if base else 0
+            self.bytes_desde_base = sum(os.path.getsize(r) for _, r in segmentos)
+
+    @property
+    def _numero(self):
+        return int(self._compartido[0])
+
+    @_numero.setter
+    def _numero(self, valor):
+        self._compartido[0] = valor
+
+    @property
+    def bytes_base(self):
+        return int(self._compartido[1])
+
+    @bytes_base.setter
+    def bytes_base(self, valor):
+        self._compartido[1] = valor
+
+    @property
+    def bytes_desde_base(self):
+        return int(self._compartido[2])
+
+    @bytes_desde_base.setter
+    def bytes_desde_base(self, valor):
+        self._compartido[2] = valor
+
+    # ------------------------------------------------------------------
+    # Archivos
+    # ------------------------------------------------------------------
+
+    def _ruta(self, prefijo, numero):
+        return os.path.join(self.directorio, f"{prefijo}_{numero:06d}.log")
+
+    def _listar(self):
+        """Devuelve (bases, segmentos) como listas ordenadas de (numero, ruta)"""
+        bases, segmentos = [], []
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            prefijo, _, resto = nombre.partition('_')
+            if not resto.endswith('.log') or not resto[:-4].isdigit():
+                continue
+            numero = int(resto[:-4])
+            if prefijo == 'base':
+                bases.append((numero, ruta))
+            elif prefijo == 'segmento':
+                segmentos.append((numero, ruta))
+        return sorted(bases), sorted(segmentos)
+
+    def _vigentes(self):
+        """Última base y segmentos posteriores a ella"""
+        bases, segmentos = self._listar()
+        base = bases[-1] if bases else None
+        if base:
+            segmentos = [(n, r) for n, r in segmentos if n > base[0]]
+        return base, segmentos
+
+    @staticmethod
+    def _leer_archivo(ruta):
+        with open(ruta, 'rb') as f:
+            datos = memoryview(f.read())
+        pos = 0
+        while pos + CABECERA.size <= len(datos):
+            longitud, crc = CABECERA.unpack_from(datos, pos)
+            inicio = pos + CABECERA.size
+            fin = inicio + longitud
+            if fin > len(datos) or zlib.crc32(datos[inicio:fin]) != crc:
+                break
+            yield bytes(datos[inicio:fin])
+            pos = fin
+        if pos < len(datos):
+            log.warning("⚠️ Registro incompleto en %s (byte %d), se descarta el resto", os.path.basename(ruta), pos)
+
+    def leer(self):
+        """Recorre los registros válidos: última base y segmentos posteriores"""
+        with self._lock:
+            self._cerrar_segmento()
+            base, segmentos = self._vigentes()
+            rutas = ([base[1]] if base else []) + [r for _, r in segmentos]
+        for ruta in rutas:
+            yield from self._leer_archivo(ruta)
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+
+    def _abrir_segmento(self, nuevo):
+        if nuevo:
+            self._numero += 1
+        self._abierto = self._numero
+        self._archivo = open(self._ruta('segmento', self._numero), 'ab')
+        self._tam_actual = self._archivo.tell()
+
+    def _cerrar_segmento(self):
+        if self._archivo is not None:
+            self._sincronizar(fsync=self.politica_fsync != 'nunca')
+            self._archivo.close()
+            self._archivo = None
+
+    def _sincronizar(self, fsync):
+        if self._archivo is None:
+            return
+        self._archivo.flush()
+        if fsync:
+            os.fsync(self._archivo.fileno())
+            self._pendientes = 0
+            self._ultima_sync = time.monotonic()
+
+    def agregar(self, datos):
+        """Anexa un registro; el coste no depende del tamaño del estado retenido"""
+        with self._lock:
+            if self._archivo is None or self._abierto != self._numero:
+                # Primera escritura de este proceso: segmento nuevo, nunca tras una cola rota.
+                # Si otro proceso cambió de segmento, se sigue en el suyo.
+                self._cerrar_segmento()
+                self._abrir_segmento(nuevo=self._abierto is None)
+            if self._tam_actual >= self.tam_segmento:
+                self._cerrar_segmento()
+                self._abrir_segmento(nuevo=True)
+            self._archivo.write(CABECERA.pack(len(datos), zlib.crc32(datos)))
+            self._archivo.write(datos)
+            tam = CABECERA.size + len(datos)
+            self._tam_actual += tam
+            self.bytes_desde_base += tam
+            self._pendientes += 1
+
+            if self._diferido:
+                return
+            if self.politica_fsync == 'siempre':
+                self._sincronizar(fsync=True)
+            elif self.politica_fsync == 'lote' and (
+                    self._pendientes >= self.lote_registros
+                    or time.monotonic() - self._ultima_sync >= self.lote_segundos):
+                self._sincronizar(fsync=True)
+            else:
+                self._sincronizar(fsync=False)
+                if self.politica_fsync == 'lote':
+                    self._programar_sync()
+
+    def _programar_sync(self):
+        """Arma el temporizador que cumple el plazo de `lote_segundos` desde la última sync"""
+        if self._temporizador is not None:
+            return
+        restante = max(0.0, self.lote_segundos - (time.monotonic() - self._ultima_sync))
+        self._temporizador = threading.Timer(restante, self._sync_vencida)
+        self._temporizador.daemon = True
+        self._temporizador.start()
+
+    def _sync_vencida(self):
+        with self._lock:
+            self._temporizador = None
+            # Dentro de lote() ya sincroniza la salida
+            if self._pendientes and not self._diferido:
+                self._sincronizar(fsync=True)
+
+    @contextmanager
+    def lote(self):
+        """Agrupa varias llamadas a agregar() en un único flush/fsync al salir"""
+        with self._lock:
+            self._diferido += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._diferido -= 1
+                if not self._diferido:
+                    self._sincronizar(fsync=self.politica_fsync != 'nunca' and self._pendientes > 0)
+
+    def sincronizar(self):
+        """Fuerza flush y fsync de lo escrito hasta ahora"""
+        with self._lock:
+            self._sincronizar(fsync=True)
+
+    def necesita_compactar(self):
+        """True cuando lo anexado supera varias veces el tamaño de la base"""
+        minimo = self.tam_segmento
+        return self.bytes_desde_base > max(self.factor_compactacion * self.bytes_base, minimo)
+
+    def compactar(self, registros):
+        """Escribe los registros dados como nueva base y elimina lo anterior"""
+        with self._lock:
+            self._cerrar_segmento()
+            for nombre in os.listdir(self.directorio):
+                if nombre.endswith('.tmp'):
+                    # Compactación interrumpida: nunca llegó a ser base
+                    os.remove(os.path.join(self.directorio, nombre))
+            self._numero += 1
+            ruta = self._ruta('base', self._numero)
+            tmp = ruta + '.tmp'
+            total = 0
+            with open(tmp, 'wb') as f:
+                for datos in registros:
+                    f.write(CABECERA.pack(len(datos), zlib.crc32(datos)))
+                    f.write(datos)
+                    total += CABECERA.size + len(datos)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, ruta)
+            _fsync_directorio(self.directorio)
+
+            bases, segmentos = self._listar()
+            for numero, viejo in bases + segmentos:
+                if numero < self._numero:
+                    os.remove(viejo)
+            self.bytes_base = total
+            self.bytes_desde_base = 0
+            # Lo que se anexe a partir de ahora va al segmento siguiente a la base
+            self._numero += 1
+
+    def cerrar(self):
+        with self._lock:
+            if self._temporizador is not None:
+                self._temporizador.cancel()
+                self._temporizador = None
+            self._cerrar_segmento()
@@ -3,85 +3,694 @@ SERVIDOR FLASK - SISTEMA DE DETECCIÓN DE FUGAS
 Versión Final para PythonAnywhere
 """
 
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, request, jsonify, url_for
 from datetime import datetime
+import atexit
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
 import json
+import logging
+import logging.handlers
 import os
+import queue
+import sys
+import threading
 import time
+import zlib
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError:  # opcional: sin él se comprime solo con gzip
+    brotli = None
+
+from analisis_fugas import ConfiguracionTuberia, MotorAnalisis
+from archivo_historico import ArchivoHistorico
+from cola_ingesta import ColaIngesta
+from buffer_circular import (AGREGADOS, BufferCircular, DECIMALES_JSON, SIN_SECUENCIA,
+                             hora_a_segundos, segundos_a_hora, texto_a_segundos, tiempo_placa,
+                             muestras_desde_mediciones)
+from instantanea import CAMPOS as CAMPOS_INSTANTANEA, cargar as cargar_instantanea, exportar as exportar_instantanea
+from estado_compartido import (ARRANQUE, EstadoCompartido, INICIALIZADO, ULTIMA_SECUENCIA,
+                               VERSION_ANALISIS, VERSION_DATOS)
+from metricas import CUBETAS_BYTES, Contador, Histograma, Medidor, borrar_volcados, compartir, exponer, volcar
+from notificador import Notificador
+from parser_paquetes import (PaqueteInvalido, dividir_lote_binario, dividir_lote_texto,
+                             parsear_paquete, parsear_trama, validar_paquete)
+from recepcion import DESORDENADO, DUPLICADO, ControlRecepcion, huella
+from registro_segmentado import RegistroSegmentado
+from submuestreo import ALGORITMOS, submuestrear
+from tarjetas import RegistroTarjetas, TarjetaDesconocida
 
 app = Flask(__name__)
 
-# Almacenamiento de paquetes (máximo 60 por tarjeta)
-paquetes_tarjeta1 = []
-paquetes_tarjeta2 = []
-MAX_PAQUETES = 60
+# Log con nivel configurable (FUGAS_LOG_NIVEL, por defecto INFO; DEBUG muestra cada
+# paquete). Las peticiones solo encolan el mensaje: la escritura en stdout la hace
+# un hilo aparte, fuera del camino de ingesta
+log = logging.getLogger('fugas')
+
+def _configurar_log():
+    raiz = logging.getLogger()
+    if any(isinstance(h, logging.handlers.QueueHandler) for h in raiz.handlers):
+        return
+    cola = queue.SimpleQueue()
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    escucha = logging.handlers.QueueListener(cola, salida)
+    raiz.addHandler(logging.handlers.QueueHandler(cola))
+    raiz.setLevel(os.environ.get('FUGAS_LOG_NIVEL', 'INFO').upper())
+    escucha.start()
+    atexit.register(escucha.stop)
+
+_configurar_log()
+
+# Estado compartido entre workers de gunicorn: con FUGAS_DIR_COMPARTIDO (p. ej.
+# /dev/shm/fugas) buffers, contadores y análisis viven en archivos mapeados
+# que ven todos los procesos. Sin él, cada proceso los guarda en su memoria.
+DIRECTORIO_COMPARTIDO = os.environ.get('FUGAS_DIR_COMPARTIDO') or None
+compartido = EstadoCompartido(DIRECTORIO_COMPARTIDO)
+
+# Tarjetas registradas y esquema de sus paquetes (FUGAS_TARJETAS, ver tarjetas.py);
+# los paquetes de cualquier otra tarjeta se rechazan
+tarjetas = RegistroTarjetas.desde_entorno()
+# Gráficas del panel: un canal de cada tipo por posición, lo tenga o no cada tarjeta
+CLAVES_PANEL = ([f'flujo{i + 1}' for i in range(tarjetas.max_flujos)]
+                + [f'presion{i + 1}' for i in range(tarjetas.max_presiones)])
 
-# Archivo para persistir datos
+# Almacenamiento de paquetes: un buffer circular NumPy por tarjeta.
+# Con el esquema por defecto cada paquete ocupa 200 x 13 float32 (~10 KB), así
+# que la capacidad puede subirse a decenas de miles con FUGAS_MAX_PAQUETES.
+MAX_PAQUETES = int(os.environ.get('FUGAS_MAX_PAQUETES', 60))
+
+def _arreglos_tarjeta(tarjeta_id):
+    return lambda campo, forma, dtype: compartido.arreglo(f'tarjeta{tarjeta_id}_{campo}', forma, dtype)
+
+# Métricas de la ingesta para /metrics. En modo compartido cada worker vuelca las
+# suyas a DIRECTORIO_METRICAS y /metrics suma las de todos
+DIRECTORIO_METRICAS = os.path.join(DIRECTORIO_COMPARTIDO, 'metricas') if DIRECTORIO_COMPARTIDO else None
+CUBETAS_INTERVALO = (0.05, 0.1, 0.25, 0.4, 0.5, 0.6, 0.75, 1.0, 2.0, 5.0, 10.0)
+CUBETAS_ANALISIS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Peso de cada intervalo nuevo en la media y varianza móviles del jitter
+ALFA_JITTER = 0.1
+PAQUETES_RECIBIDOS = Contador('fugas_paquetes_recibidos_total', 'Paquetes aceptados',
+                              ('tarjeta', 'formato'))
+PAQUETES_RECHAZADOS = Contador('fugas_paquetes_rechazados_total',
+                               'Paquetes mal formados (invalido), de tarjetas no registradas (desconocida), '
+                               'sin sitio en la cola de ingesta (cola_llena) o que fallaron al guardarse (error)',
+                               ('formato', 'motivo'))
+PAQUETES_PISADOS = Contador('fugas_paquetes_pisados_total',
+                            'Paquetes sobrescritos en el buffer circular por falta de espacio', ('tarjeta',))
+PAQUETES_DUPLICADOS = Contador('fugas_paquetes_duplicados_total',
+                               'Reintentos de paquetes ya guardados (descartados)', ('tarjeta',))
+PAQUETES_DESORDENADOS = Contador('fugas_paquetes_desordenados_total',
+                                 'Paquetes llegados después de otros posteriores de su tarjeta', ('tarjeta',))
+LATENCIA = Histograma('fugas_latencia_segundos',
+                      'Duración de cada etapa de la ingesta (encuadre, cola, parseo, agregacion, registro, historico)',
+                      ('etapa',))
+TAMANO_PETICION = Histograma('fugas_tamano_peticion_bytes', 'Tamaño del cuerpo de las peticiones de ingesta',
+                             ('endpoint',), CUBETAS_BYTES)
+INTERVALO_LLEGADA = Histograma('fugas_intervalo_llegada_segundos',
+                               'Tiempo entre paquetes consecutivos de una tarjeta', ('tarjeta',), CUBETAS_INTERVALO)
+JITTER_LLEGADA = Medidor('fugas_jitter_llegada_segundos',
+                         'Desviación típica móvil del intervalo entre paquetes', ('tarjeta',))
+ANALISIS_IDA_VUELTA = Histograma('fugas_analisis_ida_vuelta_segundos',
+                                 'Del último paquete recibido a la publicación del análisis', ('origen',),
+                                 CUBETAS_ANALISIS)
+_llegadas = {}   # tarjeta -> [media, varianza] móviles del intervalo
+_lock_llegadas = threading.Lock()
+
+# Archivo JSON de versiones anteriores (solo se lee para migrar)
 ARCHIVO_DATOS = 'paquetes_sensores.json'
+# Instantánea .npz (ver instantanea.py) con la que sembrar los buffers si el registro está vacío
+RESTAURAR_INSTANTANEA = os.environ.get('FUGAS_RESTAURAR') or None
+
+# Persistencia: log segmentado de solo-anexado (un registro por paquete)
+DIRECTORIO_DATOS = 'datos_sensores'
+# 'siempre' = fsync por paquete, 'lote' = fsync cada 20 paquetes o como mucho 1 s después de escribir,
+# 'nunca' = lo decide el SO
+POLITICA_FSYNC = os.environ.get('FUGAS_FSYNC', 'lote')
+
+with compartido.escritura():
+    buffers = {
+        esquema.tarjeta_id: BufferCircular(MAX_PAQUETES, esquema.num_muestras, esquema.num_columnas,
+                                           arreglos=_arreglos_tarjeta(esquema.tarjeta_id),
+                                           num_flujos=esquema.flujos)
+        for esquema in tarjetas
+    }
+    # Llegada del último paquete de cada tarjeta (orden de tarjetas.ids): el estado
+    # de recepción de todas sale de una sola comparación vectorizada
+    ultimas_llegadas = compartido.arreglo('ultimas_llegadas', (len(tarjetas),), np.float64)
+    # Último paquete por hora de la placa, huecos y duplicados de cada tarjeta (/recepcion)
+    recepcion = ControlRecepcion(tarjetas.ids, arreglos=compartido.arreglo)
+    registro = RegistroSegmentado(DIRECTORIO_DATOS, politica_fsync=POLITICA_FSYNC,
+                                  compartido=compartido.arreglo('registro', (3,), np.int64))
 
-# Variable para análisis de Raspberry Pi
-resultado_analisis = {
+OCUPACION_BUFFER = Medidor('fugas_ocupacion_buffer', 'Paquetes retenidos en el buffer circular', ('tarjeta',),
+                           funcion=lambda: {(t,): len(buf) for t, buf in buffers.items()})
+CAPACIDAD_BUFFER = Medidor('fugas_capacidad_buffer', 'Capacidad del buffer circular (paquetes)', ('tarjeta',),
+                           funcion=lambda: {(t,): buf.capacidad for t, buf in buffers.items()})
+PAQUETES_PERDIDOS = Medidor('fugas_paquetes_perdidos',
+                            'Paquetes que faltan según la secuencia o la hora de la placa', ('tarjeta',),
+                            funcion=lambda: {(t,): recepcion.perdidos(t) for t in tarjetas.ids})
+
+# Archivo histórico: todo lo recibido, en bloques crudos comprimidos y
+# resúmenes de 1 s / 1 min / 1 h para consultar rangos largos (/historico)
+DIRECTORIO_HISTORICO = os.environ.get('FUGAS_DIR_HISTORICO', 'historico_sensores')
+MAX_PUNTOS_HISTORICO = 20000
+archivo_historico = ArchivoHistorico(DIRECTORIO_HISTORICO, canales=lambda tarjeta_id: tarjetas[tarjeta_id].canales)
+
+# Resultado del análisis (Raspberry Pi o motor local); ver resultado_actual()
+RESULTADO_INICIAL = {
     'alarma_fuga': 'NO DETECTADA',
     'posicion_fuga': 0.0,
     'ultima_actualizacion': None
 }
 
+# Análisis en proceso (FUGAS_ANALISIS_LOCAL=1): el servidor localiza la fuga
+# por sí mismo en lugar de esperar a /actualizar_analisis de la Raspberry
+ANALISIS_LOCAL = os.environ.get('FUGAS_ANALISIS_LOCAL', '0') == '1'
+motor_analisis = None
+
+# Ingesta asíncrona (FUGAS_INGESTA_ASINCRONA=0 la desactiva): los endpoints validan
+# el encuadre, encolan y responden; el hilo de ingesta parsea y guarda. Con la cola
+# llena se responde 503 y Retry-After (s)
+INGESTA_ASINCRONA = os.environ.get('FUGAS_INGESTA_ASINCRONA', '1') == '1'
+CAPACIDAD_COLA_INGESTA = int(os.environ.get('FUGAS_COLA_INGESTA', 512))
+REINTENTAR_EN = 1
+cola_ingesta = None
+OCUPACION_COLA = Medidor('fugas_ocupacion_cola_ingesta', 'Trabajos esperando en la cola de ingesta',
+                         funcion=lambda: {(): len(cola_ingesta)} if cola_ingesta is not None else {})
+
+# Máximo de paquetes por respuesta del feed incremental de la Raspberry
+MAX_LOTE_RASPBERRY = 120
+# ?formato= del feed: 'json' (un dict por medición, como siempre) o 'columnar' (compacto)
+FORMATOS_RASPBERRY = ('json', 'columnar')
+
+# La versión de los datos (contador compartido VERSION_DATOS) cambia con cada
+# paquete o borrado e invalida la caché de gráficas de todos los workers
+_cache_graficas = {'version': -1, 'datos': None}
+# Series de muestras submuestreadas por (ancho, algoritmo, paquetes), misma versión
+_cache_muestras = {'version': -1, 'series': {}}
+# Límites de /datos_grafica: ancho en píxeles y paquetes concatenados
+MAX_ANCHO_GRAFICA = 4000
+MAX_PAQUETES_GRAFICA = 60
+_lock_cache = threading.Lock()
+# Últimas versiones que este proceso ya notificó a sus clientes de /eventos
+_versiones_notificadas = {'datos': 0, 'analisis': 0}
+
+def _datos_modificados():
+    """Llamar con el bloqueo exclusivo tras cualquier cambio en los buffers"""
+    version = compartido.incrementar(VERSION_DATOS)
+    if version != _versiones_notificadas['datos'] + 1:
+        # Entre medias escribió otro worker: sus clientes necesitan recargar
+        notificador.publicar('recarga', {})
+    _versiones_notificadas['datos'] = version
+
+# Compresión negociada (Accept-Encoding) de respuestas de más de MIN_COMPRIMIR bytes.
+# Los cuerpos comprimidos de respuestas con ETag se reutilizan mientras no cambie
+COMPRIMIBLES = ('application/json', 'text/html', 'text/plain')
+MIN_COMPRIMIR = 1024
+NIVEL_GZIP = 5
+CALIDAD_BROTLI = 5
+MAX_CACHE_COMPRIMIDOS = 32
+_cache_comprimidos = {}
+_lock_comprimidos = threading.Lock()
+
+# Eventos en tiempo real para el panel y la Raspberry (/eventos y /esperar_cambios)
+notificador = Notificador()
+TIMEOUT_EVENTOS = 15
+# Cada cliente de /eventos o /esperar_cambios ocupa un hilo del worker mientras
+# espera. Por encima de MAX_CLIENTES_PUSH se responde 503 y Retry-After para que
+# queden hilos para la ingesta; un flujo SSE se cierra a los DURACION_MAX_EVENTOS s
+# y el navegador vuelve a conectar con Last-Event-ID sin perder eventos
+MAX_CLIENTES_PUSH = int(os.environ.get('FUGAS_MAX_CLIENTES_PUSH',
+                                       max(1, int(os.environ.get('FUGAS_HILOS', 8)) // 2)))
+DURACION_MAX_EVENTOS = 300
+REINTENTAR_PUSH_EN = 5
+_clientes_push = threading.BoundedSemaphore(MAX_CLIENTES_PUSH)
+INTERVALO_VIGILANCIA = 0.1
+_vigilancia = None
+_lock_vigilancia = threading.Lock()
+
+def _sin_hilos_push():
+    """Respuesta 503 cuando ya hay MAX_CLIENTES_PUSH clientes esperando en este worker"""
+    log.warning("Máximo de clientes en espera alcanzado (%d)", MAX_CLIENTES_PUSH)
+    return jsonify({'error': 'Demasiados clientes en espera, reintentar'}), 503, {'Retry-After': str(REINTENTAR_PUSH_EN)}
+
+def _buffer(tarjeta_id):
+    """Buffer de la tarjeta (TarjetaDesconocida si no está registrada)"""
+    if tarjeta_id not in buffers:
+        raise TarjetaDesconocida(f"Tarjeta {tarjeta_id} no registrada")
+    return buffers[tarjeta_id]
+
+def _total_paquetes():
+    return sum(len(buf) for buf in buffers.values())
+
+def _codificar_paquete(tarjeta_id, pos):
+    """Registro del log: cabecera JSON, salto de línea y muestras float32 en crudo"""
+    buf = _buffer(tarjeta_id)
+    cabecera = {
+        'tarjeta': tarjeta_id,
+        'secuencia': int(buf.secuencias[pos]),
+        'timestamp': float(buf.timestamps[pos]),
+        'hora': int(buf.horas[pos]),
+        'forma': list(buf.muestras.shape[1:])
+    }
+    if buf.secuencias_placa[pos] != SIN_SECUENCIA:
+        cabecera['secuencia_placa'] = int(buf.secuencias_placa[pos])
+    cabecera = json.dumps(cabecera, separators=(',', ':')).encode()
+    return cabecera + b'\n' + buf.muestras[pos].tobytes()
+
+def _codificar_control(**campos):
+    """Registro del log sin muestras ('estado' o 'confirmacion')"""
+    return json.dumps(campos, separators=(',', ':')).encode() + b'\n'
+
+def _codificar_restauracion(ids):
+    """Un solo registro con el contenido completo de los buffers `ids` (recién restaurados,
+    así que sus paquetes ocupan las primeras ranuras): cabecera JSON y, por tarjeta, los
+    campos de la instantánea en crudo"""
+    cabecera = {'tipo': 'restauracion', 'secuencia': int(compartido.contadores[ULTIMA_SECUENCIA]),
+                'tarjetas': [[tarjeta_id, len(buffers[tarjeta_id]), list(buffers[tarjeta_id].muestras.shape[1:])]
+                             for tarjeta_id in ids]}
+    partes = [json.dumps(cabecera, separators=(',', ':')).encode(), b'\n']
+    for tarjeta_id in ids:
+        buf = buffers[tarjeta_id]
+        partes.extend(getattr(buf, campo)[:len(buf)].astype(dtype, copy=False).tobytes()
+                      for campo, dtype in CAMPOS_INSTANTANEA)
+    return b''.join(partes)
+
+def _decodificar_restauracion(cabecera, crudo):
+    """Inverso de _codificar_restauracion: (tarjeta_id, {campo: arreglo}) por tarjeta, sin copiar"""
+    desplazamiento = 0
+    for tarjeta_id, n, forma in cabecera['tarjetas']:
+        campos = {}
+        for campo, dtype in CAMPOS_INSTANTANEA:
+            dimensiones = (n, *forma) if campo == 'muestras' else (n,)
+            cuenta = int(np.prod(dimensiones))
+            campos[campo] = np.frombuffer(crudo, dtype=dtype, count=cuenta, offset=desplazamiento).reshape(dimensiones)
+            desplazamiento += cuenta * np.dtype(dtype).itemsize
+        yield tarjeta_id, campos
+
+def _decodificar_registro(datos):
+    """Inverso de _codificar_*: (cabecera, muestras); acepta también los registros JSON anteriores"""
+    cabecera, separador, crudo = datos.partition(b'\n')
+    if not separador:
+        entrada = json.loads(datos)
+        paquete = entrada['paquete']
+        return ({'tarjeta': entrada['tarjeta'], 'timestamp': paquete['timestamp'],
+                 'hora': texto_a_segundos(paquete['hora_inicio'])},
+                muestras_desde_mediciones(paquete['mediciones']))
+    cabecera = json.loads(cabecera)
+    if cabecera.get('tipo') == 'restauracion':
+        return cabecera, crudo
+    if cabecera.get('tipo', 'paquete') != 'paquete':
+        return cabecera, None
+    muestras = np.frombuffer(crudo, dtype=np.float32).reshape(cabecera['forma'])
+    return cabecera, muestras
+
+def _siguiente_secuencia():
+    """Número de secuencia global siguiente (llamar con el bloqueo exclusivo)"""
+    return compartido.incrementar(ULTIMA_SECUENCIA)
+
 def cargar_datos():
-    """Cargar datos existentes"""
-    global paquetes_tarjeta1, paquetes_tarjeta2
-    if os.path.exists(ARCHIVO_DATOS):
+    """Cargar datos existentes: última base compactada + segmentos posteriores.
+
+    En modo compartido solo lo hace el primer worker; los demás encuentran
+    los buffers ya cargados en los archivos mapeados.
+    """
+    with compartido.escritura():
+        if compartido.compartido and compartido.contadores[INICIALIZADO]:
+            log.info("✅ Estado compartido: %d paquetes de %d tarjetas", _total_paquetes(), len(buffers))
+            return
+        _cargar_registro()
+        if DIRECTORIO_METRICAS:
+            # Arranque nuevo: los contadores de los workers anteriores no se suman
+            borrar_volcados(DIRECTORIO_METRICAS)
+        compartido.contadores[ARRANQUE] = time.time_ns() // 1000000
+        compartido.contadores[INICIALIZADO] = 1
+
+def _cargar_registro():
+    for buf in buffers.values():
+        buf.vaciar()
+    ultima_secuencia = 0
+    descartados = 0
+    try:
+        for datos in registro.leer():
+            cabecera, muestras = _decodificar_registro(datos)
+            tipo = cabecera.get('tipo', 'paquete')
+            if tipo == 'estado':
+                ultima_secuencia = max(ultima_secuencia, cabecera['secuencia'])
+            elif tipo == 'confirmacion':
+                for buf in buffers.values():
+                    buf.descartar_hasta(cabecera['hasta'])
+            elif tipo == 'restauracion':
+                ultima_secuencia = max(ultima_secuencia, cabecera['secuencia'])
+                for tarjeta_id, campos in _decodificar_restauracion(cabecera, muestras):
+                    buf = buffers.get(tarjeta_id)
+                    if buf is None or campos['muestras'].shape[1:] != buf.muestras.shape[1:]:
+                        descartados += len(campos['secuencias'])
+                        continue
+                    buf.cargar(campos['muestras'], campos['timestamps'], campos['horas'],
+                               campos['secuencias'], campos['secuencias_placa'])
+            else:
+                # Registros anteriores a las secuencias reciben una nueva
+                secuencia = cabecera.get('secuencia') or ultima_secuencia + 1
+                ultima_secuencia = max(ultima_secuencia, secuencia)
+                buf = buffers.get(cabecera['tarjeta'])
+                if buf is None or muestras.shape != buf.muestras.shape[1:]:
+                    # Tarjeta retirada del registro o con otro esquema: no cabe en ningún buffer
+                    descartados += 1
+                    continue
+                buf.agregar(muestras, cabecera['timestamp'], cabecera['hora'], secuencia,
+                            cabecera.get('secuencia_placa', SIN_SECUENCIA))
+    except Exception as e:
+        log.error("Error cargando: %s", e)
+    compartido.contadores[ULTIMA_SECUENCIA] = ultima_secuencia
+    if descartados:
+        log.warning("⚠️ %d paquetes de tarjetas no registradas o con otro esquema no se cargan", descartados)
+
+    if not any(len(buf) for buf in buffers.values()) and RESTAURAR_INSTANTANEA:
+        try:
+            inicio = time.perf_counter()
+            cargados, _ = _restaurar_instantanea(cargar_instantanea(RESTAURAR_INSTANTANEA))
+            log.info("✅ Instantánea %s: %d paquetes en %.1f ms", RESTAURAR_INSTANTANEA,
+                     sum(cargados.values()), (time.perf_counter() - inicio) * 1000)
+        except (ValueError, OSError) as e:
+            log.error("Error restaurando %s: %s", RESTAURAR_INSTANTANEA, e)
+    elif not any(len(buf) for buf in buffers.values()) and os.path.exists(ARCHIVO_DATOS):
+        # Migración desde el JSON completo de versiones anteriores
         try:
             with open(ARCHIVO_DATOS, 'r') as f:
                 data = json.load(f)
-                paquetes_tarjeta1 = data.get('tarjeta1', [])
-                paquetes_tarjeta2 = data.get('tarjeta2', [])
-            print(f"✅ Cargados {len(paquetes_tarjeta1)} paquetes T1, {len(paquetes_tarjeta2)} paquetes T2")
+            for tarjeta_id in (1, 2):
+                if tarjeta_id not in buffers:
+                    continue
+                for p in data.get(f'tarjeta{tarjeta_id}', [])[-MAX_PAQUETES:]:
+                    buffers[tarjeta_id].agregar(muestras_desde_mediciones(p['mediciones']),
+                                                p['timestamp'], texto_a_segundos(p['hora_inicio']),
+                                                _siguiente_secuencia())
+            guardar_datos()
+        except Exception as e:
+            log.error("Error migrando %s: %s", ARCHIVO_DATOS, e)
+
+    for i, (tarjeta_id, buf) in enumerate(buffers.items()):
+        ultimas_llegadas[i] = buf.ultimo_timestamp() or 0.0
+        if len(buf):
+            ultimo = buf.posicion(-1)
+            recepcion.iniciar(tarjeta_id, int(buf.tiempos_placa[ultimo]), int(buf.secuencias_placa[ultimo]))
+    _datos_modificados()
+    log.info("✅ Cargados %d paquetes de %d tarjetas", _total_paquetes(), len(buffers))
+
+def _restaurar_instantanea(captura):
+    """Reemplaza los paquetes de las tarjetas de la instantánea (con el bloqueo exclusivo tomado).
+
+    Se omiten las tarjetas no registradas o con otro esquema. Los paquetes
+    reciben secuencias nuevas en el orden original, así que los cursores de
+    la Raspberry siguen avanzando. Cada campo se copia al buffer en bloque y
+    el registro recibe un solo registro 'restauracion' (sin compactar).
+    Devuelve ({tarjeta: paquetes}, [omitidas]).
+    """
+    campos, omitidas = {}, []
+    for tarjeta_id in captura.ids:
+        buf = buffers.get(tarjeta_id)
+        datos = captura[tarjeta_id]
+        if (buf is None or datos['muestras'].shape[1:] != buf.muestras.shape[1:]
+                or captura.esquemas[tarjeta_id].get('flujos') != tarjetas[tarjeta_id].flujos):
+            omitidas.append(tarjeta_id)
+            continue
+        # Solo caben los últimos `capacidad`
+        campos[tarjeta_id] = {campo: valores[-buf.capacidad:] for campo, valores in datos.items()}
+    # Secuencias nuevas: el puesto de cada paquete entre todas las tarjetas por secuencia original
+    originales = np.concatenate([datos['secuencias'] for datos in campos.values()]) if campos else np.empty(0)
+    puestos = np.empty(len(originales), dtype=np.int64)
+    puestos[np.argsort(originales, kind='stable')] = np.arange(len(originales))
+    nuevas = int(compartido.contadores[ULTIMA_SECUENCIA]) + 1 + puestos
+    compartido.incrementar(ULTIMA_SECUENCIA, len(originales))
+    desde = 0
+    for tarjeta_id, datos in campos.items():
+        hasta = desde + len(datos['secuencias'])
+        buffers[tarjeta_id].cargar(datos['muestras'], datos['timestamps'], datos['horas'],
+                                   nuevas[desde:hasta], datos['secuencias_placa'])
+        ultimas_llegadas[tarjetas.indices[tarjeta_id]] = buffers[tarjeta_id].ultimo_timestamp() or 0.0
+        desde = hasta
+    if campos:
+        try:
+            registro.agregar(_codificar_restauracion(list(campos)))
         except Exception as e:
-            print(f"Error cargando: {e}")
+            log.error("Error guardando la restauración: %s", e)
+    _datos_modificados()
+    return {tarjeta_id: len(datos['secuencias']) for tarjeta_id, datos in campos.items()}, omitidas
 
 def guardar_datos():
-    """Guardar datos"""
+    """Compactar: escribe el estado completo como nueva base del registro"""
+    def registros():
+        # La última secuencia va primero para no reutilizar números tras vaciar
+        yield _codificar_control(tipo='estado', secuencia=int(compartido.contadores[ULTIMA_SECUENCIA]))
+        for tarjeta_id, buf in buffers.items():
+            for pos in buf.posiciones():
+                yield _codificar_paquete(tarjeta_id, pos)
     try:
-        with open(ARCHIVO_DATOS, 'w') as f:
-            json.dump({
-                'tarjeta1': paquetes_tarjeta1,
-                'tarjeta2': paquetes_tarjeta2
-            }, f)
+        with compartido.escritura():
+            registro.compactar(registros())
     except Exception as e:
-        print(f"Error guardando: {e}")
-
-def agregar_paquete(tarjeta_id, paquete):
-    """Agregar paquete y mantener máximo 60"""
-    if tarjeta_id == 1:
-        paquetes_tarjeta1.append(paquete)
-        if len(paquetes_tarjeta1) > MAX_PAQUETES:
-            paquetes_tarjeta1.pop(0)
+        log.error("Error guardando: %s", e)
+
+def _insertar_paquete(tarjeta_id, muestras, hora, timestamp=None, secuencia_placa=None, archivar=True):
+    """Guarda el paquete en su buffer y anexa el registro (con el bloqueo exclusivo tomado).
+
+    Un reintento de un paquete ya aceptado se descarta (False), siga o no en el buffer.
+    Con `archivar=False` (datos de prueba o copiados) no pasa al archivo histórico.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    if secuencia_placa is None:
+        secuencia_placa = SIN_SECUENCIA
+    buf = _buffer(tarjeta_id)
+    inicio = tiempo_placa(timestamp, hora)
+    clave = huella(muestras, secuencia_placa)
+    # El buffer cubre lo cargado al arrancar, que aún no está entre las claves recientes
+    if recepcion.visto(tarjeta_id, inicio, clave) or buf.duplicado(muestras, timestamp, hora, secuencia_placa):
+        recepcion.duplicado(tarjeta_id)
+        estado = DUPLICADO
     else:
-        paquetes_tarjeta2.append(paquete)
-        if len(paquetes_tarjeta2) > MAX_PAQUETES:
-            paquetes_tarjeta2.pop(0)
-    guardar_datos()
+        esquema = tarjetas[tarjeta_id]
+        estado, perdidos = recepcion.registrar(tarjeta_id, inicio, secuencia_placa,
+                                               esquema.num_muestras * esquema.periodo_ms / 1000, clave)
+    if estado == DUPLICADO:
+        PAQUETES_DUPLICADOS.incrementar(tarjeta=tarjeta_id)
+        log.debug("Paquete duplicado de Tarjeta %s descartado", tarjeta_id)
+        return False
+    if estado == DESORDENADO:
+        PAQUETES_DESORDENADOS.incrementar(tarjeta=tarjeta_id)
+    elif perdidos:
+        log.warning("⚠️ Tarjeta %s: faltan %d paquetes antes de las %s", tarjeta_id, perdidos, segundos_a_hora(hora))
+    indice = tarjetas.indices[tarjeta_id]
+    anterior = float(ultimas_llegadas[indice]) or None
+    if len(buf) == buf.capacidad:
+        PAQUETES_PISADOS.incrementar(tarjeta=tarjeta_id)
+    with LATENCIA.medir(etapa='agregacion'):
+        pos = buf.agregar(muestras, timestamp, hora, _siguiente_secuencia(), secuencia_placa)
+    ultimas_llegadas[indice] = max(ultimas_llegadas[indice], timestamp)
+    if pos is not None:
+        try:
+            with LATENCIA.medir(etapa='registro'):
+                registro.agregar(_codificar_paquete(tarjeta_id, pos))
+        except Exception as e:
+            log.error("Error guardando: %s", e)
+    if archivar:
+        try:
+            with LATENCIA.medir(etapa='historico'):
+                archivo_historico.agregar(tarjeta_id, inicio, muestras)
+        except Exception as e:
+            log.error("Error archivando: %s", e)
+    if anterior is not None and timestamp > anterior:
+        _registrar_llegada(tarjeta_id, timestamp - anterior)
+    if pos is None:
+        # Atrasado y anterior a todo el buffer lleno: solo queda en el archivo histórico
+        return True
+    notificador.publicar('paquete', _evento_paquete(tarjeta_id, pos))
+    if motor_analisis is not None and not compartido.compartido:
+        motor_analisis.procesar(tarjeta_id, hora, _buffer(tarjeta_id).muestras[pos])
+    return True
+
+def _registrar_llegada(tarjeta_id, intervalo):
+    """Intervalo desde la llegada anterior de la tarjeta (de cualquier worker)"""
+    INTERVALO_LLEGADA.observar(intervalo, tarjeta=tarjeta_id)
+    with _lock_llegadas:
+        estadistica = _llegadas.get(tarjeta_id)
+        if estadistica is None:
+            estadistica = _llegadas[tarjeta_id] = [intervalo, 0.0]
+        diferencia = intervalo - estadistica[0]
+        estadistica[0] += ALFA_JITTER * diferencia
+        estadistica[1] = (1 - ALFA_JITTER) * (estadistica[1] + ALFA_JITTER * diferencia * diferencia)
+        jitter = estadistica[1] ** 0.5
+    JITTER_LLEGADA.fijar(jitter, tarjeta=tarjeta_id)
+
+def _evento_paquete(tarjeta_id, pos):
+    """Agregados de un paquete en las unidades del panel (presión en m.c.a)"""
+    buf = _buffer(tarjeta_id)
+    esquema = tarjetas[tarjeta_id]
+    agregados = buf.agregados[pos]
+    return {
+        'tarjeta': tarjeta_id,
+        'secuencia': int(buf.secuencias[pos]),
+        'label': f"T{tarjeta_id} {segundos_a_hora(buf.horas[pos])}",
+        'paquetes': len(buf),
+        'flujos': {nombre: np.round(agregados[k, :esquema.flujos], 2).tolist()
+                   for k, nombre in enumerate(AGREGADOS)},
+        'presiones': {nombre: np.round(agregados[k, esquema.flujos:] * esquema.factor_presion, 2).tolist()
+                      for k, nombre in enumerate(AGREGADOS)}
+    }
+
+def agregar_paquete(tarjeta_id, muestras, hora, timestamp=None, secuencia_placa=None, archivar=True):
+    """Agregar paquete (arreglo muestras x 13) al buffer de la tarjeta y al registro; False si era duplicado"""
+    with compartido.escritura():
+        guardado = _insertar_paquete(tarjeta_id, muestras, hora, timestamp, secuencia_placa, archivar)
+        _datos_modificados()
+        if registro.necesita_compactar():
+            guardar_datos()
+    return guardado
+
+def agregar_lote(paquetes):
+    """Agregar varios (tarjeta_id, muestras, hora, timestamp, secuencia_placa) con un solo flush y
+    una sola invalidación; devuelve por paquete si se guardó (False si era duplicado)"""
+    with compartido.escritura():
+        with registro.lote():
+            guardados = [_insertar_paquete(*paquete) for paquete in paquetes]
+        _datos_modificados()
+        if registro.necesita_compactar():
+            guardar_datos()
+    return guardados
+
+def confirmar_hasta(secuencia):
+    """Libera los paquetes con secuencia <= `secuencia` ya procesados por la Raspberry"""
+    with compartido.escritura():
+        liberados = sum(buf.descartar_hasta(secuencia) for buf in buffers.values())
+        try:
+            registro.agregar(_codificar_control(tipo='confirmacion', hasta=secuencia))
+        except Exception as e:
+            log.error("Error guardando: %s", e)
+        _datos_modificados()
+    notificador.publicar('recarga', {})
+    return liberados
+
+def vaciar_buffers():
+    """Borra todos los paquetes (limpiar / borrar_datos_procesados)"""
+    with compartido.escritura():
+        for buf in buffers.values():
+            buf.vaciar()
+        ultimas_llegadas[:] = 0.0
+        _datos_modificados()
+        guardar_datos()
+    notificador.publicar('recarga', {})
+
+def tiempo_muestreo_actual():
+    """Tiempo de muestreo mostrado en el panel (el nominal de la primera tarjeta si aún no hay datos)"""
+    esquema = next(iter(tarjetas))
+    buf = buffers[esquema.tarjeta_id]
+    with compartido.lectura():
+        return int(buf.muestras[buf.posicion(0), 0, 0]) if len(buf) else esquema.periodo_ms
 
 def verificar_recepcion_datos():
-    """Verificar si se están recibiendo datos (2 paquetes/segundo mínimo)"""
-    ahora = time.time()
-    estado = {'tarjeta1': True, 'tarjeta2': True}
-    
-    if paquetes_tarjeta1:
-        ultimo_t1 = paquetes_tarjeta1[-1]['timestamp']
-        if ahora - ultimo_t1 > 0.5:
-            estado['tarjeta1'] = False
-    else:
-        estado['tarjeta1'] = False
-    
-    if paquetes_tarjeta2:
-        ultimo_t2 = paquetes_tarjeta2[-1]['timestamp']
-        if ahora - ultimo_t2 > 0.5:
-            estado['tarjeta2'] = False
-    else:
-        estado['tarjeta2'] = False
-    
-    return estado
+    """Verificar si se están recibiendo datos (2 paquetes/segundo mínimo): {tarjeta_id: bool}"""
+    activas = time.time() - ultimas_llegadas <= 0.5
+    return dict(zip(tarjetas.ids, activas.tolist()))
+
+def resultado_actual():
+    """Último resultado de análisis, el mismo en todos los workers"""
+    return compartido.leer_documento('analisis', VERSION_ANALISIS, RESULTADO_INICIAL)
+
+def actualizar_resultado(resultado, origen='local'):
+    """Publica un nuevo resultado de análisis (origen 'raspberry' o motor 'local')"""
+    ultimo = max((t for t in (buf.ultimo_timestamp() for buf in buffers.values()) if t is not None), default=None)
+    if ultimo is not None:
+        ANALISIS_IDA_VUELTA.observar(max(0.0, time.time() - ultimo), origen=origen)
+    compartido.guardar_documento('analisis', resultado, VERSION_ANALISIS)
+    _versiones_notificadas['analisis'] = int(compartido.contadores[VERSION_ANALISIS])
+    notificador.publicar('analisis', resultado)
+
+def _evento_estado(estado):
+    return {str(tarjeta_id): activa for tarjeta_id, activa in estado.items()}
+
+def _vigilar_recepcion():
+    """Publica 'estado' cuando una tarjeta deja de (o vuelve a) enviar y, con
+    varios workers, 'recarga'/'analisis' cuando los cambios vienen de otro proceso"""
+    previo = None
+    while True:
+        estado = verificar_recepcion_datos()
+        if estado != previo:
+            notificador.publicar('estado', _evento_estado(estado))
+            previo = estado
+        if compartido.compartido:
+            version = int(compartido.contadores[VERSION_DATOS])
+            if version != _versiones_notificadas['datos']:
+                _versiones_notificadas['datos'] = version
+                notificador.publicar('recarga', {})
+            version = int(compartido.contadores[VERSION_ANALISIS])
+            if version != _versiones_notificadas['analisis']:
+                _versiones_notificadas['analisis'] = version
+                notificador.publicar('analisis', resultado_actual())
+        time.sleep(INTERVALO_VIGILANCIA)
+
+def _iniciar_vigilancia():
+    global _vigilancia
+    with _lock_vigilancia:
+        if _vigilancia is None:
+            _vigilancia = threading.Thread(target=_vigilar_recepcion, name='vigilancia', daemon=True)
+            _vigilancia.start()
+
+def _alimentar_motor():
+    """Modo compartido: un solo worker (el que obtiene el liderazgo) analiza los
+    paquetes de todos, leyéndolos de los buffers por número de secuencia"""
+    compartido.esperar_liderazgo('analisis')
+    cursor = int(compartido.contadores[ULTIMA_SECUENCIA])
+    while True:
+        with compartido.lectura():
+            # Cada buffer los da ya en orden de secuencia: basta mezclarlos
+            nuevos = list(heapq.merge(*(
+                [(int(buf.secuencias[pos]), tarjeta_id, int(buf.horas[pos]), buf.muestras[pos].copy())
+                 for pos in buf.posiciones_desde(cursor)]
+                for tarjeta_id, buf in buffers.items()
+            ), key=lambda x: x[0]))
+        for secuencia, tarjeta_id, hora, muestras in nuevos:
+            motor_analisis.procesar(tarjeta_id, hora, muestras)
+            cursor = secuencia
+        time.sleep(INTERVALO_VIGILANCIA)
+
+# Archivos estáticos del panel (static/): la URL lleva el hash del contenido,
+# así el navegador puede guardarlos un año y aun así ve cada versión nueva
+DIRECTORIO_ESTATICOS = os.path.join(app.root_path, 'static')
+CACHE_ESTATICOS = 365 * 24 * 3600
+# Chart.js 4.4.0 (MIT, licencia en static/vendor/) se sirve local; si falta el archivo, desde la CDN
+CHART_JS_LOCAL = 'vendor/chart.umd.min.js'
+CHART_JS_CDN = 'https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.min.js'
+
+def _url_estatico(nombre):
+    with open(os.path.join(DIRECTORIO_ESTATICOS, nombre), 'rb') as f:
+        huella = hashlib.sha256(f.read()).hexdigest()[:12]
+    with app.test_request_context():
+        return url_for('static', filename=nombre, v=huella)
+
+RECURSOS = {
+    'panel.css': _url_estatico('panel.css'),
+    'panel.js': _url_estatico('panel.js'),
+    'chart.js': (_url_estatico(CHART_JS_LOCAL)
+                 if os.path.exists(os.path.join(DIRECTORIO_ESTATICOS, CHART_JS_LOCAL)) else CHART_JS_CDN)
+}
+
+@app.after_request
+def _cache_estaticos(respuesta):
+    """Estáticos pedidos con su hash (?v=): inmutables durante un año"""
+    if request.endpoint == 'static' and request.args.get('v') and respuesta.status_code in (200, 304):
+        respuesta.cache_control.public = True
+        respuesta.cache_control.max_age = CACHE_ESTATICOS
+        respuesta.cache_control.immutable = True
+        respuesta.cache_control.no_cache = None
+    return respuesta
 
 # Template HTML completo
 HTML_TEMPLATE = '''
@@ -91,106 +700,10 @@ HTML_TEMPLATE = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>🔧 Sistema de Detección de Fugas</title>
-    <script src="https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.min.js"></script>
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body { 
-            font-family: 'Segoe UI', Tahoma, sans-serif; 
-            background: #1a1a2e;
-            color: #eee;
-            padding: 20px;
-        }
-        .container { max-width: 1600px; margin: 0 auto; }
-        h1 { 
-            text-align: center; 
-            color: #00d9ff;
-            margin-bottom: 20px;
-            font-size: 2.5em;
-            text-shadow: 0 0 10px rgba(0,217,255,0.5);
-        }
-        
-        .alert-panel {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            border-radius: 15px;
-            padding: 30px;
-            margin-bottom: 30px;
-            text-align: center;
-            box-shadow: 0 10px 30px rgba(0,0,0,0.5);
-        }
-        .alert-status {
-            font-size: 3em;
-            font-weight: bold;
-            margin: 20px 0;
-            text-shadow: 0 0 20px rgba(255,255,255,0.5);
-        }
-        .leak-position {
-            font-size: 2em;
-            color: #ffd700;
-        }
-        
-        .controls {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: 15px;
-            margin-bottom: 30px;
-        }
-        .btn {
-            background: #00d9ff;
-            color: #1a1a2e;
-            border: none;
-            padding: 15px;
-            border-radius: 10px;
-            cursor: pointer;
-            font-size: 16px;
-            font-weight: bold;
-            transition: all 0.3s;
-        }
-        .btn:hover { transform: translateY(-2px); box-shadow: 0 5px 15px rgba(0,217,255,0.5); }
-        .btn-danger { background: #ff4757; color: white; }
-        .btn-success { background: #2ed573; color: white; }
-        
-        .status-cards {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
-            gap: 20px;
-            margin-bottom: 30px;
-        }
-        .status-card {
-            background: #16213e;
-            border-radius: 10px;
-            padding: 20px;
-            border: 2px solid #0f3460;
-        }
-        .status-card h3 { color: #00d9ff; margin-bottom: 10px; }
-        .status-value { font-size: 2em; font-weight: bold; }
-        .status-ok { color: #2ed573; }
-        .status-error { color: #ff4757; }
-        
-        .charts-container {
-            display: grid;
-            grid-template-columns: repeat(2, 1fr);
-            gap: 20px;
-            margin-bottom: 30px;
-        }
-        .chart-wrapper {
-            background: #16213e;
-            border-radius: 10px;
-            padding: 20px;
-            border: 2px solid #0f3460;
-        }
-        .chart-wrapper h3 {
-            color: #00d9ff;
-            margin-bottom: 15px;
-            text-align: center;
-        }
-        canvas { width: 100% !important; height: 300px !important; }
-        
-        @media (max-width: 1200px) {
-            .charts-container { grid-template-columns: 1fr; }
-        }
-    </style>
+    <script src="{{ recursos['chart.js'] }}"></script>
+    <link rel="stylesheet" href="{{ recursos['panel.css'] }}">
 </head>
-<body>
+<body data-version-eventos="{{ version_eventos }}" data-flujos="{{ num_flujos }}" data-presiones="{{ num_presiones }}">
     <div class="container">
         <h1>🔧 Sistema de Detección de Fugas en Tuberías</h1>
         
@@ -202,18 +715,14 @@ HTML_TEMPLATE = '''
         </div>
         
         <div class="status-cards">
+            {% for tarjeta_id, paquetes in paquetes_tarjetas %}
             <div class="status-card">
-                <h3>📦 Tarjeta 1</h3>
-                <div class="status-value" id="paquetesT1">{{ paquetes_t1 }}</div>
-                <div>paquetes almacenados</div>
-                <div id="estadoT1" class="status-ok" style="margin-top: 10px;">✅ Recibiendo datos</div>
-            </div>
-            <div class="status-card">
-                <h3>📦 Tarjeta 2</h3>
-                <div class="status-value" id="paquetesT2">{{ paquetes_t2 }}</div>
+                <h3>📦 Tarjeta {{ tarjeta_id }}</h3>
+                <div class="status-value" id="paquetesT{{ tarjeta_id }}">{{ paquetes }}</div>
                 <div>paquetes almacenados</div>
-                <div id="estadoT2" class="status-ok" style="margin-top: 10px;">✅ Recibiendo datos</div>
+                <div id="estadoT{{ tarjeta_id }}" class="status-ok" style="margin-top: 10px;">✅ Recibiendo datos</div>
             </div>
+            {% endfor %}
             <div class="status-card">
                 <h3>⏱️ Tiempo Muestreo</h3>
                 <div class="status-value" id="tiempoMuestreo">{{ tiempo_muestreo }}</div>
@@ -230,237 +739,446 @@ HTML_TEMPLATE = '''
             <button class="btn btn-success" onclick="duplicarT1aT2()">📋 Duplicar T1 → T2</button>
             <button class="btn" onclick="actualizarGraficas()">🔄 Actualizar Gráficas</button>
             <button class="btn btn-danger" onclick="limpiarDatos()">🗑️ Limpiar Datos</button>
+            <select class="btn" id="vista" onchange="cambiarVista(this.value)">
+                <option value="promedio">📈 Promedio por paquete</option>
+                <option value="lttb">🔍 Muestras (LTTB)</option>
+                <option value="minmax">🔍 Muestras (mín/máx)</option>
+            </select>
         </div>
         
         <h2 style="color: #00d9ff; margin: 30px 0 20px;">📊 Gráficas de Flujo (L/min)</h2>
         <div class="charts-container">
-            <div class="chart-wrapper"><h3>Flujo 1</h3><canvas id="chartFlujo1"></canvas></div>
-            <div class="chart-wrapper"><h3>Flujo 2</h3><canvas id="chartFlujo2"></canvas></div>
-            <div class="chart-wrapper"><h3>Flujo 3</h3><canvas id="chartFlujo3"></canvas></div>
-            <div class="chart-wrapper"><h3>Flujo 4</h3><canvas id="chartFlujo4"></canvas></div>
-            <div class="chart-wrapper"><h3>Flujo 5</h3><canvas id="chartFlujo5"></canvas></div>
-            <div class="chart-wrapper"><h3>Flujo 6</h3><canvas id="chartFlujo6"></canvas></div>
+            {% for i in range(1, num_flujos + 1) %}
+            <div class="chart-wrapper"><h3>Flujo {{ i }}</h3><canvas id="chartFlujo{{ i }}"></canvas></div>
+            {% endfor %}
         </div>
         
         <h2 style="color: #00d9ff; margin: 30px 0 20px;">💧 Gráficas de Presión (m.c.a)</h2>
         <div class="charts-container">
-            <div class="chart-wrapper"><h3>Presión 1</h3><canvas id="chartPresion1"></canvas></div>
-            <div class="chart-wrapper"><h3>Presión 2</h3><canvas id="chartPresion2"></canvas></div>
-            <div class="chart-wrapper"><h3>Presión 3</h3><canvas id="chartPresion3"></canvas></div>
-            <div class="chart-wrapper"><h3>Presión 4</h3><canvas id="chartPresion4"></canvas></div>
-            <div class="chart-wrapper"><h3>Presión 5</h3><canvas id="chartPresion5"></canvas></div>
-            <div class="chart-wrapper"><h3>Presión 6</h3><canvas id="chartPresion6"></canvas></div>
+            {% for i in range(1, num_presiones + 1) %}
+            <div class="chart-wrapper"><h3>Presión {{ i }}</h3><canvas id="chartPresion{{ i }}"></canvas></div>
+            {% endfor %}
         </div>
     </div>
 
-    <script>
-        let charts = {};
-        
-        function initCharts() {
-            const chartConfig = (title) => ({
-                type: 'line',
-                data: { labels: [], datasets: [{ label: title, data: [], borderColor: '#00d9ff', tension: 0.4, fill: false }] },
-                options: { 
-                    responsive: true, 
-                    maintainAspectRatio: false,
-                    scales: { y: { beginAtZero: true, grid: { color: '#0f3460' } }, x: { grid: { color: '#0f3460' } } },
-                    plugins: { legend: { labels: { color: '#eee' } } }
-                }
-            });
-            
-            for (let i = 1; i <= 6; i++) {
-                charts[`flujo${i}`] = new Chart(document.getElementById(`chartFlujo${i}`), chartConfig(`Flujo ${i}`));
-                charts[`presion${i}`] = new Chart(document.getElementById(`chartPresion${i}`), chartConfig(`Presión ${i}`));
-            }
-        }
-        
-        async function actualizarGraficas() {
-            const response = await fetch('/obtener_ultimos_paquetes');
-            const data = await response.json();
-            
-            for (let i = 1; i <= 6; i++) {
-                charts[`flujo${i}`].data.labels = data.labels;
-                charts[`flujo${i}`].data.datasets[0].data = data[`flujo${i}`];
-                charts[`flujo${i}`].update();
-                
-                charts[`presion${i}`].data.labels = data.labels;
-                charts[`presion${i}`].data.datasets[0].data = data[`presion${i}`];
-                charts[`presion${i}`].update();
-            }
-            
-            document.getElementById('paquetesT1').textContent = data.paquetes_t1;
-            document.getElementById('paquetesT2').textContent = data.paquetes_t2;
-            document.getElementById('tiempoMuestreo').textContent = data.tiempo_muestreo;
-            document.getElementById('alarmaStatus').textContent = data.alarma;
-            document.getElementById('posicionFuga').textContent = data.posicion_fuga;
-            document.getElementById('ultimaActualizacion').textContent = data.ultima_actualizacion || 'N/A';
-            
-            if (data.estado_t1) {
-                document.getElementById('estadoT1').innerHTML = '✅ Recibiendo datos';
-                document.getElementById('estadoT1').className = 'status-ok';
-            } else {
-                document.getElementById('estadoT1').innerHTML = '❌ Sin datos';
-                document.getElementById('estadoT1').className = 'status-error';
-            }
-            
-            if (data.estado_t2) {
-                document.getElementById('estadoT2').innerHTML = '✅ Recibiendo datos';
-                document.getElementById('estadoT2').className = 'status-ok';
-            } else {
-                document.getElementById('estadoT2').innerHTML = '❌ Sin datos';
-                document.getElementById('estadoT2').className = 'status-error';
-            }
-        }
-        
-        async function generarDatosAleatorios() {
-            await fetch('/generar_aleatorios', { method: 'POST' });
-            actualizarGraficas();
-        }
-        
-        async function duplicarT1aT2() {
-            await fetch('/duplicar_t1_t2', { method: 'POST' });
-            actualizarGraficas();
-        }
-        
-        async function limpiarDatos() {
-            if (confirm('¿Eliminar todos los datos?')) {
-                await fetch('/limpiar', { method: 'POST' });
-                actualizarGraficas();
-            }
-        }
-        
-        setInterval(() => {
-            document.getElementById('horaSistema').textContent = new Date().toLocaleTimeString();
-        }, 1000);
-        
-        initCharts();
-        actualizarGraficas();
-        setInterval(actualizarGraficas, 10000);
-    </script>
+    <script id="datosIniciales" type="application/json">{{ datos_iniciales|tojson }}</script>
+    <script src="{{ recursos['panel.js'] }}"></script>
 </body>
 </html>
 '''
 
+def _etiqueta_version(*extra):
+    """ETag de lo que depende solo de los datos: arranque, versión y parámetros de la petición"""
+    partes = [int(compartido.contadores[ARRANQUE]), int(compartido.contadores[VERSION_DATOS]), *extra]
+    return '-'.join(format(p, 'x') if isinstance(p, int) else str(p) for p in partes)
+
+def _condicional(etiqueta, generar):
+    """304 sin cuerpo si el cliente ya tiene `etiqueta` (If-None-Match); si no, JSON de generar()"""
+    if request.if_none_match.contains_weak(etiqueta):
+        respuesta = Response(status=304)
+    else:
+        respuesta = jsonify(generar())
+    # Débil: la misma versión vale para cualquier Content-Encoding
+    respuesta.set_etag(etiqueta, weak=True)
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta
+
+def _codificacion_aceptada():
+    aceptadas = request.accept_encodings
+    if brotli is not None and aceptadas.quality('br') > 0:
+        return 'br'
+    if aceptadas.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+@app.after_request
+def _comprimir(respuesta):
+    """Comprime JSON y HTML con brotli o gzip según Accept-Encoding"""
+    respuesta.vary.add('Accept-Encoding')
+    if (respuesta.status_code != 200 or respuesta.direct_passthrough or respuesta.is_streamed
+            or 'Content-Encoding' in respuesta.headers or respuesta.mimetype not in COMPRIMIBLES):
+        return respuesta
+    codificacion = _codificacion_aceptada()
+    if codificacion is None or respuesta.content_length is None or respuesta.content_length < MIN_COMPRIMIR:
+        return respuesta
+    
+    etiqueta, _ = respuesta.get_etag()
+    clave = (request.path, etiqueta, codificacion) if etiqueta else None
+    with _lock_comprimidos:
+        cuerpo = _cache_comprimidos.get(clave) if clave else None
+    if cuerpo is None:
+        datos = respuesta.get_data()
+        if codificacion == 'br':
+            cuerpo = brotli.compress(datos, quality=CALIDAD_BROTLI)
+        else:
+            cuerpo = gzip.compress(datos, compresslevel=NIVEL_GZIP)
+        if clave:
+            with _lock_comprimidos:
+                if len(_cache_comprimidos) >= MAX_CACHE_COMPRIMIDOS:
+                    _cache_comprimidos.pop(next(iter(_cache_comprimidos)))
+                _cache_comprimidos[clave] = cuerpo
+    respuesta.set_data(cuerpo)
+    respuesta.headers['Content-Encoding'] = codificacion
+    return respuesta
+
+# Compilada una sola vez al importar; home() solo la renderiza
+PLANTILLA_PANEL = app.jinja_env.from_string(HTML_TEMPLATE)
+
 @app.route('/')
 def home():
     estado = verificar_recepcion_datos()
-    tiempo_muestreo = paquetes_tarjeta1[0]['mediciones'][0]['tiempo_muestreo'] if paquetes_tarjeta1 else 100
+    analisis = resultado_actual()
     
-    return render_template_string(HTML_TEMPLATE,
-        alarma=resultado_analisis['alarma_fuga'],
-        posicion=resultado_analisis['posicion_fuga'],
-        ultima_act=resultado_analisis['ultima_actualizacion'],
-        paquetes_t1=len(paquetes_tarjeta1),
-        paquetes_t2=len(paquetes_tarjeta2),
-        tiempo_muestreo=tiempo_muestreo,
-        hora_actual=datetime.now().strftime('%H:%M:%S')
+    return PLANTILLA_PANEL.render(
+        alarma=analisis['alarma_fuga'],
+        posicion=analisis['posicion_fuga'],
+        ultima_act=analisis['ultima_actualizacion'],
+        paquetes_tarjetas=[(tarjeta_id, len(buf)) for tarjeta_id, buf in buffers.items()],
+        num_flujos=tarjetas.max_flujos,
+        num_presiones=tarjetas.max_presiones,
+        tiempo_muestreo=tiempo_muestreo_actual(),
+        hora_actual=datetime.now().strftime('%H:%M:%S'),
+        recursos=RECURSOS,
+        datos_iniciales=_datos_panel(estado),
+        version_eventos=notificador.version
     )
 
+def _ingerir(formato, carga, cantidad=1):
+    """Entrega a la ingesta un cuerpo de texto por parsear o una lista de
+    (tarjeta_id, muestras, hora, secuencia_placa) ya parseados.
+
+    Devuelve None si se aceptó, o la respuesta de error (503 con la cola
+    llena; 500 si falla el guardado sin ingesta asíncrona).
+    """
+    trabajo = (time.time(), formato, carga)
+    if cola_ingesta is None:
+        try:
+            _procesar_ingesta([trabajo])
+        except Exception as e:
+            log.exception("Error: %s", e)
+            return jsonify({'error': str(e)}), 500
+    elif not cola_ingesta.encolar(trabajo):
+        PAQUETES_RECHAZADOS.incrementar(cantidad, formato=formato, motivo='cola_llena')
+        log.warning("Cola de ingesta llena: %d paquetes rechazados", cantidad)
+        return jsonify({'error': 'Cola de ingesta llena, reintentar'}), 503, {'Retry-After': str(REINTENTAR_EN)}
+    return None
+
+def _procesar_ingesta(trabajos):
+    """Hilo de ingesta: parsea los cuerpos de texto y guarda todo con un solo agregar_lote"""
+    paquetes = []
+    formatos = []
+    ahora = time.time()
+    for llegada, formato, carga in trabajos:
+        LATENCIA.observar(ahora - llegada, etapa='cola')
+        if isinstance(carga, str):
+            try:
+                with LATENCIA.medir(etapa='parseo'):
+                    tarjeta_id, (hora, minuto, segundo), muestras, secuencia = parsear_paquete(
+                        carga, formas=tarjetas.forma)
+            except PaqueteInvalido as e:
+                PAQUETES_RECHAZADOS.incrementar(formato=formato, motivo=_motivo_rechazo(e))
+                log.warning("Paquete rechazado: %s", e)
+                continue
+            carga = [(tarjeta_id, muestras, hora_a_segundos(hora, minuto, segundo), secuencia)]
+        # La hora de llegada es la de la petición, no la del momento de guardarlo
+        paquetes.extend((tarjeta_id, muestras, hora, llegada, secuencia)
+                        for tarjeta_id, muestras, hora, secuencia in carga)
+        formatos.extend([formato] * len(carga))
+    if not paquetes:
+        return
+    
+    try:
+        guardados = agregar_lote(paquetes)
+    except Exception:
+        for formato in formatos:
+            PAQUETES_RECHAZADOS.incrementar(formato=formato, motivo='error')
+        raise
+    for paquete, formato, guardado in zip(paquetes, formatos, guardados):
+        if guardado:
+            PAQUETES_RECIBIDOS.incrementar(tarjeta=paquete[0], formato=formato)
+    log.debug("✅ Guardados %d paquetes", sum(guardados))
+
 @app.route('/recibir_paquete', methods=['POST'])
 def recibir_paquete():
-    """Recibe paquetes de Arduino"""
+    """Recibe paquetes de Arduino.
+
+    Con la ingesta asíncrona solo se valida el encuadre (cabecera, tarjeta,
+    hora y número de filas) antes de responder; los números se convierten en
+    el hilo de ingesta y un paquete con filas ilegibles se descarta allí.
+    """
+    cuerpo = request.get_data(as_text=True)
+    TAMANO_PETICION.observar(request.content_length or 0, endpoint='recibir_paquete')
     try:
-        datos = request.get_data(as_text=True)
-        lineas = datos.strip().split('\n')
-        
-        if lineas[0] != 'PAQUETE' or lineas[-1] != 'FIN_PAQUETE':
-            return jsonify({'error': 'Formato inválido'}), 400
+        if cola_ingesta is None:
+            with LATENCIA.medir(etapa='parseo'):
+                tarjeta_id, (hora, minuto, segundo), muestras, secuencia = parsear_paquete(
+                    cuerpo, formas=tarjetas.forma)
+            carga = [(tarjeta_id, muestras, hora_a_segundos(hora, minuto, segundo), secuencia)]
+        else:
+            with LATENCIA.medir(etapa='encuadre'):
+                tarjeta_id, _ = validar_paquete(cuerpo, formas=tarjetas.forma)
+            carga = cuerpo
+    except PaqueteInvalido as e:
+        PAQUETES_RECHAZADOS.incrementar(formato='texto', motivo=_motivo_rechazo(e))
+        log.warning("Paquete rechazado: %s", e)
+        return jsonify({'error': str(e)}), 400
+    
+    error = _ingerir('texto', carga)
+    if error is not None:
+        return error
+    log.debug("✅ Paquete recibido de Tarjeta %s", tarjeta_id)
+    return jsonify({'status': 'success'}), 200
+
+@app.route('/recibir_paquete_binario', methods=['POST'])
+def recibir_paquete_binario():
+    """Recibe paquetes de Arduino en trama binaria (ver parser_paquetes)"""
+    cuerpo = request.get_data()
+    TAMANO_PETICION.observar(len(cuerpo), endpoint='recibir_paquete_binario')
+    try:
+        with LATENCIA.medir(etapa='parseo_binario'):
+            tarjeta_id, (hora, minuto, segundo), tiempos, valores, secuencia = parsear_trama(
+                cuerpo, formas=tarjetas.forma)
+    except PaqueteInvalido as e:
+        PAQUETES_RECHAZADOS.incrementar(formato='binario', motivo=_motivo_rechazo(e))
+        log.warning("Trama rechazada: %s", e)
+        return jsonify({'error': str(e)}), 400
+    
+    # La trama ya está validada entera (sin coste de conversión): se encola parseada
+    error = _ingerir('binario', [(tarjeta_id, _muestras_de_trama(tiempos, valores),
+                                  hora_a_segundos(hora, minuto, segundo), secuencia)])
+    if error is not None:
+        return error
+    log.debug("✅ Paquete binario recibido de Tarjeta %s", tarjeta_id)
+    return jsonify({'status': 'success'}), 200
+
+def _motivo_rechazo(error):
+    return 'desconocida' if isinstance(error, TarjetaDesconocida) else 'invalido'
+
+def _muestras_de_trama(tiempos, valores):
+    """Une tiempos y valores de una trama binaria en el arreglo (muestras x columnas)"""
+    muestras = np.empty((len(tiempos), valores.shape[1] + 1), dtype=np.float32)
+    muestras[:, 0] = tiempos
+    muestras[:, 1:] = valores
+    return muestras
+
+@app.route('/recibir_lote', methods=['POST'])
+def recibir_lote():
+    """Recibe muchos paquetes (de una o varias tarjetas) en una sola petición.
+
+    Cuerpo de texto: bloques PAQUETE...FIN_PAQUETE seguidos. Con
+    Content-Type application/octet-stream: tramas binarias seguidas.
+    Los paquetes válidos se ingieren ordenados por hora de la placa, todos
+    en un único trabajo de la cola de ingesta.
+
+    Responde 200 si se aceptaron todos, 207 ('parcial') si solo algunos y
+    400 si ninguno; 'sin_procesar' son los bytes de tramas que no se
+    pudieron separar (tras una cabecera inválida se sigue en la siguiente).
+    """
+    binario = request.mimetype == 'application/octet-stream'
+    formato = 'binario' if binario else 'texto'
+    estados = []
+    validos = []
+    sin_procesar = 0
+    TAMANO_PETICION.observar(request.content_length or 0, endpoint='recibir_lote')
+    if binario:
+        bloques = dividir_lote_binario(request.get_data(), formas=tarjetas.forma)
+    else:
+        bloques = dividir_lote_texto(request.get_data(as_text=True))
+    for indice, bloque in enumerate(bloques):
+        try:
+            if isinstance(bloque, PaqueteInvalido):
+                # Tramo sin cabecera legible: se informa y el divisor sigue en la siguiente trama
+                sin_procesar += bloque.sin_procesar
+                raise bloque
+            if binario:
+                with LATENCIA.medir(etapa='parseo_binario'):
+                    tarjeta_id, (hora, minuto, segundo), tiempos, valores, secuencia = parsear_trama(
+                        bloque, formas=tarjetas.forma)
+                    muestras = _muestras_de_trama(tiempos, valores)
+            else:
+                with LATENCIA.medir(etapa='parseo'):
+                    tarjeta_id, (hora, minuto, segundo), muestras, secuencia = parsear_paquete(
+                        bloque, formas=tarjetas.forma)
+        except PaqueteInvalido as e:
+            PAQUETES_RECHAZADOS.incrementar(formato=formato, motivo=_motivo_rechazo(e))
+            estados.append({'indice': indice, 'status': 'error', 'error': str(e)})
+            continue
+        estados.append({'indice': indice, 'tarjeta': tarjeta_id, 'status': 'success'})
+        validos.append((tarjeta_id, muestras, hora_a_segundos(hora, minuto, segundo), secuencia))
+
+    if validos:
+        # En orden de hora de la placa cada uno va al final de su buffer, sin desplazar otros
+        ahora = time.time()
+        validos.sort(key=lambda p: tiempo_placa(ahora, p[2]))
+        error = _ingerir(formato, validos, len(validos))
+        if error is not None:
+            return error
+    rechazados = len(estados) - len(validos)
+    log.debug("✅ Lote recibido: %d paquetes aceptados, %d rechazados", len(validos), rechazados)
+    if not validos:
+        status, codigo = 'error', 400
+    elif rechazados:
+        status, codigo = 'parcial', 207
+    else:
+        status, codigo = 'success', 200
+    respuesta = {
+        'status': status,
+        'aceptados': len(validos),
+        'rechazados': rechazados,
+        'sin_procesar': sin_procesar,
+        'paquetes': estados
+    }
+    return jsonify(respuesta), codigo
+
+def _canales_panel(tarjeta_id, canales):
+    """Canales de la tarjeta (..., flujos + presiones) en el orden de CLAVES_PANEL:
+    presiones en m.c.a y NaN en las gráficas de canales que la tarjeta no tiene"""
+    esquema = tarjetas[tarjeta_id]
+    panel = np.full(canales.shape[:-1] + (len(CLAVES_PANEL),), np.nan)
+    panel[..., :esquema.flujos] = canales[..., :esquema.flujos]
+    inicio = tarjetas.max_flujos
+    panel[..., inicio:inicio + esquema.presiones] = canales[..., esquema.flujos:] * esquema.factor_presion
+    return panel
+
+def _redondear(valores):
+    """Lista JSON con 2 decimales; los huecos (NaN) van como null"""
+    redondeados = np.round(valores, 2).astype(object)
+    redondeados[np.isnan(valores)] = None
+    return redondeados.tolist()
+
+def datos_graficas():
+    """Últimos 10 paquetes (todas las tarjetas) listos para las gráficas.
+
+    Usa las medias calculadas al insertar cada paquete y se cachea hasta que
+    llegue un paquete nuevo, así N paneles abiertos cuestan un solo cálculo.
+    """
+    with _lock_cache, compartido.lectura():
+        version = int(compartido.contadores[VERSION_DATOS])
+        if _cache_graficas['version'] == version:
+            return _cache_graficas['datos']
         
-        tiempo = lineas[1].split(',')
-        hora, minuto, segundo = int(tiempo[0]), int(tiempo[1]), int(tiempo[2])
+        todos_paquetes = _ultimos_paquetes(10)
         
-        tarjeta_line = lineas[2]
-        tarjeta_id = int(tarjeta_line.replace('TARJETA', ''))
+        labels = [f"T{tarjeta_id} {segundos_a_hora(buf.horas[pos])}" for tarjeta_id, buf, pos in todos_paquetes]
         
-        mediciones = []
-        for i in range(3, 203):
-            valores = lineas[i].split(',')
-            mediciones.append({
-                'tiempo_muestreo': int(valores[0]),
-                'flujos': [float(valores[j]) for j in range(1, 7)],
-                'presiones': [float(valores[j]) for j in range(7, 13)]
-            })
+        # Fila 0 de los agregados = media de cada canal
+        medias = np.empty((len(todos_paquetes), len(CLAVES_PANEL)))
+        for k, (tarjeta_id, buf, pos) in enumerate(todos_paquetes):
+            medias[k] = _canales_panel(tarjeta_id, buf.agregados[pos, 0])
         
-        paquete = {
-            'timestamp': time.time(),
-            'hora_inicio': f"{hora:02d}:{minuto:02d}:{segundo:02d}",
-            'mediciones': mediciones
+        datos = {
+            'labels': labels,
+            **{clave: _redondear(medias[:, i]) for i, clave in enumerate(CLAVES_PANEL)},
+            'paquetes': {str(tarjeta_id): len(buf) for tarjeta_id, buf in buffers.items()},
+            'tiempo_muestreo': tiempo_muestreo_actual()
         }
+        _cache_graficas['version'] = version
+        _cache_graficas['datos'] = datos
+        return datos
+
+def _ultimos_paquetes(cantidad):
+    """(tarjeta_id, buffer, posición) de los últimos `cantidad` paquetes de todas las tarjetas por hora de la placa"""
+    partes = [(tarjeta_id, buf, buf.posiciones(cantidad)) for tarjeta_id, buf in buffers.items() if len(buf)]
+    if not partes:
+        return []
+    # Un arreglo por campo; cada tarjeta es ya un tramo ordenado por hora de la placa y
+    # la ordenación estable (timsort) solo tiene que mezclar los tramos
+    tiempos = np.concatenate([buf.tiempos_placa[pos] for _, buf, pos in partes])
+    origen = np.repeat(np.arange(len(partes)), [len(pos) for _, _, pos in partes])
+    posiciones = np.concatenate([pos for _, _, pos in partes])
+    elegidos = np.argsort(tiempos, kind='stable')[-cantidad:]
+    return [(partes[k][0], partes[k][1], int(pos)) for k, pos in zip(origen[elegidos], posiciones[elegidos])]
+
+def series_muestras(ancho, algoritmo, num_paquetes):
+    """Muestras crudas de los últimos paquetes, reducidas a `ancho` puntos por canal.
+
+    x es la posición de la muestra en la serie concatenada; 'paquetes' indica
+    dónde empieza cada paquete para poder etiquetar el eje.
+    """
+    clave = (ancho, algoritmo, num_paquetes)
+    with _lock_cache, compartido.lectura():
+        version = int(compartido.contadores[VERSION_DATOS])
+        if _cache_muestras['version'] != version:
+            _cache_muestras['version'] = version
+            _cache_muestras['series'] = {}
+        elif clave in _cache_muestras['series']:
+            return _cache_muestras['series'][clave]
         
-        agregar_paquete(tarjeta_id, paquete)
-        print(f"✅ Paquete recibido de Tarjeta {tarjeta_id}")
-        
-        return jsonify({'status': 'success'}), 200
+        paquetes = _ultimos_paquetes(num_paquetes)
+        if paquetes:
+            valores = np.concatenate([_canales_panel(tarjeta_id, buf.muestras[pos, :, 1:])
+                                      for tarjeta_id, buf, pos in paquetes])
+        else:
+            valores = np.empty((0, len(CLAVES_PANEL)))
+        inicios = np.cumsum([0] + [buf.num_muestras for _, buf, _ in paquetes[:-1]])
+        x = np.arange(len(valores), dtype=np.float64)
+        # Los canales que falten en alguna tarjeta cuentan como 0 al elegir y salen como huecos
+        indices = (submuestrear(x, np.nan_to_num(valores), ancho, algoritmo) if len(valores)
+                   else np.empty((len(CLAVES_PANEL), 0), dtype=np.int64))
         
-    except Exception as e:
-        print(f"Error: {e}")
-        return jsonify({'error': str(e)}), 500
+        series = {
+            'algoritmo': algoritmo,
+            'ancho': ancho,
+            'muestras': len(valores),
+            'paquetes': [{'label': f"T{tarjeta_id} {segundos_a_hora(buf.horas[pos])}", 'inicio': int(inicio)}
+                         for inicio, (tarjeta_id, buf, pos) in zip(inicios, paquetes)]
+        }
+        for canal, clave_canal in enumerate(CLAVES_PANEL):
+            elegidos = indices[canal]
+            series[clave_canal] = {'x': elegidos.tolist(), 'y': _redondear(valores[elegidos, canal])}
+        _cache_muestras['series'][clave] = series
+        return series
+
+@app.route('/datos_grafica', methods=['GET'])
+def datos_grafica():
+    """Muestras crudas de cada canal submuestreadas al ancho de la gráfica.
+
+    ?ancho=<píxeles>&algoritmo=lttb|minmax&paquetes=<n> (por defecto 800, lttb, 10)
+    """
+    ancho = min(max(3, request.args.get('ancho', 800, type=int)), MAX_ANCHO_GRAFICA)
+    algoritmo = request.args.get('algoritmo', 'lttb')
+    if algoritmo not in ALGORITMOS:
+        return jsonify({'error': f"Algoritmo desconocido, usar uno de {list(ALGORITMOS)}"}), 400
+    num_paquetes = min(max(1, request.args.get('paquetes', 10, type=int)), MAX_PAQUETES_GRAFICA)
+    return _condicional(_etiqueta_version(ancho, algoritmo, num_paquetes),
+                        lambda: series_muestras(ancho, algoritmo, num_paquetes))
 
 @app.route('/obtener_ultimos_paquetes', methods=['GET'])
 def obtener_ultimos_paquetes():
     """Obtiene últimos 10 paquetes para gráficas"""
     estado = verificar_recepcion_datos()
+    etiqueta = _etiqueta_version(int(compartido.contadores[VERSION_ANALISIS]),
+                                 ''.join('1' if activo else '0' for activo in estado.values()))
     
-    todos_paquetes = []
-    for p in paquetes_tarjeta1[-10:]:
-        todos_paquetes.append(('T1', p))
-    for p in paquetes_tarjeta2[-10:]:
-        todos_paquetes.append(('T2', p))
-    
-    todos_paquetes.sort(key=lambda x: x[1]['timestamp'])
-    
-    labels = [f"{p[0]} {p[1]['hora_inicio']}" for p in todos_paquetes[-10:]]
-    
-    flujos = {f'flujo{i}': [] for i in range(1, 7)}
-    presiones = {f'presion{i}': [] for i in range(1, 7)}
-    
-    for _, paquete in todos_paquetes[-10:]:
-        for i in range(6):
-            flujo_prom = sum(m['flujos'][i] for m in paquete['mediciones']) / 200
-            presion_prom = sum(m['presiones'][i] for m in paquete['mediciones']) / 200
-            presion_mca = presion_prom * 2.0
-            
-            flujos[f'flujo{i+1}'].append(round(flujo_prom, 2))
-            presiones[f'presion{i+1}'].append(round(presion_mca, 2))
-    
-    tiempo_muestreo = paquetes_tarjeta1[0]['mediciones'][0]['tiempo_muestreo'] if paquetes_tarjeta1 else 100
-    
-    return jsonify({
-        'labels': labels,
-        **flujos,
-        **presiones,
-        'paquetes_t1': len(paquetes_tarjeta1),
-        'paquetes_t2': len(paquetes_tarjeta2),
-        'tiempo_muestreo': tiempo_muestreo,
-        'alarma': resultado_analisis['alarma_fuga'],
-        'posicion_fuga': resultado_analisis['posicion_fuga'],
-        'ultima_actualizacion': resultado_analisis['ultima_actualizacion'],
-        'estado_t1': estado['tarjeta1'],
-        'estado_t2': estado['tarjeta2']
-    })
+    return _condicional(etiqueta, lambda: _datos_panel(estado))
+
+def _datos_panel(estado):
+    """Gráficas, análisis y estado de las tarjetas (lo que pinta el panel)"""
+    analisis = resultado_actual()
+    return {
+        **datos_graficas(),
+        'alarma': analisis['alarma_fuga'],
+        'posicion_fuga': analisis['posicion_fuga'],
+        'ultima_actualizacion': analisis['ultima_actualizacion'],
+        'estados': _evento_estado(estado)
+    }
 
 @app.route('/generar_aleatorios', methods=['POST'])
 def generar_aleatorios():
     """Genera 10 paquetes aleatorios de prueba"""
     import random
-    tarjeta = random.choice([1, 2])
+    tarjeta = random.choice(tarjetas.ids)
+    esquema = tarjetas[tarjeta]
+    n = esquema.num_muestras
+    rng = np.random.default_rng()
     
     for _ in range(10):
-        mediciones = []
-        for j in range(200):
-            mediciones.append({
-                'tiempo_muestreo': j * 100,
-                'flujos': [random.uniform(10, 50) for _ in range(6)],
-                'presiones': [random.uniform(1.0, 4.5) for _ in range(6)]
-            })
+        muestras = np.empty((n, esquema.num_columnas), dtype=np.float32)
+        muestras[:, 0] = np.arange(n) * esquema.periodo_ms
+        muestras[:, esquema.col_flujos] = rng.uniform(10, 50, (n, esquema.flujos))
+        muestras[:, esquema.col_presiones] = rng.uniform(1.0, 4.5, (n, esquema.presiones))
         
-        paquete = {
-            'timestamp': time.time(),
-            'hora_inicio': datetime.now().strftime('%H:%M:%S'),
-            'mediciones': mediciones
-        }
-        
-        agregar_paquete(tarjeta, paquete)
+        agregar_paquete(tarjeta, muestras, texto_a_segundos(datetime.now().strftime('%H:%M:%S')), archivar=False)
         time.sleep(0.1)
     
     return jsonify({'status': 'success'})
@@ -468,57 +1186,290 @@ def generar_aleatorios():
 @app.route('/duplicar_t1_t2', methods=['POST'])
 def duplicar_t1_t2():
     """Duplica datos de T1 a T2"""
-    global paquetes_tarjeta2
-    paquetes_tarjeta2 = paquetes_tarjeta1.copy()
-    guardar_datos()
+    if 1 not in buffers or 2 not in buffers or buffers[1].muestras.shape != buffers[2].muestras.shape:
+        return jsonify({'error': 'Las tarjetas 1 y 2 deben estar registradas con el mismo esquema'}), 400
+    with compartido.escritura():
+        buffers[2].vaciar()
+        with registro.lote():
+            for pos in buffers[1].posiciones():
+                _insertar_paquete(2, buffers[1].muestras[pos], buffers[1].horas[pos], buffers[1].timestamps[pos],
+                                  archivar=False)
+        _datos_modificados()
+        guardar_datos()
+    notificador.publicar('recarga', {})
     return jsonify({'status': 'success'})
 
 @app.route('/limpiar', methods=['POST'])
 def limpiar():
     """Limpia todos los datos"""
-    global paquetes_tarjeta1, paquetes_tarjeta2
-    paquetes_tarjeta1 = []
-    paquetes_tarjeta2 = []
-    guardar_datos()
+    vaciar_buffers()
     return jsonify({'status': 'success'})
 
 @app.route('/obtener_datos_raspberry', methods=['GET'])
 def obtener_datos_raspberry():
-    """Raspberry Pi obtiene datos en orden de llegada"""
-    todos = []
-    for p in paquetes_tarjeta1:
-        todos.append({'tarjeta': 1, 'paquete': p})
-    for p in paquetes_tarjeta2:
-        todos.append({'tarjeta': 2, 'paquete': p})
-    
-    todos.sort(key=lambda x: x['paquete']['timestamp'])
+    """Raspberry Pi obtiene datos.
+
+    Con ?desde=<cursor> devuelve, en orden de llegada, solo los paquetes con
+    secuencia mayor que el cursor (a lo sumo ?max=, por defecto
+    MAX_LOTE_RASPBERRY) y el cursor para la siguiente llamada. Sin parámetros
+    devuelve todo lo retenido en orden de hora de la placa.
+    """
+    desde = request.args.get('desde', type=int)
+    formato = request.args.get('formato', 'json')
+    if formato not in FORMATOS_RASPBERRY:
+        return jsonify({'error': f"Formato desconocido, usar uno de {list(FORMATOS_RASPBERRY)}"}), 400
     
-    return jsonify({'paquetes': todos})
+    def generar():
+        with compartido.lectura():
+            # Cada buffer da sus paquetes ya ordenados: se mezclan en lugar de ordenar el conjunto
+            if desde is None:
+                todos = list(heapq.merge(*(
+                    [(buf.tiempos_placa[pos], tarjeta_id, buf, pos) for pos in buf.posiciones()]
+                    for tarjeta_id, buf in buffers.items()
+                ), key=lambda x: x[0]))
+                hay_mas = False
+            else:
+                maximo = max(1, request.args.get('max', MAX_LOTE_RASPBERRY, type=int))
+                todos = list(itertools.islice(heapq.merge(*(
+                    [(buf.secuencias[pos], tarjeta_id, buf, pos) for pos in buf.posiciones_desde(desde, maximo + 1)]
+                    for tarjeta_id, buf in buffers.items()
+                ), key=lambda x: x[0]), maximo + 1))
+                hay_mas = len(todos) > maximo
+                todos = todos[:maximo]
+            
+            if formato == 'columnar':
+                paquetes = _paquetes_columnar(todos)
+                secuencias = paquetes['secuencia']
+            else:
+                paquetes = [{'tarjeta': tarjeta_id, 'secuencia': int(buf.secuencias[pos]), 'paquete': buf.paquete(pos)}
+                            for _, tarjeta_id, buf, pos in todos]
+                secuencias = [p['secuencia'] for p in paquetes]
+            cursor = max(secuencias, default=desde or 0)
+            respuesta = {'paquetes': paquetes, 'cursor': cursor, 'hay_mas': hay_mas}
+            if desde is not None:
+                # Paquetes pisados por falta de espacio antes de que la Raspberry los leyera
+                respuesta['datos_perdidos'] = any(buf.secuencia_pisada > desde for buf in buffers.values())
+        return respuesta
+    return _condicional(_etiqueta_version(zlib.crc32(request.query_string)), generar)
+
+def _paquetes_columnar(todos):
+    """Formato compacto del feed: un arreglo por campo en vez de un dict por medición.
+
+    flujos y presiones son, por paquete, una lista por canal de la tarjeta
+    con sus muestras: (paquetes, canales, muestras).
+    """
+    muestras = [buf.muestras[pos].astype(np.float64).round(DECIMALES_JSON) for _, _, buf, pos in todos]
+    return {
+        'tarjeta': [tarjeta_id for _, tarjeta_id, _, _ in todos],
+        'secuencia': [int(buf.secuencias[pos]) for _, _, buf, pos in todos],
+        'timestamp': [float(buf.timestamps[pos]) for _, _, buf, pos in todos],
+        'hora_inicio': [segundos_a_hora(buf.horas[pos]) for _, _, buf, pos in todos],
+        'tiempo_muestreo': [m[:, 0].astype(np.int64).tolist() for m in muestras],
+        'flujos': [m[:, buf.col_flujos].T.tolist() for m, (_, _, buf, _) in zip(muestras, todos)],
+        'presiones': [m[:, buf.col_presiones].T.tolist() for m, (_, _, buf, _) in zip(muestras, todos)]
+    }
+
+@app.route('/confirmar_datos_procesados', methods=['POST'])
+def confirmar_datos_procesados():
+    """Raspberry confirma lo procesado hasta un cursor: {"hasta": <secuencia>}"""
+    data = request.get_json(silent=True) or {}
+    try:
+        hasta = int(data['hasta'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Falta "hasta" (secuencia entera)'}), 400
+    return jsonify({'status': 'success', 'liberados': confirmar_hasta(hasta)})
 
 @app.route('/borrar_datos_procesados', methods=['POST'])
 def borrar_datos_procesados():
-    """Raspberry borra datos después de procesar"""
-    global paquetes_tarjeta1, paquetes_tarjeta2
-    paquetes_tarjeta1 = []
-    paquetes_tarjeta2 = []
-    guardar_datos()
+    """Raspberry borra datos después de procesar (con {"hasta": n} solo hasta ese cursor)"""
+    data = request.get_json(silent=True) or {}
+    if 'hasta' in data:
+        return confirmar_datos_procesados()
+    vaciar_buffers()
     return jsonify({'status': 'success'})
 
 @app.route('/actualizar_analisis', methods=['POST'])
 def actualizar_analisis():
     """Raspberry actualiza resultado del análisis"""
-    global resultado_analisis
     data = request.get_json()
-    resultado_analisis = {
+    actualizar_resultado({
         'alarma_fuga': data.get('alarma_fuga', 'NO DETECTADA'),
         'posicion_fuga': data.get('posicion_fuga', 0.0),
         'ultima_actualizacion': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    }
+    }, origen='raspberry')
     return jsonify({'status': 'success'})
 
+@app.route('/historico', methods=['GET'])
+def historico():
+    """Serie histórica de una tarjeta: ?tarjeta=1&desde=<epoch s>&hasta=<epoch s>&puntos=1000
+
+    La resolución (crudo, 1s, 1min, 1h) se elige según el rango para no pasar
+    de `puntos`; por defecto devuelve la última hora.
+    """
+    tarjeta_id = request.args.get('tarjeta', tarjetas.ids[0], type=int)
+    if tarjeta_id not in tarjetas:
+        return jsonify({'error': f"Tarjeta {tarjeta_id} no registrada"}), 404
+    esquema = tarjetas[tarjeta_id]
+    hasta = request.args.get('hasta', time.time(), type=float)
+    desde = request.args.get('desde', hasta - 3600, type=float)
+    puntos = min(max(1, request.args.get('puntos', 1000, type=int)), MAX_PUNTOS_HISTORICO)
+    if desde >= hasta:
+        return jsonify({'error': '"desde" debe ser anterior a "hasta"'}), 400
+    
+    serie = archivo_historico.consultar(tarjeta_id, desde, hasta, puntos)
+    respuesta = {
+        'tarjeta': tarjeta_id,
+        'nivel': serie['nivel'],
+        'resolucion': serie['ancho'],
+        'tiempo': np.round(serie['tiempo'], 3).tolist()
+    }
+    for nombre in ('minimo', 'media', 'maximo'):
+        valores = serie[nombre].astype(np.float64)
+        for i in range(esquema.flujos):
+            respuesta.setdefault(f'flujo{i+1}', {})[nombre] = np.round(valores[:, i], 2).tolist()
+        for i in range(esquema.presiones):
+            respuesta.setdefault(f'presion{i+1}', {})[nombre] = np.round(
+                valores[:, esquema.flujos + i] * esquema.factor_presion, 2).tolist()
+    return jsonify(respuesta)
+
+@app.route('/tarjetas', methods=['GET'])
+def obtener_tarjetas():
+    """Tarjetas registradas con su esquema y la posición de sus estaciones"""
+    posiciones = tarjetas.posiciones()
+    return jsonify({'tarjetas': [
+        {**esquema.a_dict(),
+         'posiciones': posiciones[esquema.tarjeta_id].tolist() if esquema.tarjeta_id in posiciones else None}
+        for esquema in tarjetas
+    ]})
+
+@app.route('/instantanea', methods=['GET'])
+def descargar_instantanea():
+    """Paquetes retenidos en un .npz (ver instantanea.py); ?tarjetas=1,2 para elegir tarjetas"""
+    try:
+        ids = [int(t) for t in request.args['tarjetas'].split(',')] if 'tarjetas' in request.args else tarjetas.ids
+    except ValueError:
+        return jsonify({'error': '"tarjetas" debe ser una lista de ids separados por comas'}), 400
+    desconocidas = [t for t in ids if t not in tarjetas]
+    if desconocidas:
+        return jsonify({'error': f"Tarjetas no registradas: {desconocidas}"}), 404
+    salida = io.BytesIO()
+    with compartido.lectura():
+        exportar_instantanea(salida, {t: buffers[t] for t in ids}, {t: tarjetas[t].a_dict() for t in ids},
+                             compartido.contadores[ULTIMA_SECUENCIA])
+    nombre = datetime.now().strftime('fugas_%Y%m%d_%H%M%S.npz')
+    return Response(salida.getvalue(), mimetype='application/octet-stream',
+                    headers={'Content-Disposition': f'attachment; filename={nombre}'})
+
+@app.route('/instantanea', methods=['POST'])
+def subir_instantanea():
+    """Carga un .npz de GET /instantanea: reemplaza los paquetes de las tarjetas que trae"""
+    try:
+        captura = cargar_instantanea(io.BytesIO(request.get_data()), mmap=False)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    with compartido.escritura():
+        cargados, omitidas = _restaurar_instantanea(captura)
+    if omitidas:
+        log.warning("⚠️ Instantánea: tarjetas %s no registradas o con otro esquema", omitidas)
+    if captura.ids and not cargados:
+        return jsonify({'error': 'Ninguna tarjeta de la instantánea coincide con el registro',
+                        'omitidas': omitidas}), 400
+    notificador.publicar('recarga', {})
+    return jsonify({'status': 'success', 'cargados': {str(t): n for t, n in cargados.items()},
+                    'omitidas': omitidas})
+
+@app.route('/recepcion', methods=['GET'])
+def obtener_recepcion():
+    """Continuidad de cada tarjeta: duplicados descartados, paquetes desordenados,
+    huecos y paquetes perdidos (horas de la placa en epoch s)"""
+    estado = verificar_recepcion_datos()
+    with compartido.lectura():
+        return jsonify({str(tarjeta_id): {**recepcion.estado(tarjeta_id), 'activa': estado[tarjeta_id]}
+                        for tarjeta_id in tarjetas.ids})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas en formato de texto de Prometheus (de todos los workers en modo compartido)"""
+    return Response(exponer(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/eventos', methods=['GET'])
+def eventos():
+    """Canal Server-Sent Events: paquetes nuevos, estado de tarjetas y análisis.
+
+    Cada conexión ocupa un hilo mientras está abierta; con gunicorn usar
+    workers con hilos (--worker-class gthread --threads N). Como mucho
+    MAX_CLIENTES_PUSH a la vez por worker, y cada una DURACION_MAX_EVENTOS s.
+    """
+    if not _clientes_push.acquire(blocking=False):
+        return _sin_hilos_push()
+    _iniciar_vigilancia()
+    ultima = request.headers.get('Last-Event-ID', type=int)
+    if ultima is None:
+        ultima = request.args.get('version', notificador.version, type=int)
+    
+    def flujo(ultima):
+        yield 'retry: 2000\n\n'
+        fin = time.monotonic() + DURACION_MAX_EVENTOS
+        while (restante := fin - time.monotonic()) > 0:
+            nuevos, incompleto = notificador.esperar(ultima, min(TIMEOUT_EVENTOS, restante))
+            if incompleto:
+                # Se perdieron eventos: el cliente recarga el estado completo
+                ultima = nuevos[-1]['version'] if nuevos else notificador.version
+                yield f"id: {ultima}\nevent: recarga\ndata: {{}}\n\n"
+                continue
+            if not nuevos:
+                yield ': ping\n\n'
+                continue
+            for evento in nuevos:
+                yield f"id: {evento['version']}\nevent: {evento['tipo']}\ndata: {json.dumps(evento['datos'])}\n\n"
+            ultima = nuevos[-1]['version']
+    
+    respuesta = Response(flujo(ultima), mimetype='text/event-stream',
+                         headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Se libera al cerrar la respuesta, aunque el flujo no llegue a empezar
+    respuesta.call_on_close(_clientes_push.release)
+    return respuesta
+
+@app.route('/esperar_cambios', methods=['GET'])
+def esperar_cambios():
+    """Long-poll: ?version=N espera hasta ?timeout= s a que haya eventos posteriores a N"""
+    _iniciar_vigilancia()
+    version = request.args.get('version', type=int)
+    if version is None:
+        return jsonify({'version': notificador.version, 'eventos': [], 'recargar': True})
+    timeout = min(max(request.args.get('timeout', 25, type=float), 0), 60)
+    
+    if not _clientes_push.acquire(blocking=False):
+        return _sin_hilos_push()
+    try:
+        nuevos, incompleto = notificador.esperar(version, timeout)
+    finally:
+        _clientes_push.release()
+    if nuevos:
+        version = nuevos[-1]['version']
+    elif incompleto:
+        version = notificador.version
+    return jsonify({'version': version, 'eventos': nuevos, 'recargar': incompleto})
+
 # Cargar datos al iniciar
 cargar_datos()
+if DIRECTORIO_METRICAS:
+    compartir(DIRECTORIO_METRICAS)
+    atexit.register(volcar)
+if ANALISIS_LOCAL:
+    motor_analisis = MotorAnalisis(ConfiguracionTuberia.desde_registro(tarjetas), al_actualizar=actualizar_resultado)
+    motor_analisis.iniciar()
+    if compartido.compartido:
+        threading.Thread(target=_alimentar_motor, name='alimentar_analisis', daemon=True).start()
+if INGESTA_ASINCRONA:
+    cola_ingesta = ColaIngesta(_procesar_ingesta, CAPACIDAD_COLA_INGESTA)
+    cola_ingesta.iniciar()
+atexit.register(registro.cerrar)
+atexit.register(archivo_historico.cerrar)
+if cola_ingesta is not None:
+    # Se registra después para ejecutarse antes: guardar lo encolado y luego cerrar
+    atexit.register(cola_ingesta.detener)
 
 # Para desarrollo local
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
\ No newline at end of file
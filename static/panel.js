@@ -0,0 +1,214 @@
+let charts = {};
+// Gráficas por tipo de canal: tantas como canales tiene la tarjeta más grande
+const numFlujos = Number(document.body.dataset.flujos);
+const numPresiones = Number(document.body.dataset.presiones);
+// 'promedio' = un punto por paquete; 'lttb' / 'minmax' = muestras crudas submuestreadas
+let vista = 'promedio';
+let paquetesMuestras = [];
+
+// Etiqueta del paquete al que pertenece la muestra x (vistas de muestras)
+function etiquetaMuestra(x) {
+    let etiqueta = '';
+    for (const p of paquetesMuestras) {
+        if (p.inicio <= x) etiqueta = p.label;
+    }
+    return etiqueta;
+}
+
+function initCharts() {
+    if (typeof Chart === 'undefined') {
+        // Chart.js no cargó (sin static/vendor/ ni CDN): aviso visible en lugar de gráficas en blanco
+        for (const canvas of document.querySelectorAll('.chart-wrapper canvas')) {
+            const aviso = document.createElement('p');
+            aviso.className = 'chart-aviso';
+            aviso.textContent = '⚠️ Gráfica no disponible: no se pudo cargar Chart.js';
+            canvas.replaceWith(aviso);
+        }
+        return;
+    }
+    const chartConfig = (title) => vista === 'promedio' ? {
+        type: 'line',
+        data: { labels: [], datasets: [{ label: title, data: [], borderColor: '#00d9ff', tension: 0.4, fill: false }] },
+        options: { 
+            responsive: true, 
+            maintainAspectRatio: false,
+            scales: { y: { beginAtZero: true, grid: { color: '#0f3460' } }, x: { grid: { color: '#0f3460' } } },
+            plugins: { legend: { labels: { color: '#eee' } } }
+        }
+    } : {
+        type: 'line',
+        data: { datasets: [{ label: title, data: [], borderColor: '#00d9ff', borderWidth: 1, pointRadius: 0, tension: 0, fill: false }] },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            animation: false,
+            parsing: false,
+            scales: {
+                y: { grid: { color: '#0f3460' } },
+                x: { type: 'linear', grid: { color: '#0f3460' }, ticks: { callback: etiquetaMuestra } }
+            },
+            plugins: { legend: { labels: { color: '#eee' } } }
+        }
+    };
+    
+    for (let i = 1; i <= numFlujos; i++) {
+        charts[`flujo${i}`] = new Chart(document.getElementById(`chartFlujo${i}`), chartConfig(`Flujo ${i}`));
+    }
+    for (let i = 1; i <= numPresiones; i++) {
+        charts[`presion${i}`] = new Chart(document.getElementById(`chartPresion${i}`), chartConfig(`Presión ${i}`));
+    }
+}
+
+function cambiarVista(valor) {
+    vista = valor;
+    for (const chart of Object.values(charts)) chart.destroy();
+    initCharts();
+    actualizarGraficas();
+}
+
+async function actualizarMuestras() {
+    // Tantos puntos como píxeles tiene la gráfica
+    const ancho = document.getElementById('chartFlujo1').clientWidth || 800;
+    const response = await fetch(`/datos_grafica?algoritmo=${vista}&ancho=${ancho}`);
+    const data = await response.json();
+    paquetesMuestras = data.paquetes;
+    for (const [clave, chart] of Object.entries(charts)) {
+        const serie = data[clave];
+        chart.data.datasets[0].data = serie.x.map((x, k) => ({ x: x, y: serie.y[k] }));
+        chart.update('none');
+    }
+}
+
+async function actualizarGraficas() {
+    const response = await fetch('/obtener_ultimos_paquetes');
+    await mostrarDatos(await response.json());
+}
+
+async function mostrarDatos(data) {
+    if (vista === 'promedio') {
+        for (const [clave, chart] of Object.entries(charts)) {
+            chart.data.labels = data.labels.slice();
+            chart.data.datasets[0].data = data[clave];
+            chart.update();
+        }
+    } else {
+        await actualizarMuestras();
+    }
+    
+    for (const [tarjeta, paquetes] of Object.entries(data.paquetes)) {
+        document.getElementById(`paquetesT${tarjeta}`).textContent = paquetes;
+    }
+    document.getElementById('tiempoMuestreo').textContent = data.tiempo_muestreo;
+    mostrarAnalisis({
+        alarma_fuga: data.alarma,
+        posicion_fuga: data.posicion_fuga,
+        ultima_actualizacion: data.ultima_actualizacion
+    });
+    mostrarEstado(data.estados);
+}
+
+function mostrarAnalisis(analisis) {
+    document.getElementById('alarmaStatus').textContent = analisis.alarma_fuga;
+    document.getElementById('posicionFuga').textContent = analisis.posicion_fuga;
+    document.getElementById('ultimaActualizacion').textContent = analisis.ultima_actualizacion || 'N/A';
+}
+
+// estados = {tarjeta: recibiendo datos (bool)}
+function mostrarEstado(estados) {
+    for (const [tarjeta, activa] of Object.entries(estados)) {
+        const elemento = document.getElementById(`estadoT${tarjeta}`);
+        if (activa) {
+            elemento.innerHTML = '✅ Recibiendo datos';
+            elemento.className = 'status-ok';
+        } else {
+            elemento.innerHTML = '❌ Sin datos';
+            elemento.className = 'status-error';
+        }
+    }
+}
+
+// Un paquete nuevo llega por /eventos: se añade un punto sin volver a pedir todo
+let muestrasPendientes = null;
+
+function agregarPunto(p) {
+    document.getElementById(`paquetesT${p.tarjeta}`).textContent = p.paquetes;
+    if (vista !== 'promedio') {
+        // Como mucho una petición de muestras cada 500 ms aunque lleguen más paquetes
+        if (!muestrasPendientes) {
+            muestrasPendientes = setTimeout(() => {
+                muestrasPendientes = null;
+                actualizarMuestras();
+            }, 500);
+        }
+        return;
+    }
+    // Las gráficas de canales que esta tarjeta no tiene reciben un hueco
+    const medias = {};
+    p.flujos.media.forEach((valor, k) => { medias[`flujo${k + 1}`] = valor; });
+    p.presiones.media.forEach((valor, k) => { medias[`presion${k + 1}`] = valor; });
+    for (const [clave, chart] of Object.entries(charts)) {
+        chart.data.labels.push(p.label);
+        chart.data.datasets[0].data.push(medias[clave] ?? null);
+        if (chart.data.labels.length > 10) {
+            chart.data.labels.shift();
+            chart.data.datasets[0].data.shift();
+        }
+        chart.update('none');
+    }
+}
+
+let sondeo = null;
+
+function iniciarSondeo() {
+    if (!sondeo) sondeo = setInterval(actualizarGraficas, 10000);
+}
+
+function conectarEventos() {
+    if (!window.EventSource) {
+        iniciarSondeo();
+        return;
+    }
+    // Se continúa desde la versión de eventos con la que se generó la página
+    const fuente = new EventSource(`/eventos?version=${document.body.dataset.versionEventos}`);
+    fuente.addEventListener('paquete', e => agregarPunto(JSON.parse(e.data)));
+    fuente.addEventListener('estado', e => mostrarEstado(JSON.parse(e.data)));
+    fuente.addEventListener('analisis', e => mostrarAnalisis(JSON.parse(e.data)));
+    fuente.addEventListener('recarga', () => actualizarGraficas());
+    fuente.onopen = () => {
+        // Tras un corte cubierto por el sondeo se recarga; las reconexiones normales
+        // reanudan con Last-Event-ID y el servidor envía 'recarga' si faltan eventos
+        if (sondeo) {
+            clearInterval(sondeo);
+            sondeo = null;
+            actualizarGraficas();
+        }
+    };
+    // Sin conexión de eventos se vuelve a consultar cada 10 s
+    fuente.onerror = iniciarSondeo;
+}
+
+async function generarDatosAleatorios() {
+    await fetch('/generar_aleatorios', { method: 'POST' });
+    actualizarGraficas();
+}
+
+async function duplicarT1aT2() {
+    await fetch('/duplicar_t1_t2', { method: 'POST' });
+    actualizarGraficas();
+}
+
+async function limpiarDatos() {
+    if (confirm('¿Eliminar todos los datos?')) {
+        await fetch('/limpiar', { method: 'POST' });
+        actualizarGraficas();
+    }
+}
+
+setInterval(() => {
+    document.getElementById('horaSistema').textContent = new Date().toLocaleTimeString();
+}, 1000);
+
+initCharts();
+// Primer pintado con los datos incrustados en la página, sin otra petición
+mostrarDatos(JSON.parse(document.getElementById('datosIniciales').textContent));
+conectarEventos();
@@ -0,0 +1,86 @@
+"""
+SUBMUESTREO - SERIES LARGAS REDUCIDAS AL ANCHO DE LA GRÁFICA
+Reduce las muestras crudas de varios canales a un número de puntos acotado
+conservando la forma de la señal (picos y caídas de presión incluidos).
+
+    lttb     Largest-Triangle-Three-Buckets: un punto por cubeta, el que forma
+             el triángulo de mayor área con el punto anterior elegido y la
+             media de la cubeta siguiente
+    minmax   mínimo y máximo de cada cubeta, en su orden temporal
+
+Ambos trabajan sobre todos los canales a la vez: x (n,) compartido e
+y (n, canales); el resultado son índices (canales, puntos) sobre las muestras.
+"""
+
+import numpy as np
+
+ALGORITMOS = ('lttb', 'minmax')
+
+
+def _todos(n, canales):
+    return np.broadcast_to(np.arange(n), (canales, n)).copy()
+
+
+def lttb(x, y, puntos):
+    """Índices (canales, puntos) elegidos por LTTB para cada canal de `y`"""
+    n, canales = y.shape
+    if puntos >= n or puntos < 3:
+        return _todos(n, canales)
+
+    # Cubetas para los puntos intermedios (el primero y el último se conservan)
+    cada = (n - 2) / (puntos - 2)
+    bordes = (np.arange(puntos - 1) * cada).astype(np.int64) + 1
+    bordes[-1] = n - 1
+    tamanos = np.diff(bordes)
+    # reduceat suma la última cubeta hasta el final: sin x[n-1] (el último punto, aparte)
+    medias_x = np.add.reduceat(x[:n - 1], bordes[:-1]) / tamanos
+    medias_y = np.add.reduceat(y[:n - 1], bordes[:-1], axis=0, dtype=np.float64) / tamanos[:, None]
+    # Punto "siguiente" de cada cubeta: la media de la próxima (o el último punto)
+    siguiente_x = np.append(medias_x[1:], x[-1])
+    siguiente_y = np.vstack([medias_y[1:], y[-1:]])
+
+    canal = np.arange(canales)
+    elegidos = np.empty((canales, puntos), dtype=np.int64)
+    elegidos[:, 0] = 0
+    elegidos[:, -1] = n - 1
+    anterior = np.zeros(canales, dtype=np.int64)
+    # La elección depende de la anterior, así que se recorre por cubetas; dentro
+    # de cada una, todas las muestras y canales se evalúan de una vez
+    for i in range(puntos - 2):
+        inicio, fin = bordes[i], bordes[i + 1]
+        ax = x[anterior]
+        ay = y[anterior, canal]
+        areas = np.abs((ax - siguiente_x[i]) * (y[inicio:fin] - ay)
+                       - (ax - x[inicio:fin, None]) * (siguiente_y[i] - ay))
+        anterior = inicio + np.argmax(areas, axis=0)
+        elegidos[:, i + 1] = anterior
+    return elegidos
+
+
+def minmax(x, y, puntos):
+    """Índices (canales, puntos) con el mínimo y el máximo de puntos/2 cubetas"""
+    n, canales = y.shape
+    cubetas = puntos // 2
+    if puntos >= n or cubetas < 1:
+        return _todos(n, canales)
+
+    bordes = (np.arange(cubetas + 1) * (n / cubetas)).astype(np.int64)
+    tamanos = np.diff(bordes)
+    # Matriz (cubetas, tamaño máximo) de índices; las cubetas cortas repiten su última muestra
+    desplazamientos = np.minimum(np.arange(tamanos.max()), tamanos[:, None] - 1)
+    indices = bordes[:-1, None] + desplazamientos
+    valores = y[indices]                     # (cubetas, tamaño, canales)
+    minimos = np.take_along_axis(indices[:, :, None], valores.argmin(axis=1)[:, None, :], axis=1)[:, 0]
+    maximos = np.take_along_axis(indices[:, :, None], valores.argmax(axis=1)[:, None, :], axis=1)[:, 0]
+    # Cada par en orden temporal para no dibujar la línea hacia atrás
+    pares = np.stack([np.minimum(minimos, maximos), np.maximum(minimos, maximos)], axis=1)
+    return pares.reshape(cubetas * 2, canales).T
+
+
+def submuestrear(x, y, puntos, algoritmo='lttb'):
+    """Índices (canales, ≤puntos) según el algoritmo ('lttb' o 'minmax')"""
+    if algoritmo == 'lttb':
+        return lttb(x, y, puntos)
+    if algoritmo == 'minmax':
+        return minmax(x, y, puntos)
+    raise ValueError(f"Algoritmo de submuestreo desconocido: {algoritmo}")
@@ -0,0 +1,179 @@
+"""
+TARJETAS - REGISTRO DE TARJETAS Y SENSORES
+Qué tarjetas existen y el esquema de los paquetes de cada una. Un paquete de
+una tarjeta no registrada se rechaza en lugar de mezclarse con otra.
+
+Columnas de una muestra de la tarjeta:
+    0                              tiempo de muestreo (ms)
+    1 .. flujos                    caudalímetros
+    flujos + 1 .. flujos+presiones sensores de presión
+
+FUGAS_TARJETAS elige el registro: la ruta de un JSON como
+
+    {"tarjetas": [
+        {"id": 1, "flujos": 6, "presiones": 6, "muestras": 200,
+         "periodo_ms": 100, "factor_presion": 2.0,
+         "posiciones": [0, 100, 200, 300, 400, 500]},
+        {"id": 7, "flujos": 4, "presiones": 4}
+    ]}
+
+o un número N para N tarjetas (ids 1..N) con el esquema por defecto. Sin
+FUGAS_TARJETAS se registran las tarjetas 1 y 2 de siempre.
+
+`posiciones` (m a lo largo de la línea, una por estación) es para el análisis
+y solo tiene sentido con tantos caudalímetros como sensores de presión; si se
+omite, las estaciones se reparten cada ESPACIADO_ESTACIONES m a continuación
+de las de la tarjeta anterior.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from parser_paquetes import PaqueteInvalido
+
+NUM_FLUJOS = 6
+NUM_PRESIONES = 6
+NUM_MUESTRAS = 200
+PERIODO_MS = 100
+# Lectura del sensor -> metros de columna de agua
+FACTOR_PRESION = 2.0
+ESPACIADO_ESTACIONES = 100.0
+TARJETAS_POR_DEFECTO = (1, 2)
+
+
+class TarjetaDesconocida(PaqueteInvalido):
+    """El paquete viene de una tarjeta que no está en el registro"""
+
+
+class EsquemaTarjeta:
+    """Canales, muestras por paquete y calibración de una tarjeta"""
+
+    def __init__(self, tarjeta_id, flujos=NUM_FLUJOS, presiones=NUM_PRESIONES, muestras=NUM_MUESTRAS,
+                 periodo_ms=PERIODO_MS, factor_presion=FACTOR_PRESION, posiciones=None):
+        self.tarjeta_id = int(tarjeta_id)
+        self.flujos = int(flujos)
+        self.presiones = int(presiones)
+        self.num_muestras = int(muestras)
+        self.periodo_ms = periodo_ms
+        self.factor_presion = float(factor_presion)
+        if self.flujos < 0 or self.presiones < 0 or self.flujos + self.presiones == 0 or self.num_muestras < 1:
+            raise ValueError(f"Esquema inválido para la tarjeta {tarjeta_id}")
+        if posiciones is not None:
+            posiciones = np.asarray(posiciones, dtype=np.float64)
+            if self.flujos != self.presiones or len(posiciones) != self.flujos:
+                raise ValueError(f"La tarjeta {tarjeta_id} necesita una posición por estación "
+                                 f"(mismo número de caudalímetros y sensores de presión)")
+        self.posiciones = posiciones
+
+    @property
+    def canales(self):
+        return self.flujos + self.presiones
+
+    @property
+    def num_columnas(self):
+        return 1 + self.canales
+
+    @property
+    def col_flujos(self):
+        return slice(1, 1 + self.flujos)
+
+    @property
+    def col_presiones(self):
+        return slice(1 + self.flujos, 1 + self.canales)
+
+    @property
+    def estaciones(self):
+        """Estaciones con caudal y presión (las que usa el análisis)"""
+        return self.flujos if self.flujos == self.presiones else 0
+
+    def a_dict(self):
+        return {
+            'id': self.tarjeta_id,
+            'flujos': self.flujos,
+            'presiones': self.presiones,
+            'muestras': self.num_muestras,
+            'periodo_ms': self.periodo_ms,
+            'factor_presion': self.factor_presion
+        }
+
+
+class RegistroTarjetas:
+    """Tarjetas registradas por id, en orden de id"""
+
+    def __init__(self, esquemas):
+        self._esquemas = {}
+        for esquema in sorted(esquemas, key=lambda e: e.tarjeta_id):
+            if esquema.tarjeta_id in self._esquemas:
+                raise ValueError(f"Tarjeta {esquema.tarjeta_id} registrada dos veces")
+            self._esquemas[esquema.tarjeta_id] = esquema
+        if not self._esquemas:
+            raise ValueError('El registro no tiene tarjetas')
+        self.ids = tuple(self._esquemas)
+        # Posición de cada id en los arreglos por tarjeta (p. ej. última llegada)
+        self.indices = {tarjeta_id: i for i, tarjeta_id in enumerate(self.ids)}
+        self.max_flujos = max(e.flujos for e in self._esquemas.values())
+        self.max_presiones = max(e.presiones for e in self._esquemas.values())
+
+    @classmethod
+    def por_defecto(cls, ids=TARJETAS_POR_DEFECTO):
+        return cls([EsquemaTarjeta(tarjeta_id) for tarjeta_id in ids])
+
+    @classmethod
+    def desde_json(cls, datos):
+        esquemas = []
+        for entrada in datos['tarjetas']:
+            entrada = dict(entrada)
+            esquemas.append(EsquemaTarjeta(entrada.pop('id'), **entrada))
+        return cls(esquemas)
+
+    @classmethod
+    def desde_entorno(cls, valor=None):
+        """Registro según FUGAS_TARJETAS (ruta de un JSON o número de tarjetas)"""
+        if valor is None:
+            valor = os.environ.get('FUGAS_TARJETAS', '')
+        valor = valor.strip()
+        if not valor:
+            return cls.por_defecto()
+        if valor.isdigit():
+            return cls.por_defecto(range(1, int(valor) + 1))
+        with open(valor) as f:
+            return cls.desde_json(json.load(f))
+
+    def __len__(self):
+        return len(self._esquemas)
+
+    def __iter__(self):
+        return iter(self._esquemas.values())
+
+    def __contains__(self, tarjeta_id):
+        return tarjeta_id in self._esquemas
+
+    def __getitem__(self, tarjeta_id):
+        try:
+            return self._esquemas[tarjeta_id]
+        except KeyError:
+            raise TarjetaDesconocida(f"Tarjeta {tarjeta_id} no registrada")
+
+    def forma(self, tarjeta_id):
+        """(muestras, columnas) de un paquete de la tarjeta; para los parsers"""
+        esquema = self[tarjeta_id]
+        return esquema.num_muestras, esquema.num_columnas
+
+    def posiciones(self):
+        """{tarjeta: posiciones de sus estaciones} de las tarjetas que entran en el análisis"""
+        posiciones = {}
+        siguiente = 0.0
+        for esquema in self:
+            if not esquema.estaciones:
+                continue
+            if esquema.posiciones is not None:
+                posiciones[esquema.tarjeta_id] = esquema.posiciones
+            else:
+                posiciones[esquema.tarjeta_id] = siguiente + np.arange(esquema.estaciones) * ESPACIADO_ESTACIONES
+            siguiente = posiciones[esquema.tarjeta_id].max() + ESPACIADO_ESTACIONES
+        return posiciones
+
+    def factores_presion(self):
+        return {esquema.tarjeta_id: esquema.factor_presion for esquema in self}
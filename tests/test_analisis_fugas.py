@@ -0,0 +1,166 @@
+"""
+PRUEBAS - LOCALIZACIÓN DE FUGAS CON FUGAS SINTÉTICAS
+Línea por defecto de ConfiguracionTuberia: 12 estaciones cada 100 m
+(T1 en 0..500 m, T2 en 600..1100 m), onda a 1000 m/s y muestras cada 100 ms.
+
+Uso:
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analisis_fugas import (ConfiguracionTuberia, MotorAnalisis, balance_flujos,  # noqa: E402
+                            localizar_por_gradiente, localizar_por_tiempos, retardo_correlacion)
+from buffer_circular import SEGUNDOS_DIA  # noqa: E402
+
+POSICIONES = np.arange(0, 1200, 100.0)
+VELOCIDAD = 1000.0
+PERIODO = 0.1
+MUESTRAS = 200
+CAUDAL = 40.0
+CABEZA = 60.0           # m.c.a en el origen
+PENDIENTE = 0.01        # pérdida de carga (m/m) con el caudal nominal
+CAIDA = 3.0             # m.c.a que baja la onda al abrirse la fuga
+SUBIDA = 0.5            # s que tarda el frente en pasar
+
+
+def caudales(fuga, fraccion=0.2):
+    """Caudal en cada estación: aguas abajo de la fuga falta `fraccion` del nominal"""
+    return np.where(POSICIONES > fuga, CAUDAL * (1 - fraccion), CAUDAL)
+
+
+def piezometrica(fuga, fraccion=0.2):
+    """Carga en régimen con fuga: la pendiente va con el cuadrado del caudal"""
+    abajo = PENDIENTE * (1 - fraccion) ** 2
+    return CABEZA - PENDIENTE * np.minimum(POSICIONES, fuga) - abajo * np.maximum(POSICIONES - fuga, 0)
+
+
+def frente(tiempos, llegada):
+    """Fracción de la caída que ya pasó por una estación (rampa de SUBIDA s)"""
+    return np.clip((tiempos - llegada) / SUBIDA, 0.0, 1.0)
+
+
+def paquetes(fuga, apertura=None, factor=2.0):
+    """{tarjeta: muestras} de un paquete de 20 s de ambas tarjetas.
+
+    Sin `apertura` la línea está en régimen sin fuga; con ella la fuga se abre
+    en ese instante (s desde el inicio del paquete) y la onda llega a cada
+    estación |x - fuga| / VELOCIDAD después.
+    """
+    tiempos = np.arange(MUESTRAS) * PERIODO
+    flujos = np.tile(caudales(np.inf), (MUESTRAS, 1))
+    presiones = np.tile(piezometrica(np.inf), (MUESTRAS, 1))
+    if apertura is not None:
+        # Tras el frente queda el régimen con fuga, CAIDA más abajo
+        paso = frente(tiempos[:, None], apertura + np.abs(POSICIONES - fuga) / VELOCIDAD)
+        flujos = flujos + paso * (caudales(fuga) - flujos)
+        presiones = presiones + paso * (piezometrica(fuga) - CAIDA - presiones)
+    resultado = {}
+    for tarjeta, estaciones in ((1, slice(0, 6)), (2, slice(6, 12))):
+        muestras = np.empty((MUESTRAS, 13))
+        muestras[:, 0] = tiempos * 1000
+        muestras[:, 1:7] = flujos[:, estaciones]
+        muestras[:, 7:] = presiones[:, estaciones] / factor
+        resultado[tarjeta] = muestras
+    return resultado
+
+
+@pytest.mark.parametrize('fuga', [130.0, 450.0, 820.0])
+def test_balance_flujos_tramo(fuga):
+    tramo, perdida = balance_flujos(caudales(fuga), 0.05)
+    assert POSICIONES[tramo] < fuga < POSICIONES[tramo + 1]
+    assert perdida == pytest.approx(0.2 * CAUDAL / caudales(fuga).mean())
+
+
+def test_balance_flujos_sin_fuga():
+    tramo, perdida = balance_flujos(caudales(np.inf) + np.linspace(0, 0.1, len(POSICIONES)), 0.05)
+    assert tramo is None
+    assert perdida <= 0.05
+
+
+@pytest.mark.parametrize('fuga', [130.0, 450.0, 820.0])
+def test_localizar_por_gradiente(fuga):
+    tramo, _ = balance_flujos(caudales(fuga), 0.05)
+    posicion = localizar_por_gradiente(piezometrica(fuga), POSICIONES, tramo)
+    assert type(posicion) is float
+    assert posicion == pytest.approx(fuga, abs=1.0)
+
+
+def test_localizar_por_gradiente_sin_ajuste():
+    # Un solo punto aguas arriba: no hay recta que ajustar y queda el centro del tramo
+    posicion = localizar_por_gradiente(piezometrica(50.0), POSICIONES, 0)
+    assert type(posicion) is float
+    assert posicion == 50.0
+
+
+@pytest.mark.parametrize('fuga', [130.0, 820.0])
+def test_localizar_por_tiempos(fuga):
+    xa, xb = 100.0 * (fuga // 100), 100.0 * (fuga // 100 + 1)
+    ta, tb = abs(fuga - xa) / VELOCIDAD, abs(xb - fuga) / VELOCIDAD
+    assert localizar_por_tiempos(xa, xb, ta, tb, VELOCIDAD) == pytest.approx(fuga)
+    # Tiempos incoherentes: se queda en el extremo del tramo
+    assert localizar_por_tiempos(xa, xb, 0.0, 1.0, VELOCIDAD) == xa
+
+
+@pytest.mark.parametrize('fuga', [130.0, 820.0])
+def test_retardo_correlacion_submuestra(fuga):
+    # Retardos que no son múltiplo del periodo: 0.84 s y -0.54 s
+    tiempos = np.arange(MUESTRAS) * PERIODO
+    a = -CAIDA * frente(tiempos, 5.0 + fuga / VELOCIDAD)
+    b = -CAIDA * frente(tiempos, 5.0 + (POSICIONES[-1] - fuga) / VELOCIDAD)
+    retardo, coeficiente = retardo_correlacion(a, b, PERIODO, POSICIONES[-1] / VELOCIDAD)
+    assert retardo == pytest.approx((POSICIONES[-1] - 2 * fuga) / VELOCIDAD, abs=0.02)
+    assert coeficiente > 0.9
+    # El vértice de la parábola sobre un pico triangular deja unos metros de sesgo
+    posicion = localizar_por_tiempos(POSICIONES[0], POSICIONES[-1], 0.0, retardo, VELOCIDAD)
+    assert posicion == pytest.approx(fuga, abs=10.0)
+
+
+def test_retardo_correlacion_senal_plana():
+    assert retardo_correlacion(np.ones(50), np.ones(50), PERIODO, 1.0) == (0.0, 0.0)
+
+
+def _motor(fuga, hora=12 * 3600):
+    motor = MotorAnalisis(ConfiguracionTuberia())
+    for k in range(3):
+        for tarjeta, muestras in paquetes(fuga).items():
+            resultado = motor.analizar_paquete(tarjeta, hora + 20 * k, muestras)
+    assert resultado['alarma_fuga'] == 'NO DETECTADA'
+    return motor, hora + 60
+
+
+@pytest.mark.parametrize('fuga', [130.0, 450.0, 820.0])
+def test_motor_onda_negativa(fuga):
+    motor, hora = _motor(fuga)
+    for tarjeta, muestras in paquetes(fuga, apertura=7.33).items():
+        resultado = motor.analizar_paquete(tarjeta, hora, muestras)
+    assert resultado['alarma_fuga'] == 'FUGA DETECTADA'
+    assert resultado['metodo'] == 'onda_negativa'
+    assert resultado['posicion_fuga'] == pytest.approx(fuga, abs=5.0)
+
+
+@pytest.mark.parametrize('fuga', [130.0, 450.0, 820.0])
+def test_motor_onda_negativa_medianoche(fuga):
+    # T1 empieza a las 23:59:50 y T2 a las 00:00:00; la fuga se abre a las 00:00:07.33
+    motor, hora = _motor(fuga, hora=SEGUNDOS_DIA - 70)
+    motor.analizar_paquete(1, hora, paquetes(fuga, apertura=17.33)[1])
+    resultado = motor.analizar_paquete(2, 0, paquetes(fuga, apertura=7.33)[2])
+    assert resultado['metodo'] == 'onda_negativa'
+    assert resultado['posicion_fuga'] == pytest.approx(fuga, abs=5.0)
+
+
+@pytest.mark.parametrize('fuga', [130.0, 820.0])
+def test_motor_gradiente(fuga):
+    # La fuga se abrió antes del paquete: no hay frente ni retardo, solo el régimen nuevo
+    motor, hora = _motor(fuga)
+    for k in range(motor.config.ventana):
+        for tarjeta, muestras in paquetes(fuga, apertura=-100.0).items():
+            resultado = motor.analizar_paquete(tarjeta, hora + 20 * k, muestras)
+    assert resultado['metodo'] == 'gradiente'
+    assert resultado['posicion_fuga'] == pytest.approx(fuga, abs=5.0)
@@ -0,0 +1,151 @@
+"""
+PRUEBAS - BUFFER CIRCULAR
+Orden por hora de la placa, pisado del más antiguo al llenarse, agregados
+al insertar y detección de reintentos.
+
+Uso:
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from buffer_circular import (AGREGADOS, SEGUNDOS_DIA, BufferCircular, hora_a_segundos,  # noqa: E402
+                             tiempo_placa)
+
+# Mediodía local: lejos de medianoche salvo en las pruebas que la buscan
+LLEGADA = time.mktime((2026, 3, 10, 12, 0, 0, 0, 0, -1))
+MUESTRAS = 5
+
+
+def hora_local(timestamp):
+    local = time.localtime(timestamp)
+    return hora_a_segundos(local.tm_hour, local.tm_min, local.tm_sec)
+
+
+def paquete(valor):
+    muestras = np.full((MUESTRAS, 13), valor, dtype=np.float32)
+    muestras[:, 0] = np.arange(MUESTRAS) * 100
+    return muestras
+
+
+def agregar(buf, segundos, secuencia=0, secuencia_placa=-1):
+    """Paquete que la placa empezó `segundos` después del inicio de LLEGADA; valor = segundos"""
+    return buf.agregar(paquete(segundos), LLEGADA + segundos + 20, hora_local(LLEGADA + segundos),
+                       secuencia, secuencia_placa)
+
+
+def horas(buf):
+    return [int(buf.muestras[pos, 0, 1]) for pos in buf.posiciones()]
+
+
+def test_tiempo_placa_medianoche():
+    # Paquete de las 23:59:50 que llega a las 00:00:05: es del día anterior
+    llegada = time.mktime((2026, 3, 11, 0, 0, 5, 0, 0, -1))
+    assert tiempo_placa(llegada, hora_a_segundos(23, 59, 50)) == llegada - 15
+    # Reloj de la placa algo adelantado justo antes de medianoche: es del día siguiente
+    llegada = time.mktime((2026, 3, 10, 23, 59, 58, 0, 0, -1))
+    assert tiempo_placa(llegada, hora_a_segundos(0, 0, 3)) == llegada + 5
+    assert abs(tiempo_placa(LLEGADA, hora_local(LLEGADA)) - LLEGADA) < SEGUNDOS_DIA / 2
+
+
+def test_agregar_en_orden():
+    buf = BufferCircular(4, num_muestras=MUESTRAS)
+    for k, segundos in enumerate((0, 20, 40)):
+        agregar(buf, segundos, secuencia=k + 1)
+    assert len(buf) == 3
+    assert horas(buf) == [0, 20, 40]
+    assert buf.ultimo_timestamp() == LLEGADA + 60
+
+
+def test_atrasado_se_inserta_en_su_sitio():
+    buf = BufferCircular(5, num_muestras=MUESTRAS)
+    for k, segundos in enumerate((0, 40, 60, 20)):
+        agregar(buf, segundos, secuencia=k + 1)
+    assert horas(buf) == [0, 20, 40, 60]
+    # La secuencia global sigue siendo la de llegada: posiciones_desde la respeta
+    assert [int(buf.secuencias[pos]) for pos in buf.posiciones_desde(1)] == [2, 3, 4]
+
+
+def test_lleno_pisa_el_mas_antiguo():
+    buf = BufferCircular(3, num_muestras=MUESTRAS)
+    for k, segundos in enumerate((0, 20, 40, 60, 80)):
+        agregar(buf, segundos, secuencia=k + 1)
+    assert len(buf) == 3
+    assert horas(buf) == [40, 60, 80]
+    assert buf.secuencia_pisada == 2
+
+
+def test_lleno_atrasado():
+    buf = BufferCircular(3, num_muestras=MUESTRAS)
+    for k, segundos in enumerate((20, 40, 60)):
+        agregar(buf, segundos, secuencia=k + 1)
+    # Anterior a todo lo retenido: sería el primero en pisarse y no se guarda
+    assert agregar(buf, 0, secuencia=4) is None
+    # En medio: sale el más antiguo y el nuevo queda en su sitio
+    assert agregar(buf, 50, secuencia=5) is not None
+    assert horas(buf) == [40, 50, 60]
+    assert buf.secuencia_pisada == 1
+
+
+def test_agregados_al_insertar():
+    buf = BufferCircular(2, num_muestras=MUESTRAS)
+    muestras = paquete(0)
+    muestras[:, 1:] = np.arange(MUESTRAS)[:, None] * np.arange(1, 13)
+    pos = buf.agregar(muestras, LLEGADA, hora_local(LLEGADA))
+    canales = muestras[:, 1:].astype(np.float64)
+    esperados = (canales.mean(axis=0), canales.min(axis=0), canales.max(axis=0), canales.std(axis=0))
+    for fila, esperado in zip(buf.agregados[pos], esperados):
+        np.testing.assert_allclose(fila, esperado, rtol=1e-6)
+    assert buf.agregados.shape[1] == len(AGREGADOS)
+
+
+def test_agregados_se_desplazan_con_el_paquete():
+    buf = BufferCircular(4, num_muestras=MUESTRAS)
+    for segundos in (0, 40, 20):
+        agregar(buf, segundos)
+    assert [float(buf.agregados[pos, 0, 0]) for pos in buf.posiciones()] == [0.0, 20.0, 40.0]
+
+
+@pytest.mark.parametrize('secuencia_placa', [-1, 7])
+def test_duplicado(secuencia_placa):
+    buf = BufferCircular(4, num_muestras=MUESTRAS)
+    for segundos in (0, 20, 40):
+        agregar(buf, segundos, secuencia_placa=secuencia_placa if segundos == 20 else -1)
+    hora = hora_local(LLEGADA + 20)
+    # El reintento llega más tarde pero con la misma hora de la placa
+    assert buf.duplicado(paquete(20), LLEGADA + 90, hora, secuencia_placa)
+    assert not buf.duplicado(paquete(21), LLEGADA + 90, hora, 8 if secuencia_placa != -1 else -1)
+    assert not buf.duplicado(paquete(60), LLEGADA + 90, hora_local(LLEGADA + 60), secuencia_placa)
+
+
+def test_descartar_hasta():
+    buf = BufferCircular(4, num_muestras=MUESTRAS)
+    for k, segundos in enumerate((0, 20, 40)):
+        agregar(buf, segundos, secuencia=k + 1)
+    assert buf.descartar_hasta(2) == 2
+    assert horas(buf) == [40]
+    buf.vaciar()
+    assert len(buf) == 0 and buf.ultimo_timestamp() is None
+
+
+def test_cargar_en_bloque():
+    # Mismo resultado que insertar uno a uno, quedándose con los últimos por hora de la placa
+    segundos = [0, 40, 20, 60, 80]
+    uno_a_uno = BufferCircular(4, num_muestras=MUESTRAS)
+    for k, s in enumerate(segundos):
+        agregar(uno_a_uno, s, secuencia=k + 1, secuencia_placa=k)
+    en_bloque = BufferCircular(4, num_muestras=MUESTRAS)
+    assert en_bloque.cargar(np.stack([paquete(s) for s in segundos]),
+                            [LLEGADA + s + 20 for s in segundos], [hora_local(LLEGADA + s) for s in segundos],
+                            np.arange(1, 6), np.arange(5)) == 4
+    assert horas(en_bloque) == horas(uno_a_uno) == [20, 40, 60, 80]
+    for campo in ('secuencias', 'timestamps', 'horas', 'tiempos_placa', 'secuencias_placa', 'agregados'):
+        np.testing.assert_array_equal(getattr(en_bloque, campo)[en_bloque.posiciones()],
+                                      getattr(uno_a_uno, campo)[uno_a_uno.posiciones()])
@@ -0,0 +1,84 @@
+"""
+PRUEBAS - MÉTRICAS
+Formato de exposición y suma de los volcados de varios workers.
+
+Uso:
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metricas  # noqa: E402
+from metricas import Contador, Histograma, Medidor, compartir, exponer, volcar  # noqa: E402
+
+CONTADOR = Contador('prueba_paquetes_total', 'Paquetes de prueba', ('tarjeta',))
+HISTOGRAMA = Histograma('prueba_tamano_bytes', 'Tamaños de prueba', cubetas=(10, 100))
+MEDIDOR = Medidor('prueba_jitter_segundos', 'Jitter de prueba', ('tarjeta',))
+CALCULADO = Medidor('prueba_ocupacion', 'Ocupación de prueba', funcion=lambda: {(): 7})
+
+
+def lineas(prefijo):
+    return [linea for linea in exponer().splitlines() if linea.startswith(prefijo)]
+
+
+@pytest.fixture(autouse=True)
+def vacias():
+    for metrica in (CONTADOR, HISTOGRAMA, MEDIDOR):
+        metrica._series.clear()
+
+
+@pytest.fixture
+def directorio(tmp_path):
+    compartir(str(tmp_path))
+    yield tmp_path
+    compartir(None)
+
+
+def otro_worker(directorio):
+    """Lo volcado hasta ahora pasa a ser de otro proceso; este empieza de cero"""
+    volcar()
+    propio = os.path.join(directorio, metricas._volcado['archivo'])
+    os.rename(propio, os.path.join(directorio, 'otro.json'))
+    for metrica in (CONTADOR, HISTOGRAMA, MEDIDOR):
+        metrica._series.clear()
+    metricas._volcado['escrito'] = None
+
+
+def test_formato_local():
+    CONTADOR.incrementar(2, tarjeta=1)
+    assert lineas('prueba_paquetes_total') == ['prueba_paquetes_total{tarjeta="1"} 2']
+    assert lineas('prueba_ocupacion') == ['prueba_ocupacion 7']
+    with pytest.raises(ValueError):
+        CONTADOR.incrementar(tarjeta=1, formato='texto')
+
+
+def test_suma_de_workers(directorio):
+    CONTADOR.incrementar(2, tarjeta=1)
+    HISTOGRAMA.observar(5)
+    MEDIDOR.fijar(0.5, tarjeta=1)
+    otro_worker(directorio)
+    CONTADOR.incrementar(3, tarjeta=1)
+    CONTADOR.incrementar(tarjeta=2)
+    HISTOGRAMA.observar(50)
+    MEDIDOR.fijar(0.25, tarjeta=1)
+    assert lineas('prueba_paquetes_total') == ['prueba_paquetes_total{tarjeta="1"} 5',
+                                               'prueba_paquetes_total{tarjeta="2"} 1']
+    assert lineas('prueba_tamano_bytes') == ['prueba_tamano_bytes_bucket{le="10"} 1',
+                                             'prueba_tamano_bytes_bucket{le="100"} 2',
+                                             'prueba_tamano_bytes_bucket{le="+Inf"} 2',
+                                             'prueba_tamano_bytes_sum 55',
+                                             'prueba_tamano_bytes_count 2']
+    # Medidores fijados: el máximo; calculados: solo el de este proceso
+    assert lineas('prueba_jitter_segundos') == ['prueba_jitter_segundos{tarjeta="1"} 0.5']
+    assert lineas('prueba_ocupacion') == ['prueba_ocupacion 7']
+
+
+def test_volcado_ilegible_se_ignora(directorio):
+    CONTADOR.incrementar(4, tarjeta=1)
+    (directorio / 'roto.json').write_text('{"prueba_paquetes_total": [[')
+    assert lineas('prueba_paquetes_total') == ['prueba_paquetes_total{tarjeta="1"} 4']
@@ -0,0 +1,200 @@
+"""
+PRUEBAS - PARSER DE PAQUETES
+Protocolo de texto (np.loadtxt en bloque) y tramas binarias con CRC y secuencia.
+
+Uso:
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser_paquetes import (BANDERA_CRC, CABECERA_TRAMA, PaqueteInvalido, construir_trama,  # noqa: E402
+                             dividir_lote_binario, dividir_lote_texto,
+                             parsear_paquete, parsear_trama, validar_paquete)
+
+MUESTRAS = 200
+
+
+def mediciones(semilla=0, muestras=MUESTRAS, canales=12):
+    rng = np.random.default_rng(semilla)
+    valores = np.empty((muestras, 1 + canales), dtype=np.float32)
+    valores[:, 0] = np.arange(muestras) * 100
+    valores[:, 1:] = rng.uniform(0, 50, (muestras, canales)).round(3)
+    return valores
+
+
+def texto(valores, tarjeta=1, hora='12,30,15'):
+    filas = [','.join([str(int(f[0]))] + [f"{v:.3f}" for v in f[1:]]) for f in valores]
+    return '\n'.join(['PAQUETE', hora, f'TARJETA{tarjeta}'] + filas + ['FIN_PAQUETE'])
+
+
+def trama(valores, tarjeta=1, hora=(12, 30, 15), **opciones):
+    return construir_trama(tarjeta, hora, valores[:, 0], valores[:, 1:], **opciones)
+
+
+# ----------------------------------------------------------------------
+# Texto
+# ----------------------------------------------------------------------
+
+def test_texto_ida_y_vuelta():
+    valores = mediciones()
+    tarjeta, hora, muestras, secuencia = parsear_paquete(texto(valores, tarjeta=2))
+    assert (tarjeta, hora, secuencia) == (2, (12, 30, 15), None)
+    assert muestras.dtype == np.float32 and muestras.shape == (MUESTRAS, 13)
+    np.testing.assert_array_equal(muestras, valores)
+
+
+def test_texto_secuencia_y_crlf():
+    cuerpo = texto(mediciones(), hora='23,59,59,4294967295').replace('\n', '\r\n')
+    _, hora, _, secuencia = parsear_paquete(cuerpo)
+    assert hora == (23, 59, 59)
+    assert secuencia == 2 ** 32 - 1
+
+
+@pytest.mark.parametrize('cambio, mensaje', [
+    (lambda t: t.replace('PAQUETE\n', 'PAQ\n', 1), 'Formato'),
+    (lambda t: t.replace('FIN_PAQUETE', 'FIN'), 'Formato'),
+    (lambda t: t.replace('12,30,15', '24,00,00'), 'Hora fuera de rango'),
+    (lambda t: t.replace('12,30,15', '12,30'), 'Hora inválida'),
+    (lambda t: t.replace('12,30,15', '12,30,15,-1'), 'Secuencia'),
+    (lambda t: t.replace('TARJETA1', 'PLACA1'), 'tarjeta'),
+    (lambda t: t.replace('\nFIN_PAQUETE', '\n0,1,2,3,4,5,6,7,8,9,10,11,12\nFIN_PAQUETE'), 'filas'),
+    (lambda t: t.replace('\nFIN_PAQUETE', ',1\nFIN_PAQUETE'), 'Fila'),
+    (lambda t: t.replace('\nFIN_PAQUETE', 'x\nFIN_PAQUETE'), 'Fila'),
+])
+def test_texto_invalido(cambio, mensaje):
+    with pytest.raises(PaqueteInvalido, match=mensaje):
+        parsear_paquete(cambio(texto(mediciones())))
+
+
+def test_texto_no_finito():
+    valores = mediciones()
+    valores[3, 4] = np.nan
+    with pytest.raises(PaqueteInvalido, match='no numéricos'):
+        parsear_paquete(texto(valores))
+
+
+def test_validar_sin_convertir():
+    # El encuadre no mira los números: una fila mal escrita solo la detecta el parseo
+    cuerpo = texto(mediciones()).replace('\nFIN_PAQUETE', 'x\nFIN_PAQUETE')
+    assert validar_paquete(cuerpo) == (1, (12, 30, 15))
+
+
+def test_texto_formas_por_tarjeta():
+    formas = {1: (MUESTRAS, 13), 3: (50, 9)}.__getitem__
+    valores = mediciones(muestras=50, canales=8)
+    tarjeta, _, muestras, _ = parsear_paquete(texto(valores, tarjeta=3), formas=formas)
+    assert tarjeta == 3 and muestras.shape == (50, 9)
+    with pytest.raises(PaqueteInvalido, match='filas'):
+        parsear_paquete(texto(valores, tarjeta=1), formas=formas)
+
+
+# ----------------------------------------------------------------------
+# Binario
+# ----------------------------------------------------------------------
+
+@pytest.mark.parametrize('crc', [True, False])
+@pytest.mark.parametrize('secuencia', [None, 0, 123456])
+def test_trama_ida_y_vuelta(crc, secuencia):
+    valores = mediciones()
+    datos = trama(valores, tarjeta=2, crc=crc, secuencia=secuencia)
+    tarjeta, hora, tiempos, canales, leida = parsear_trama(datos)
+    assert (tarjeta, hora, leida) == (2, (12, 30, 15), secuencia)
+    np.testing.assert_array_equal(tiempos, valores[:, 0])
+    np.testing.assert_array_equal(canales, valores[:, 1:])
+    # Vistas sobre el cuerpo recibido, sin copiar
+    assert not canales.flags.owndata
+
+
+def test_trama_crc_incorrecto():
+    datos = bytearray(trama(mediciones(), secuencia=5))
+    datos[CABECERA_TRAMA.size + 10] ^= 0x01
+    with pytest.raises(PaqueteInvalido, match='CRC'):
+        parsear_trama(bytes(datos))
+
+
+def test_trama_secuencia_cubierta_por_crc():
+    datos = bytearray(trama(mediciones(), secuencia=5))
+    datos[CABECERA_TRAMA.size] = 6
+    with pytest.raises(PaqueteInvalido, match='CRC'):
+        parsear_trama(bytes(datos))
+
+
+@pytest.mark.parametrize('cambio, mensaje', [
+    (lambda d: d[:CABECERA_TRAMA.size - 1], 'corta'),
+    (lambda d: b'FUGO' + d[4:], 'Cabecera'),
+    (lambda d: d[:4] + b'\x02' + d[5:], 'Cabecera'),
+    (lambda d: d[:-1], 'Longitud'),
+    (lambda d: d + b'\x00', 'Longitud'),
+])
+def test_trama_invalida(cambio, mensaje):
+    with pytest.raises(PaqueteInvalido, match=mensaje):
+        parsear_trama(cambio(trama(mediciones())))
+
+
+def test_trama_hora_fuera_de_rango():
+    with pytest.raises(PaqueteInvalido, match='Hora'):
+        parsear_trama(trama(mediciones(), hora=(24, 0, 0)))
+
+
+def test_trama_no_finita():
+    valores = mediciones()
+    valores[0, 1] = np.inf
+    with pytest.raises(PaqueteInvalido, match='no numéricos'):
+        parsear_trama(trama(valores))
+
+
+def test_trama_sin_crc_no_lo_comprueba():
+    datos = bytearray(trama(mediciones(), crc=False))
+    assert not datos[5] & BANDERA_CRC
+    datos[-1] ^= 0x01
+    parsear_trama(bytes(datos))
+
+
+# ----------------------------------------------------------------------
+# Lotes
+# ----------------------------------------------------------------------
+
+def test_lote_binario_sigue_tras_cabecera_invalida():
+    tramas = [trama(mediciones(k), secuencia=k) for k in range(3)]
+    basura = b'\x00' * 5 + b'FUG'
+    bloques = list(dividir_lote_binario(tramas[0] + basura + tramas[1] + tramas[2][:-3]))
+    assert bytes(bloques[0]) == tramas[0]
+    assert isinstance(bloques[1], PaqueteInvalido) and bloques[1].sin_procesar == len(basura)
+    assert bytes(bloques[2]) == tramas[1]
+    # La última trama queda corta: se entrega y la rechaza parsear_trama
+    with pytest.raises(PaqueteInvalido, match='Longitud'):
+        parsear_trama(bloques[3])
+    assert len(bloques) == 4
+
+
+def test_lote_binario_resto_corto():
+    bloques = list(dividir_lote_binario(trama(mediciones()) + b'FUGA'))
+    assert isinstance(bloques[-1], PaqueteInvalido) and bloques[-1].sin_procesar == 4
+
+
+def test_lote_texto():
+    cuerpos = [texto(mediciones(k)) for k in range(3)]
+    bloques = list(dividir_lote_texto('\n'.join(cuerpos) + '\n'))
+    assert [parsear_paquete(b)[2][0, 1] for b in bloques] == [parsear_paquete(c)[2][0, 1] for c in cuerpos]
+
+
+def test_lote_binario_tarjeta_desconocida():
+    # La tarjeta 9 no está registrada y tiene otro número de canales: su trama se salta entera
+    formas = {1: (MUESTRAS, 13)}
+    def forma(tarjeta):
+        if tarjeta not in formas:
+            raise PaqueteInvalido(f"Tarjeta {tarjeta} desconocida")
+        return formas[tarjeta]
+    desconocida = construir_trama(9, (1, 2, 3), np.arange(50), np.ones((50, 4)), secuencia=1)
+    tramas = [trama(mediciones(k)) for k in range(2)]
+    bloques = list(dividir_lote_binario(tramas[0] + desconocida + tramas[1] + desconocida, formas=forma))
+    assert [bytes(b) for b in bloques] == [tramas[0], desconocida, tramas[1], desconocida]
+    with pytest.raises(PaqueteInvalido, match='desconocida'):
+        parsear_trama(bloques[1], formas=forma)
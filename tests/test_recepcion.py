@@ -0,0 +1,144 @@
+"""
+PRUEBAS - RECEPCIÓN
+Duplicados por clave (hora de la placa, huella), huecos y desorden por
+secuencia de la placa o por hora.
+
+Uso:
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from buffer_circular import SIN_SECUENCIA  # noqa: E402
+from recepcion import (DESORDENADO, DUPLICADO, EN_ORDEN, HUECO, VENTANA_CLAVES,  # noqa: E402
+                       ControlRecepcion, huella)
+
+INICIO = 1_770_000_000
+DURACION = 20
+
+
+def recibir(control, k, secuencia=SIN_SECUENCIA, tarjeta=1):
+    """Paquete k-ésimo de la tarjeta (hora INICIO + k * DURACION): descarta duplicados como el servidor"""
+    tiempo = INICIO + k * DURACION
+    clave = huella(np.full((4, 3), k, dtype=np.float32), secuencia)
+    if control.visto(tarjeta, tiempo, clave):
+        control.duplicado(tarjeta)
+        return DUPLICADO, 0
+    return control.registrar(tarjeta, tiempo, secuencia, DURACION, clave)
+
+
+def arreglos_compartidos():
+    """Mismos arreglos para varias instancias, como dos workers sobre EstadoCompartido"""
+    creados = {}
+    def arreglos(nombre, forma, dtype):
+        if nombre not in creados:
+            creados[nombre] = np.zeros(forma, dtype=dtype)
+        return creados[nombre]
+    return arreglos
+
+
+def test_huella():
+    muestras = np.arange(12, dtype=np.float32).reshape(4, 3)
+    assert huella(muestras, 7) == 7
+    assert huella(muestras) < 0
+    assert huella(muestras) == huella(muestras.copy())
+    assert huella(muestras) != huella(muestras + 1)
+
+
+@pytest.mark.parametrize('con_secuencia', [True, False])
+def test_en_orden(con_secuencia):
+    control = ControlRecepcion([1])
+    for k in range(5):
+        assert recibir(control, k, k if con_secuencia else SIN_SECUENCIA) == (EN_ORDEN, 0)
+    assert control.estado(1)['perdidos'] == 0
+    assert control.estado(1)['ultimo_paquete'] == INICIO + 4 * DURACION
+
+
+@pytest.mark.parametrize('con_secuencia', [True, False])
+def test_reintento_es_duplicado(con_secuencia):
+    # Aunque el buffer ya lo haya soltado (confirmado), la clave sigue en la ventana
+    control = ControlRecepcion([1])
+    secuencia = (lambda k: k) if con_secuencia else (lambda k: SIN_SECUENCIA)
+    for k in range(5):
+        recibir(control, k, secuencia(k))
+    assert recibir(control, 2, secuencia(2)) == (DUPLICADO, 0)
+    assert recibir(control, 4, secuencia(4)) == (DUPLICADO, 0)
+    estado = control.estado(1)
+    assert (estado['duplicados'], estado['desordenados']) == (2, 0)
+
+
+def test_misma_secuencia_que_el_ultimo():
+    # Mismo número de la placa sin que la clave coincida (hora reescrita): duplicado, no desorden
+    control = ControlRecepcion([1])
+    recibir(control, 0, 7)
+    assert control.registrar(1, INICIO - 5, 7, DURACION, 7) == (DUPLICADO, 0)
+    assert control.estado(1)['desordenados'] == 0
+
+
+def test_reintento_tras_dar_la_vuelta_la_ventana():
+    control = ControlRecepcion([1])
+    for k in range(VENTANA_CLAVES + 1):
+        recibir(control, k, k)
+    # La clave 0 ya salió de la ventana; la 1 sigue dentro
+    assert not control.visto(1, INICIO, 0)
+    assert control.visto(1, INICIO + DURACION, 1)
+    assert recibir(control, 1, 1) == (DUPLICADO, 0)
+    # Fuera de la ventana se clasifica por la secuencia: llega atrasado
+    assert recibir(control, 0, 0) == (DESORDENADO, 0)
+
+
+def test_claves_de_otro_worker():
+    arreglos = arreglos_compartidos()
+    uno, otro = ControlRecepcion([1, 2], arreglos), ControlRecepcion([1, 2], arreglos)
+    for k in range(3):
+        recibir(uno, k, k, tarjeta=2)
+    assert recibir(otro, 1, 1, tarjeta=2) == (DUPLICADO, 0)
+    # Más claves nuevas de las que caben en la ventana: el otro rehace su índice
+    for k in range(3, VENTANA_CLAVES + 10):
+        recibir(uno, k, k, tarjeta=2)
+    assert not otro.visto(2, INICIO + 5 * DURACION, 5)
+    assert otro.visto(2, INICIO + 20 * DURACION, 20)
+
+
+def test_hueco_por_secuencia():
+    control = ControlRecepcion([1])
+    recibir(control, 0, 10)
+    assert recibir(control, 3, 13) == (HUECO, 2)
+    assert control.estado(1)['perdidos'] == 2
+    # El que faltaba llega tarde: desordenado y ya no cuenta como perdido
+    assert recibir(control, 1, 11) == (DESORDENADO, 0)
+    estado = control.estado(1)
+    assert (estado['perdidos'], estado['huecos'], estado['desordenados']) == (1, 1, 1)
+    assert estado['ultimo_hueco'] == [INICIO, INICIO + 3 * DURACION]
+
+
+def test_reinicio_de_la_placa():
+    # La secuencia vuelve a empezar pero la hora avanza: no es desorden
+    control = ControlRecepcion([1])
+    for k in range(3):
+        recibir(control, k, 100 + k)
+    assert recibir(control, 3, 0) == (EN_ORDEN, 0)
+    assert recibir(control, 4, 1) == (EN_ORDEN, 0)
+    assert control.estado(1)['perdidos'] == 0
+
+
+def test_hueco_por_hora():
+    control = ControlRecepcion([1])
+    recibir(control, 0)
+    assert recibir(control, 4) == (HUECO, 3)
+    assert control.estado(1)['perdidos'] == 3
+    assert recibir(control, 2) == (DESORDENADO, 0)
+    assert control.estado(1)['perdidos'] == 2
+
+
+def test_tarjetas_independientes():
+    control = ControlRecepcion([1, 2])
+    recibir(control, 0, 5, tarjeta=1)
+    assert recibir(control, 0, 5, tarjeta=2) == (EN_ORDEN, 0)
+    assert control.estado(2)['duplicados'] == 0
@@ -0,0 +1,122 @@
+"""
+PRUEBAS - REGISTRO SEGMENTADO
+Recuperación tras una caída (cola truncada, CRC inválido) y compactación.
+
+Uso:
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from registro_segmentado import CABECERA, RegistroSegmentado  # noqa: E402
+
+REGISTROS = [f"paquete {i}".encode() * (i + 1) for i in range(10)]
+
+
+def _escribir(directorio, registros=REGISTROS, **opciones):
+    registro = RegistroSegmentado(str(directorio), **opciones)
+    for datos in registros:
+        registro.agregar(datos)
+    registro.cerrar()
+    return registro
+
+
+def _segmentos(directorio):
+    return sorted(os.path.join(directorio, n) for n in os.listdir(directorio) if n.startswith('segmento_'))
+
+
+def test_releer_tras_reabrir(tmp_path):
+    _escribir(tmp_path)
+    assert list(RegistroSegmentado(str(tmp_path)).leer()) == REGISTROS
+
+
+@pytest.mark.parametrize('politica', ['siempre', 'lote', 'nunca'])
+def test_politicas_fsync(tmp_path, politica):
+    _escribir(tmp_path, politica_fsync=politica)
+    assert list(RegistroSegmentado(str(tmp_path)).leer()) == REGISTROS
+
+
+def test_politica_desconocida(tmp_path):
+    with pytest.raises(ValueError):
+        RegistroSegmentado(str(tmp_path), politica_fsync='a veces')
+
+
+@pytest.mark.parametrize('cortar', [1, CABECERA.size - 1, CABECERA.size + 3])
+def test_cola_truncada(tmp_path, cortar):
+    # Caída a mitad del último registro: se cargan todos los anteriores
+    _escribir(tmp_path)
+    ruta = _segmentos(tmp_path)[-1]
+    with open(ruta, 'r+b') as f:
+        f.truncate(os.path.getsize(ruta) - len(REGISTROS[-1]) - CABECERA.size + cortar)
+    assert list(RegistroSegmentado(str(tmp_path)).leer()) == REGISTROS[:-1]
+
+
+def test_crc_invalido(tmp_path):
+    # Un byte cambiado en el cuarto registro marca el final útil del segmento
+    _escribir(tmp_path)
+    ruta = _segmentos(tmp_path)[-1]
+    desplazamiento = sum(CABECERA.size + len(d) for d in REGISTROS[:3]) + CABECERA.size
+    with open(ruta, 'r+b') as f:
+        f.seek(desplazamiento)
+        byte = f.read(1)
+        f.seek(desplazamiento)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    assert list(RegistroSegmentado(str(tmp_path)).leer()) == REGISTROS[:3]
+
+
+def test_nunca_anexa_tras_cola_rota(tmp_path):
+    # Lo escrito después de reabrir va a un segmento nuevo y no queda tapado por la cola rota
+    _escribir(tmp_path)
+    ruta = _segmentos(tmp_path)[-1]
+    with open(ruta, 'r+b') as f:
+        f.truncate(os.path.getsize(ruta) - 2)
+    _escribir(tmp_path, [b'nuevo'])
+    assert list(RegistroSegmentado(str(tmp_path)).leer()) == REGISTROS[:-1] + [b'nuevo']
+    assert len(_segmentos(tmp_path)) == 2
+
+
+def test_rotacion_de_segmentos(tmp_path):
+    _escribir(tmp_path, tam_segmento=64)
+    assert len(_segmentos(tmp_path)) > 1
+    assert list(RegistroSegmentado(str(tmp_path), tam_segmento=64).leer()) == REGISTROS
+
+
+def test_compactar(tmp_path):
+    registro = _escribir(tmp_path, tam_segmento=64)
+    registro.compactar([b'estado'])
+    registro.agregar(b'despues')
+    registro.cerrar()
+    # Solo queda la base nueva y el segmento posterior a ella
+    bases = [n for n in os.listdir(tmp_path) if n.startswith('base_')]
+    assert len(bases) == 1
+    assert all(s > os.path.join(tmp_path, 'segmento_' + bases[0][5:]) for s in _segmentos(tmp_path))
+    assert len(_segmentos(tmp_path)) == 1
+    assert list(RegistroSegmentado(str(tmp_path)).leer()) == [b'estado', b'despues']
+    assert registro.bytes_base == CABECERA.size + len(b'estado')
+
+
+def test_compactacion_interrumpida(tmp_path):
+    # Una base .tmp que no llegó a renombrarse se ignora y se borra en la siguiente compactación
+    registro = _escribir(tmp_path)
+    with open(os.path.join(tmp_path, 'base_000099.log.tmp'), 'wb') as f:
+        f.write(b'a medias')
+    assert list(RegistroSegmentado(str(tmp_path)).leer()) == REGISTROS
+    registro.compactar(REGISTROS[:2])
+    assert not any(n.endswith('.tmp') for n in os.listdir(tmp_path))
+    assert list(RegistroSegmentado(str(tmp_path)).leer()) == REGISTROS[:2]
+
+
+def test_necesita_compactar(tmp_path):
+    registro = RegistroSegmentado(str(tmp_path), tam_segmento=64, factor_compactacion=2)
+    assert not registro.necesita_compactar()
+    for datos in REGISTROS:
+        registro.agregar(datos)
+    assert registro.necesita_compactar()
+    registro.compactar(REGISTROS[:1])
+    assert not registro.necesita_compactar()
+    registro.cerrar()
@@ -0,0 +1,146 @@
+"""
+PRUEBAS - ENDPOINTS DEL SERVIDOR
+Se importa servidor_flask en un directorio temporal con ingesta síncrona
+(cada petición ya ha guardado sus paquetes al responder).
+
+Uso:
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser_paquetes import construir_trama  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def servidor(tmp_path_factory):
+    anterior = os.getcwd()
+    directorio = tmp_path_factory.mktemp('servidor')
+    os.chdir(directorio)
+    os.environ['FUGAS_INGESTA_ASINCRONA'] = '0'
+    os.environ['FUGAS_DIR_HISTORICO'] = str(directorio / 'historico_sensores')
+    import servidor_flask
+    yield servidor_flask
+    os.chdir(anterior)
+
+
+@pytest.fixture
+def cliente(servidor):
+    # /limpiar vacía los buffers pero no olvida los paquetes ya vistos: cada prueba usa sus propias horas
+    cliente = servidor.app.test_client()
+    cliente.post('/limpiar')
+    return cliente
+
+
+def trama(tarjeta=1, segundos_atras=60, secuencia=None, canales=12, muestras=200):
+    """Trama binaria de la tarjeta empezada hace `segundos_atras` s"""
+    local = time.localtime(time.time() - segundos_atras)
+    valores = np.full((muestras, canales), segundos_atras, dtype=np.float32)
+    return construir_trama(tarjeta, (local.tm_hour, local.tm_min, local.tm_sec),
+                           np.arange(muestras) * 100, valores, secuencia=secuencia)
+
+
+def recibir_lote(cliente, cuerpo):
+    respuesta = cliente.post('/recibir_lote', data=cuerpo, content_type='application/octet-stream')
+    return respuesta.status_code, respuesta.get_json()
+
+
+def test_lote_binario(servidor, cliente):
+    codigo, datos = recibir_lote(cliente, trama(1, 80) + trama(2, 60) + trama(1, 40))
+    assert codigo == 200
+    assert (datos['status'], datos['aceptados'], datos['rechazados'], datos['sin_procesar']) == ('success', 3, 0, 0)
+    assert len(servidor.buffers[1]) == 2 and len(servidor.buffers[2]) == 1
+
+
+def test_lote_trama_corrupta_en_medio(servidor, cliente):
+    # La cabecera de la segunda trama está rota: se descarta solo ella y se sigue con las demás
+    corrupta = b'XXXX' + trama(1, 160)[4:]
+    codigo, datos = recibir_lote(cliente, trama(1, 180) + corrupta + trama(2, 140) + trama(1, 120))
+    assert codigo == 207
+    assert datos['status'] == 'parcial'
+    assert (datos['aceptados'], datos['rechazados']) == (3, 1)
+    assert datos['sin_procesar'] == len(corrupta)
+    assert [p['status'] for p in datos['paquetes']] == ['success', 'error', 'success', 'success']
+    assert len(servidor.buffers[1]) == 2 and len(servidor.buffers[2]) == 1
+
+
+def test_lote_cola_truncada(cliente):
+    codigo, datos = recibir_lote(cliente, trama(1, 260) + trama(1, 240)[:7])
+    assert codigo == 207
+    assert datos['aceptados'] == 1
+    assert datos['sin_procesar'] == 7
+
+
+def test_lote_sin_validos(cliente):
+    codigo, datos = recibir_lote(cliente, b'basura' * 10)
+    assert codigo == 400
+    assert datos['status'] == 'error'
+    assert datos['sin_procesar'] == 60
+
+
+def test_lote_tarjeta_desconocida_en_medio(servidor, cliente):
+    # Una trama de una tarjeta sin registrar no se lleva las siguientes de tarjetas conocidas
+    codigo, datos = recibir_lote(cliente, trama(1, 380) + trama(9, 360, canales=4, muestras=50)
+                                 + trama(2, 340) + trama(1, 320))
+    assert codigo == 207
+    assert (datos['aceptados'], datos['rechazados'], datos['sin_procesar']) == (3, 1, 0)
+    assert datos['paquetes'][1]['error'] == 'Tarjeta 9 no registrada'
+    assert len(servidor.buffers[1]) == 2 and len(servidor.buffers[2]) == 1
+
+
+def test_maximo_clientes_en_espera(servidor, cliente, monkeypatch):
+    # Un solo hueco: el flujo SSE abierto lo ocupa hasta que se cierra
+    monkeypatch.setattr(servidor, '_clientes_push', threading.BoundedSemaphore(1))
+    flujo = cliente.get('/eventos', buffered=False)
+    assert flujo.status_code == 200
+    respuesta = cliente.get('/esperar_cambios?version=0&timeout=0')
+    assert respuesta.status_code == 503 and respuesta.headers['Retry-After']
+    assert cliente.get('/eventos').status_code == 503
+    flujo.close()
+    assert cliente.get('/esperar_cambios?version=0&timeout=0').status_code == 200
+    assert cliente.get('/esperar_cambios?version=0&timeout=0').status_code == 200
+
+
+def test_flujo_eventos_acotado(servidor, cliente, monkeypatch):
+    monkeypatch.setattr(servidor, 'DURACION_MAX_EVENTOS', 0.2)
+    monkeypatch.setattr(servidor, 'TIMEOUT_EVENTOS', 0.05)
+    respuesta = cliente.get('/eventos?version=%d' % servidor.notificador.version)
+    # Termina solo; el navegador reconecta con Last-Event-ID
+    assert respuesta.get_data(as_text=True).startswith('retry: 2000')
+
+
+def test_restaurar_instantanea(servidor, cliente):
+    recibir_lote(cliente, trama(1, 480) + trama(2, 470) + trama(1, 460) + trama(2, 450))
+    captura = cliente.get('/instantanea').data
+    antes = {t: servidor.buffers[t].secuencias[servidor.buffers[t].posiciones()].copy() for t in (1, 2)}
+    bases = sorted(os.listdir(servidor.DIRECTORIO_DATOS))
+
+    respuesta = cliente.post('/instantanea', data=captura, content_type='application/octet-stream')
+    assert respuesta.get_json()['cargados'] == {'1': 2, '2': 2}
+    # Secuencias nuevas, posteriores a todo, en el orden original entre tarjetas
+    despues = {t: servidor.buffers[t].secuencias[servidor.buffers[t].posiciones()] for t in (1, 2)}
+    assert despues[1].min() > max(antes[1].max(), antes[2].max())
+    assert np.array_equal(np.argsort(np.concatenate([antes[1], antes[2]])),
+                          np.argsort(np.concatenate([despues[1], despues[2]])))
+    # Un solo registro anexado, sin compactar
+    assert [n for n in sorted(os.listdir(servidor.DIRECTORIO_DATOS)) if n.startswith('base_')] == \
+           [n for n in bases if n.startswith('base_')]
+    cabecera, _ = servidor._decodificar_registro(list(servidor.registro.leer())[-1])
+    assert cabecera['tipo'] == 'restauracion'
+
+    # Al releer el registro se obtiene lo mismo
+    copia = {t: servidor.buffers[t].muestras[servidor.buffers[t].posiciones()].copy() for t in (1, 2)}
+    with servidor.compartido.escritura():
+        servidor._cargar_registro()
+    for t in (1, 2):
+        buf = servidor.buffers[t]
+        assert np.array_equal(buf.secuencias[buf.posiciones()], despues[t])
+        assert np.array_equal(buf.muestras[buf.posiciones()], copia[t])
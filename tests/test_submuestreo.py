@@ -0,0 +1,79 @@
+"""
+PRUEBAS - SUBMUESTREO
+LTTB y min/max sobre varios canales a la vez.
+
+Uso:
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from submuestreo import lttb, minmax, submuestrear  # noqa: E402
+
+
+def serie(n=2000, canales=3, semilla=0):
+    rng = np.random.default_rng(semilla)
+    x = np.arange(n, dtype=np.float64)
+    y = rng.normal(0, 1, (n, canales)).cumsum(axis=0)
+    return x, y
+
+
+@pytest.mark.parametrize('puntos', [3, 10, 97, 500])
+def test_lttb_extremos_y_orden(puntos):
+    x, y = serie()
+    indices = lttb(x, y, puntos)
+    assert indices.shape == (3, puntos)
+    assert (indices[:, 0] == 0).all() and (indices[:, -1] == len(x) - 1).all()
+    assert (np.diff(indices, axis=1) > 0).all()
+
+
+def test_lttb_serie_constante():
+    # Con y constante todos los triángulos son nulos: la serie reducida sigue siendo la constante
+    x = np.arange(2000, dtype=np.float64)
+    y = np.full((2000, 2), 10.0)
+    indices = lttb(x, y, 100)
+    assert (y[indices, 0] == 10.0).all()
+    assert (indices[:, 0] == 0).all() and (indices[:, -1] == 1999).all()
+
+
+def test_lttb_ultima_cubeta_sin_el_ultimo_punto():
+    # n=10, 4 puntos: cubetas [1, 5) y [5, 9). La primera se elige hacia la media de la
+    # segunda, (6.5, 0); si esa media arrastrara el punto final (9, 1000) saldría x=3
+    x = np.arange(10, dtype=np.float64)
+    y = np.zeros((10, 1))
+    y[4], y[9] = 50.0, 1000.0
+    assert lttb(x, y, 4)[0].tolist() == [0, 4, 8, 9]
+
+
+def test_lttb_conserva_pico():
+    x, y = serie(canales=1)
+    y[1234] = 1e3
+    assert 1234 in lttb(x, y, 50)[0]
+
+
+def test_minmax_conserva_extremos():
+    x, y = serie()
+    indices = minmax(x, y, 100)
+    assert indices.shape == (3, 100)
+    for canal in range(3):
+        assert y[:, canal].argmax() in indices[canal]
+        assert y[:, canal].argmin() in indices[canal]
+    assert (np.diff(indices, axis=1) >= 0).all()
+
+
+def test_pocos_puntos_devuelve_todo():
+    x, y = serie(n=20)
+    assert (lttb(x, y, 50) == np.arange(20)).all()
+    assert (minmax(x, y, 50) == np.arange(20)).all()
+
+
+def test_algoritmo_desconocido():
+    x, y = serie(n=20)
+    with pytest.raises(ValueError):
+        submuestrear(x, y, 10, 'media')